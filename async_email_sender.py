@@ -0,0 +1,306 @@
+# async_email_sender.py
+"""
+asyncio delivery backend: a small SMTP client on asyncio streams that keeps one
+message in flight on each of several connections from a single event loop
+thread, with a timeout per message. Failures are raised as the same smtplib
+exception types the blocking backend raises, so callers handle both alike.
+
+AsyncSMTPPool offers the blocking pool's send_message()/quit(), so the existing
+send_single_email works with it unchanged. The pipeline does not go through those
+blocking calls: it submits each payslip's coroutine to the pool's event loop
+(submit), so as many messages as the pool has sessions (ASYNC_MAX_IN_FLIGHT) are
+in flight at once, however many SEND_WORKERS there are. send_payslips() does the
+same for async callers that want every result gathered per recipient.
+"""
+import asyncio
+import base64
+import re
+import smtplib
+import ssl
+import threading
+import time
+from email.utils import getaddresses
+import metrics
+from email_config import SMTP_SERVERS, SMTP_TIMEOUT, SMTP_IDLE_CHECK, SMTP_MESSAGE_TIMEOUT
+from email_sender import _RateLimiter, build_payslip_message, detect_provider
+
+_LEADING_DOT = re.compile(rb"^\.", re.MULTILINE)
+
+class AsyncSMTPSession:
+    """One SMTP connection driven with asyncio streams."""
+    def __init__(self, server_config, timeout=SMTP_TIMEOUT):
+        self.server_config = server_config
+        self.timeout = timeout
+        self.extensions = {}
+        self.last_used = time.monotonic()
+        self._reader = None
+        self._writer = None
+
+    @property
+    def closed(self):
+        return self._writer is None or self._writer.is_closing()
+
+    async def _read_reply(self):
+        """Reads a (possibly multi-line) reply and returns (code, text)."""
+        lines = []
+        while True:
+            try:
+                line = await asyncio.wait_for(self._reader.readline(), self.timeout)
+            except asyncio.TimeoutError:
+                self.close()
+                raise smtplib.SMTPServerDisconnected("Timed out waiting for the server")
+            if not line:
+                self.close()
+                raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+            lines.append(line[4:].strip().decode("utf-8", "replace"))
+            if line[3:4] != b"-":
+                return int(line[:3]), "\n".join(lines)
+
+    async def command(self, line, expect=(250,), error=smtplib.SMTPResponseException):
+        """Sends one command and returns its reply, raising `error` for any reply code not in expect."""
+        self._writer.write(line.encode("utf-8") + b"\r\n")
+        await self._writer.drain()
+        code, text = await self._read_reply()
+        if code not in expect:
+            raise error(code, text)
+        return code, text
+
+    async def _ehlo(self):
+        _, text = await self.command("EHLO localhost")
+        self.extensions = {}
+        for feature in text.split("\n")[1:]:
+            name, _, params = feature.partition(" ")
+            self.extensions[name.upper()] = params.upper()
+
+    async def connect(self, sender_email, sender_password):
+        """Opens the connection, with STARTTLS and login unless the SMTP_SERVERS entry disables them."""
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.server_config['server'], self.server_config['port']), self.timeout)
+        code, text = await self._read_reply()
+        if code != 220:
+            raise smtplib.SMTPConnectError(code, text)
+        await self._ehlo()
+        if self.server_config.get('starttls', True):
+            await self.command("STARTTLS", expect=(220,))
+            await self._writer.start_tls(ssl.create_default_context(), server_hostname=self.server_config['server'])
+            await self._ehlo()
+        if self.server_config.get('login', True):
+            await self._login(sender_email, sender_password)
+        self.last_used = time.monotonic()
+
+    async def _login(self, username, password):
+        if "PLAIN" in self.extensions.get("AUTH", "PLAIN"):
+            token = base64.b64encode(f"\0{username}\0{password}".encode("utf-8")).decode("ascii")
+            await self.command(f"AUTH PLAIN {token}", expect=(235,), error=smtplib.SMTPAuthenticationError)
+        else:
+            await self.command("AUTH LOGIN", expect=(334,), error=smtplib.SMTPAuthenticationError)
+            await self.command(base64.b64encode(username.encode("utf-8")).decode("ascii"), expect=(334,),
+                               error=smtplib.SMTPAuthenticationError)
+            await self.command(base64.b64encode(password.encode("utf-8")).decode("ascii"), expect=(235,),
+                               error=smtplib.SMTPAuthenticationError)
+
+    async def send(self, from_addr, to_addrs, data):
+        """Sends one message (CRLF-terminated bytes) like smtplib.SMTP.sendmail."""
+        try:
+            await self.command(f"MAIL FROM:<{from_addr}>")
+        except smtplib.SMTPResponseException as e:
+            raise smtplib.SMTPSenderRefused(e.smtp_code, e.smtp_error, from_addr)
+        refused = {}
+        for recipient in to_addrs:
+            try:
+                await self.command(f"RCPT TO:<{recipient}>", expect=(250, 251))
+            except smtplib.SMTPResponseException as e:
+                refused[recipient] = (e.smtp_code, e.smtp_error)
+        if len(refused) == len(to_addrs):
+            await self.command("RSET")
+            raise smtplib.SMTPRecipientsRefused(refused)
+        await self.command("DATA", expect=(354,), error=smtplib.SMTPDataError)
+        data = _LEADING_DOT.sub(b"..", data)
+        if not data.endswith(b"\r\n"):
+            data += b"\r\n"
+        self._writer.write(data + b".\r\n")
+        await self._writer.drain()
+        code, text = await self._read_reply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, text)
+        self.last_used = time.monotonic()
+        return refused
+
+    async def is_alive(self):
+        if self.closed:
+            return False
+        if time.monotonic() - self.last_used < SMTP_IDLE_CHECK:
+            return True
+        try:
+            await self.command("NOOP")
+            return True
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    async def quit(self):
+        if not self.closed:
+            try:
+                await self.command("QUIT", expect=(221,))
+            except (smtplib.SMTPException, OSError):
+                pass
+        self.close()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._writer = None
+
+def _envelope(msg):
+    """Sender, recipients and wire bytes of an email.message.Message, as smtplib.send_message derives them."""
+    from_addr = getaddresses([msg['Sender'] or msg['From']])[0][1]
+    to_addrs = [address for _, address in getaddresses(msg.get_all('To', []) + msg.get_all('Cc', []) + msg.get_all('Bcc', []))]
+    del msg['Bcc']
+    return from_addr, to_addrs, msg.as_bytes(policy=msg.policy.clone(linesep="\r\n"))
+
+class AsyncSMTPPool:
+    """
+    `size` SMTP sessions served by one event loop running on a background thread.
+    Each message borrows an idle session, so up to `size` messages are in flight at
+    once; a message that takes longer than SMTP_MESSAGE_TIMEOUT fails on its own
+    and its session is replaced. Dropped sessions are reopened and the message
+    retried once, and sending is throttled to the provider's max_per_minute.
+    """
+    def __init__(self, sender_email, sender_password, size=4, provider=None, message_timeout=None):
+        self.provider = provider or detect_provider(sender_email)
+        self.server_config = SMTP_SERVERS[self.provider]
+        self.size = size
+        self.message_timeout = message_timeout or SMTP_MESSAGE_TIMEOUT
+        self.reconnects = 0
+        self._sender_email = sender_email
+        self._sender_password = sender_password
+        self._limiter = _RateLimiter(self.server_config.get('max_per_minute', 0))
+        self._idle = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def submit(self, coroutine):
+        """Schedules a coroutine on the pool's loop from any other thread; returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def _run(self, coroutine):
+        """Runs a coroutine on the pool's loop from any other thread and waits for its result."""
+        return self.submit(coroutine).result()
+
+    async def _connect(self):
+        session = AsyncSMTPSession(self.server_config)
+        try:
+            await session.connect(self._sender_email, self._sender_password)
+        except BaseException:
+            session.close()
+            raise
+        return session
+
+    async def _open(self):
+        self._idle = asyncio.Queue()
+        results = await asyncio.gather(*(self._connect() for _ in range(self.size)), return_exceptions=True)
+        for result in results:
+            self._idle.put_nowait(None if isinstance(result, BaseException) else result)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            raise errors[0]
+
+    def open(self):
+        """Opens every session up front, so a login problem shows before any payslip is sent."""
+        self._run(self._open())
+
+    async def _reconnect(self, session):
+        if session is not None:
+            session.close()
+        self.reconnects += 1
+        metrics.count("smtp_reconnects")
+        return await self._connect()
+
+    async def send_message_async(self, msg):
+        """Sends an email.message.Message on a free session; raises smtplib exceptions on failure."""
+        from_addr, to_addrs, data = _envelope(msg)
+        session = await self._idle.get()
+        try:
+            if session is None or not await session.is_alive():
+                session = await self._reconnect(session)
+            delay = self._limiter.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                return await asyncio.wait_for(session.send(from_addr, to_addrs, data), self.message_timeout)
+            except asyncio.TimeoutError:
+                session.close() # Mid-transaction state is unknown; never reuse the session
+                raise smtplib.SMTPServerDisconnected(f"Message not accepted within {self.message_timeout}s")
+            except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+                print(f"SMTP session dropped ({e}). Reconnecting and retrying once.")
+                session = await self._reconnect(session)
+                return await asyncio.wait_for(session.send(from_addr, to_addrs, data), self.message_timeout)
+        except asyncio.TimeoutError:
+            if session is not None:
+                session.close()
+            raise smtplib.SMTPServerDisconnected(f"Message not accepted within {self.message_timeout}s")
+        finally:
+            self._idle.put_nowait(None if session is None or session.closed else session)
+
+    def send_message(self, msg):
+        """Blocking send for callers on other threads, like smtplib.SMTP.send_message."""
+        return self._run(self.send_message_async(msg))
+
+    async def deliver_payslip_async(self, sender_email, recipient_email, employee_name, period,
+                                    pdf_path=None, pdf_bytes=None, pdf_name=None):
+        """Async counterpart of email_sender.deliver_payslip: raises smtplib exceptions on failure."""
+        with metrics.timer("mime_build_seconds"):
+            # Building and base64-encoding the attachment is CPU work; keep it off the event loop
+            msg = await asyncio.to_thread(build_payslip_message, sender_email, recipient_email, employee_name,
+                                          period, pdf_path, pdf_bytes, pdf_name)
+        with metrics.timer("smtp_send_seconds"):
+            await self.send_message_async(msg)
+        metrics.count("emails_sent")
+        if metrics.enabled():
+            metrics.count("attachment_bytes", len(msg.get_payload()[-1].get_payload()))
+        print(f"Successfully sent email to {recipient_email}")
+
+    async def send_single_email_async(self, sender_email, recipient_email, employee_name, period,
+                                      pdf_path=None, pdf_bytes=None, pdf_name=None):
+        """Async counterpart of email_sender.send_single_email, with the same (ok, message) result."""
+        try:
+            await self.deliver_payslip_async(sender_email, recipient_email, employee_name, period, pdf_path, pdf_bytes, pdf_name)
+            return True, "Email sent successfully!"
+        except Exception as e:
+            metrics.count("send_errors")
+            error_msg = f"Failed to send email to {recipient_email}: {e}"
+            print(error_msg)
+            return False, error_msg
+
+    async def _send_payslips(self, sender_email, payslips, max_in_flight):
+        limit = asyncio.Semaphore(max_in_flight)
+        async def send_one(payslip):
+            async with limit:
+                return payslip['recipient_email'], await self.send_single_email_async(sender_email, **payslip)
+        return dict(await asyncio.gather(*(send_one(payslip) for payslip in payslips)))
+
+    def send_payslips(self, sender_email, payslips, max_in_flight=None):
+        """
+        Sends many payslips concurrently and returns {recipient_email: (ok, message)}.
+        Each payslip is a dict of send_single_email's keyword arguments (recipient_email,
+        employee_name, period and pdf_path or pdf_bytes/pdf_name). max_in_flight bounds
+        how many messages are built and held at once (default: the pool size).
+        """
+        return self._run(self._send_payslips(sender_email, payslips, max_in_flight or self.size))
+
+    async def _quit(self):
+        while self._idle is not None and not self._idle.empty():
+            session = self._idle.get_nowait()
+            if session is not None:
+                await session.quit()
+
+    def quit(self):
+        """Closes every session and stops the event loop."""
+        if self._loop.is_closed():
+            return
+        try:
+            self._run(self._quit())
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
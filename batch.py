@@ -0,0 +1,203 @@
+# batch.py
+"""
+Batch runs: several workbooks, or every sheet of them, in one process. The sheets
+are parsed concurrently and then all of their payslips go through a single pipeline
+run, so fonts, the page template, render workers and SMTP sessions are set up once
+for the whole batch.
+
+Each workbook (or, with all_sheets, each sheet) is an entity: its payslips are
+written to OUTPUT_ROOT/<entity>/Payslips_<Mon_YYYY> and it gets its own summary.
+With stream_batch instead of load_batch, the sheets are read in chunks as the
+pipeline consumes them, so rendering starts on the first rows of the first sheet.
+"""
+from pathlib import Path
+import calculations
+import data_handler
+import pdf_generator
+import pipeline
+
+WORKBOOK_SUFFIXES = (".xlsx", ".xlsm") # openpyxl formats; legacy .xls would need xlrd
+
+def expand_inputs(paths):
+    """Returns the workbooks to process: files as given and every workbook directly inside a directory."""
+    workbooks = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            # "~$" files are the lock files Excel leaves next to open workbooks
+            found = sorted(entry for entry in path.iterdir()
+                           if entry.suffix.lower() in WORKBOOK_SUFFIXES and not entry.name.startswith("~$"))
+        else:
+            found = [path]
+        workbooks += [workbook for workbook in found if workbook not in workbooks]
+    return workbooks
+
+def _new_entity(workbook, sheet, entity):
+    return {
+        "workbook": str(workbook), "sheet": sheet, "entity": entity, "error": None,
+        "rows": 0, "invalid_rows": [], "total": 0, "generated": 0, "sent": 0, "skipped": 0,
+        "cancelled": 0, "failed": [], "dead_letter_files": [], "output_dirs": [],
+    }
+
+def list_entities(workbooks, all_sheets=False):
+    """
+    Returns one summary dict per entity, filled in as the batch runs. The entity is
+    the workbook's file name without its extension or, with all_sheets, <workbook>/<sheet>
+    for each sheet of a workbook that has several. Workbooks that share a file name
+    get ' (2)', ' (3)'... added.
+    """
+    entities, used = [], set()
+    for workbook in map(Path, workbooks):
+        name, count = workbook.stem, 1
+        while name in used:
+            count += 1
+            name = f"{workbook.stem} ({count})"
+        used.add(name)
+        if not all_sheets:
+            entities.append(_new_entity(workbook, None, name))
+            continue
+        try:
+            sheets = data_handler.sheet_names(workbook)
+            if len(sheets) == 1:
+                entities.append(_new_entity(workbook, sheets[0], name))
+            else:
+                entities += [_new_entity(workbook, sheet, f"{name}/{sheet}") for sheet in sheets]
+        except Exception as e:
+            entities.append(_new_entity(workbook, None, name))
+            entities[-1]["error"] = f"Failed to read the sheets of {workbook}: {e}"
+            print(entities[-1]["error"])
+    return entities
+
+def _prepare_entity(entity, employee_df, on_invalid):
+    """Validates one entity's sheet. Returns its valid rows tagged with the entity, or None (with entity["error"] set)."""
+    label = entity["entity"]
+    if employee_df is None:
+        entity["error"] = "Failed to load or read the Excel file."
+        return None
+    missing_essential = data_handler.missing_essential_columns(employee_df)
+    if missing_essential:
+        entity["error"] = f"Essential columns are missing: {', '.join(missing_essential)}"
+        return None
+
+    employee_df, entity["invalid_rows"] = data_handler.normalize_employee_data(employee_df)
+    entity["rows"] = len(employee_df)
+    for problem in data_handler.format_invalid_rows(entity["invalid_rows"]):
+        print(f"[{label}] {problem}")
+    if entity["invalid_rows"] and on_invalid == "abort":
+        entity["error"] = f"{len(entity['invalid_rows'])} rows have missing or invalid essential data."
+        return None
+    valid_employee_df = employee_df.drop(index=[invalid["row"] for invalid in entity["invalid_rows"]])
+    if valid_employee_df.empty:
+        entity["error"] = "No valid employee records found to process."
+        return None
+    return valid_employee_df.assign(Entity=label)
+
+def load_batch(entities, on_invalid="abort", workers=None):
+    """
+    Parses every entity's sheet concurrently and validates it. Returns the valid
+    employee rows of each entity, in order (None where the entity cannot be processed;
+    its "error" says why). With on_invalid="abort", an entity with invalid rows is
+    left out as a whole; with "skip" only those rows are.
+    """
+    pending = [entity for entity in entities if entity["error"] is None]
+    loaded = data_handler.load_employee_workbooks(
+        [(entity["workbook"], 0 if entity["sheet"] is None else entity["sheet"]) for entity in pending], workers)
+    employee_dfs = {id(entity): _prepare_entity(entity, employee_df, on_invalid) for entity, employee_df in zip(pending, loaded)}
+    for entity in entities:
+        if entity["error"]:
+            print(f"[{entity['entity']}] Not processed: {entity['error']}")
+    return [employee_dfs.get(id(entity)) for entity in entities]
+
+def salary_jobs(employee_df):
+    """The (employee_row, salary_details) jobs of a loaded and validated sheet."""
+    salary_by_index = calculations.calculate_salary_batch(employee_df).to_dict('index')
+    for index, employee_row in employee_df.iterrows():
+        yield employee_row, salary_by_index[index]
+
+def _stream_jobs(entity, stream):
+    def chunks():
+        for chunk in stream:
+            entity["rows"] += len(chunk)
+            yield chunk.assign(Entity=entity["entity"])
+    return pipeline.iter_salary_jobs(chunks(), entity["invalid_rows"])
+
+def stream_batch(entities):
+    """
+    Streaming counterpart of load_batch, for on_invalid="skip": opens every entity's
+    sheet and checks its header, then returns (entity_jobs, streams). entity_jobs holds
+    each entity's (employee_row, salary_details) jobs, read lazily in chunks (None where
+    the entity cannot be processed; its "error" says why). Rows with missing or invalid
+    data are left out and listed in the entity's invalid_rows as they are reached.
+    Close the streams once the run is over.
+    """
+    entity_jobs, streams = [], []
+    for entity in entities:
+        stream = None
+        if entity["error"] is None:
+            try:
+                stream = data_handler.EmployeeStream(entity["workbook"], 0 if entity["sheet"] is None else entity["sheet"])
+            except Exception as e:
+                entity["error"] = f"Failed to load or read the Excel file: {e}"
+        if stream is not None:
+            missing_essential = data_handler.missing_essential_columns(stream.header)
+            if missing_essential:
+                entity["error"] = f"Essential columns are missing: {', '.join(missing_essential)}"
+                stream.close()
+                stream = None
+        if entity["error"]:
+            print(f"[{entity['entity']}] Not processed: {entity['error']}")
+        if stream is not None:
+            streams.append(stream)
+        entity_jobs.append(None if stream is None else _stream_jobs(entity, stream))
+    return entity_jobs, streams
+
+def run_batch(entities, entity_jobs, send_fn, **pipeline_options):
+    """
+    Renders and sends the payslips of every entity in a single pipeline.run_pipeline
+    call (pipeline_options are passed on to it), then fills in each entity's summary.
+    entity_jobs holds each entity's (employee_row, salary_details) jobs: salary_jobs of
+    a loaded sheet or a stream from stream_batch, None where the entity is not processed.
+    Returns the pipeline results per processed entity.
+    """
+    batch = [(entity, jobs) for entity, jobs in zip(entities, entity_jobs) if jobs is not None]
+    periods = {entity["entity"]: set() for entity, _ in batch}
+
+    def all_jobs():
+        for entity, jobs in batch:
+            for employee_row, salary_details in jobs:
+                periods[entity["entity"]].add(employee_row['Period'])
+                yield employee_row, salary_details
+    results = pipeline.run_pipeline(all_jobs(), send_fn, **pipeline_options) if batch else []
+
+    results_by_entity = {entity["entity"]: [] for entity, _ in batch}
+    for result in results:
+        results_by_entity[result["entity"]].append(result)
+    for entity, _ in batch:
+        entity.update(pipeline.summarize_results(results_by_entity[entity["entity"]]))
+        entity["output_dirs"] = sorted({str(pdf_generator.payslip_output_dir(period, entity["entity"]).resolve())
+                                        for period in periods[entity["entity"]]})
+    return [results_by_entity[entity["entity"]] for entity, _ in batch]
+
+def summarize_batch(entities):
+    """Totals over every entity, plus the entities that could not be processed."""
+    return {
+        "entities": len(entities),
+        "total": sum(entity["total"] for entity in entities),
+        "generated": sum(entity["generated"] for entity in entities),
+        "sent": sum(entity["sent"] for entity in entities),
+        "skipped": sum(entity["skipped"] for entity in entities),
+        "cancelled": sum(entity["cancelled"] for entity in entities),
+        "failed": [f"[{entity['entity']}] {error}" for entity in entities for error in entity["failed"]],
+        "not_processed": [f"[{entity['entity']}] {entity['error']}" for entity in entities if entity["error"]],
+        "dead_letter_files": sorted({path for entity in entities for path in entity["dead_letter_files"]}),
+    }
+
+def format_batch_summary(entities):
+    """One line per entity for the console, e.g. 'acme/April: 120 of 122 payslips generated, 118 emailed'."""
+    lines = []
+    for entity in entities:
+        if entity["error"]:
+            lines.append(f"  {entity['entity']}: not processed ({entity['error']})")
+        else:
+            lines.append(f"  {entity['entity']}: {entity['generated']} of {entity['total']} payslips generated, "
+                         f"{entity['sent']} emailed, {entity['skipped']} skipped, {len(entity['failed'])} failed")
+    return "\n".join(lines)
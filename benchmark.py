@@ -0,0 +1,399 @@
+# benchmark.py
+"""
+Throughput benchmark for the payslip pipeline.
+
+Generates synthetic employee workbooks shaped like the real monthly file (the
+standard COLUMN_MAP headers below a 3-row preamble) and times each stage on its
+own: load, validate, calculate, render, MIME build and send. Emails go to a null
+SMTP sink on localhost, so nothing leaves the machine. Each size runs in a fresh
+process so its peak RSS is its own.
+
+Example:
+    python benchmark.py --sizes 100 1000 10000 100000 --output benchmark_report.json
+
+Rendering and sending are measured on the first --render-sample rows of each
+workbook (every row with --render-sample 0), since rendering 100k payslips takes
+hours. The JSON report goes to stdout (and --output); progress goes to stderr.
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from openpyxl import Workbook
+import config
+import data_handler
+import calculations
+import pdf_generator
+import email_sender
+from column_config import COLUMN_MAP
+from email_config import SMTP_SERVERS
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+REPORT_VERSION = 1
+BENCHMARK_SIZES = [100, 1000, 10000, 100000]
+DEFAULT_RENDER_SAMPLE = 200
+PROFILE_SIZE_SAMPLE = 20 # Rows rendered with every PDF profile to compare attachment sizes
+CHILD_POLL_SECONDS = 5 # How often the parent checks that a size's process is still alive
+# Salary components are derived by calculations.py, so the synthetic workbook leaves them out like the real one
+INPUT_FIELDS = [field for field in COLUMN_MAP if field not in ('Basic', 'HRA', 'Special_Allowance', 'EPF')]
+DEPARTMENTS = ['Engineering', 'Finance', 'Human Resources', 'Operations', 'Sales']
+LOCATIONS = ['Mumbai', 'Pune', 'Bengaluru', 'Hyderabad', 'Navi Mumbai']
+SENDER_EMAIL = "payroll@benchmark.invalid"
+
+# --- Synthetic workbooks ---
+def _synthetic_row(index, rng, period):
+    gross = round(rng.uniform(15000, 300000), 2)
+    values = {
+        'Employee_ID': f"EMP{index:06d}",
+        'Employee_Name': f"Employee {index}",
+        'Employee_Email': f"employee{index}@example.com",
+        'Department': rng.choice(DEPARTMENTS),
+        'Designation': rng.choice(['Associate', 'Engineer', 'Senior Engineer', 'Manager']),
+        'Location': rng.choice(LOCATIONS),
+        'Date_of_Joining': datetime.datetime(2010, 1, 1) + datetime.timedelta(days=rng.randrange(5000)),
+        'Bank_Name': rng.choice(['HDFC Bank', 'ICICI Bank', 'State Bank of India']),
+        'Bank_Account_No': str(rng.randrange(10**11, 10**12)),
+        'PAN_Number': f"ABCDE{index % 10000:04d}F",
+        'PF_Account_Number': f"MH/BOM/{index:07d}",
+        'ESI_Number': str(rng.randrange(10**9, 10**10)),
+        'UAN_Number': str(rng.randrange(10**11, 10**12)),
+        'Period': period,
+        'Days_Worked': 30,
+        'LOP_Days': 0,
+        'Gross_Salary': gross,
+        'Income_Tax': round(gross * rng.uniform(0, 0.2), 2),
+    }
+    return [values.get(field) for field in INPUT_FIELDS]
+
+def write_synthetic_workbook(filepath, rows, seed=0):
+    """Writes a workbook of `rows` synthetic employees with the standard headers on row HEADER_ROW."""
+    rng = random.Random(seed)
+    period = datetime.datetime(2025, 4, 1)
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Salary")
+    preamble = [[config.COMPANY_NAME], ["Monthly Salary Sheet"], [f"Period: {period:%B %Y}"]]
+    for line in preamble[:data_handler.HEADER_ROW]:
+        sheet.append(line)
+    sheet.append([COLUMN_MAP[field][0] for field in INPUT_FIELDS])
+    for index in range(rows):
+        sheet.append(_synthetic_row(index, rng, period))
+    workbook.save(filepath)
+
+# --- Null SMTP sink ---
+class _NullSMTPHandler(socketserver.StreamRequestHandler):
+    """Speaks just enough SMTP to accept and discard messages."""
+    def reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        self.server.record_connection()
+        self.reply("220 benchmark null SMTP sink")
+        for line in self.rfile:
+            command = line[:4].upper()
+            if command in (b"EHLO", b"HELO"):
+                self.reply("250 benchmark")
+            elif command == b"MAIL":
+                self.server.begin_message()
+                self.reply("250 OK")
+            elif command == b"DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                size = 0
+                for data_line in self.rfile:
+                    if data_line == b".\r\n":
+                        break
+                    size += len(data_line)
+                if self.server.reply_delay:
+                    time.sleep(self.server.reply_delay) # Stands in for a real server's processing time
+                self.server.record_message(size)
+                self.reply("250 OK: queued")
+            elif command == b"QUIT":
+                self.reply("221 Bye")
+                return
+            else: # RCPT, RSET, NOOP
+                self.reply("250 OK")
+
+class NullSMTPServer(socketserver.ThreadingTCPServer):
+    """
+    Threaded SMTP server on a free localhost port that only counts what it receives.
+    Each message can be held for reply_delay seconds before it is accepted; peak_in_flight
+    is the most messages that were between MAIL FROM and their final reply at once.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, reply_delay=0):
+        super().__init__(("localhost", 0), _NullSMTPHandler)
+        self.port = self.server_address[1]
+        self.reply_delay = reply_delay
+        self.connections = 0
+        self.messages = 0
+        self.bytes_received = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._lock = threading.Lock()
+
+    def record_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    def begin_message(self):
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def record_message(self, size):
+        with self._lock:
+            self.in_flight -= 1
+            self.messages += 1
+            self.bytes_received += size
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+# --- Measurement ---
+def _stage(rows, seconds, **extra):
+    return {"rows": rows, "seconds": round(seconds, 4),
+            "rows_per_second": round(rows / seconds, 1) if seconds > 0 else None, **extra}
+
+def _windows_peak_rss_bytes():
+    """Peak working set of this process in bytes, from GetProcessMemoryInfo (Windows has no resource module)."""
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+    kernel32, psapi = ctypes.WinDLL("kernel32"), ctypes.WinDLL("psapi")
+    kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+    psapi.GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.POINTER(PROCESS_MEMORY_COUNTERS), wintypes.DWORD]
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    if not psapi.GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+        return None
+    return counters.PeakWorkingSetSize
+
+def _peak_rss_mb(children=False):
+    """
+    Peak resident set size in MB of this process or, with children=True, its largest
+    finished child. On Windows only this process's own peak is available.
+    """
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1) # bytes on macOS, KB elsewhere
+    if children or sys.platform != "win32":
+        return None
+    try:
+        peak = _windows_peak_rss_bytes()
+    except (OSError, AttributeError):
+        return None
+    return round(peak / (1024 * 1024), 1) if peak else None
+
+def benchmark_workbook(filepath, rows, render_sample, render_workers, send_workers, engine, transport="smtp"):
+    """Runs every stage once over the workbook and returns the per-stage timings."""
+    stages = {}
+
+    started = time.perf_counter()
+    employee_df = data_handler.load_employee_data(filepath, use_cache=False)
+    stages["load"] = _stage(rows, time.perf_counter() - started)
+    if employee_df is None:
+        raise RuntimeError(f"Could not load {filepath}")
+
+    started = time.perf_counter()
+    missing_essential = data_handler.missing_essential_columns(employee_df)
+    if missing_essential:
+        raise RuntimeError(f"Synthetic workbook is missing columns: {missing_essential}")
+    employee_df, invalid_rows = data_handler.normalize_employee_data(employee_df)
+    stages["validate"] = _stage(rows, time.perf_counter() - started, invalid_rows=len(invalid_rows))
+
+    started = time.perf_counter()
+    salary_by_index = calculations.calculate_salary_batch(employee_df).to_dict('index')
+    stages["calculate"] = _stage(rows, time.perf_counter() - started)
+
+    sample_df = employee_df.head(render_sample) if render_sample else employee_df
+    sample_rows = [employee_row for _, employee_row in sample_df.iterrows()]
+    sample_salaries = [salary_by_index[index] for index in sample_df.index]
+
+    pdf_generator.register_fonts()
+    started = time.perf_counter()
+    rendered = pdf_generator.create_payslips_parallel(sample_rows, sample_salaries, workers=render_workers,
+                                                      engine=engine, in_memory=True)
+    pdf_bytes = sum(len(pdf) for pdf, _, _ in rendered)
+    stages["render"] = _stage(len(rendered), time.perf_counter() - started,
+                              avg_pdf_bytes=round(pdf_bytes / len(rendered)) if rendered else 0)
+    stages["attachment_size"] = pdf_generator.profile_size_report(sample_rows[:PROFILE_SIZE_SAMPLE],
+                                                                  sample_salaries[:PROFILE_SIZE_SAMPLE], engine)
+
+    started = time.perf_counter()
+    for employee_row, (pdf, pdf_name, _) in zip(sample_rows, rendered):
+        email_sender.build_payslip_message(SENDER_EMAIL, employee_row['Employee_Email'], employee_row['Employee_Name'],
+                                           employee_row['Period'], pdf_bytes=pdf, pdf_name=pdf_name)
+    stages["mime_build"] = _stage(len(rendered), time.perf_counter() - started)
+
+    with contextlib.ExitStack() as stack:
+        if transport == "smtp":
+            sink = stack.enter_context(NullSMTPServer())
+            SMTP_SERVERS["benchmark"] = {**SMTP_SERVERS["local"], "server": "localhost", "port": sink.port}
+            pool = email_sender.connect_pool(SENDER_EMAIL, "", size=send_workers, provider="benchmark")
+        else:
+            pool = email_sender.connect_transport(SENDER_EMAIL, "", size=send_workers, transport=transport,
+                                                  outbox=Path(config.OUTPUT_ROOT) / f"outbox_{transport}")
+        if pool is None:
+            raise RuntimeError(f"Could not open the {transport} transport")
+        try:
+            def send(job):
+                employee_row, (pdf, pdf_name, _) = job
+                return email_sender.send_single_email(pool, SENDER_EMAIL, employee_row['Employee_Email'], employee_row['Employee_Name'],
+                                                      employee_row['Period'], pdf_bytes=pdf, pdf_name=pdf_name)[0]
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=send_workers) as senders:
+                sent = sum(senders.map(send, zip(sample_rows, rendered)))
+            stages["send"] = _stage(len(rendered), time.perf_counter() - started, sent=sent, transport=transport,
+                                    bytes_sent=sink.bytes_received if transport == "smtp" else pool.bytes_delivered)
+        finally:
+            pool.quit()
+    return stages
+
+def _run_size(rows, workdir, options, results):
+    """Body of the per-size child process: generates (or reuses) the workbook and benchmarks it."""
+    filepath = Path(workdir) / f"employees_{rows}_seed{options['seed']}.xlsx"
+    run = {"rows": rows, "workbook": str(filepath)}
+    # The child may be spawned (Windows, macOS) rather than forked, so it starts from the
+    # config module's defaults: every setting the run depends on travels in options
+    config.PDF_PROFILE = options['pdf_profile']
+    if options['latency_ms'] is not None:
+        config.MAIL_LATENCY_MS = options['latency_ms']
+    config.OUTPUT_ROOT = workdir # Payslips are rendered in memory; anything written lands in the scratch folder
+    config.PDF_STORE = False # Every run must really render, not reuse slips stored by an earlier run
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            if not filepath.exists():
+                started = time.perf_counter()
+                write_synthetic_workbook(filepath, rows, seed=options['seed'])
+                run["generate_seconds"] = round(time.perf_counter() - started, 4)
+            run["workbook_bytes"] = filepath.stat().st_size
+            run["stages"] = benchmark_workbook(filepath, rows, options['render_sample'], options['render_workers'],
+                                               options['send_workers'], options['engine'], options['transport'])
+        except Exception as e:
+            run["error"] = str(e)
+    run["peak_rss_mb"] = _peak_rss_mb()
+    run["peak_render_worker_rss_mb"] = _peak_rss_mb(children=True)
+    results.put(run)
+
+def _collect_run(rows, worker, results):
+    """Waits for the child's result; a child that dies without one (OOM kill, segfault) marks the size as failed."""
+    while True:
+        try:
+            return results.get(timeout=CHILD_POLL_SECONDS)
+        except queue.Empty:
+            if worker.is_alive():
+                continue
+        try: # The child may have put its result just before exiting
+            return results.get(timeout=1)
+        except queue.Empty:
+            worker.join()
+            return {"rows": rows, "error": f"benchmark process exited with code {worker.exitcode} without a result"}
+
+def run_benchmark(sizes, workdir, render_sample=DEFAULT_RENDER_SAMPLE, render_workers=None, send_workers=None, engine=None, seed=0,
+                  transport="smtp"):
+    """Benchmarks every workbook size in its own process and returns the JSON-ready report."""
+    options = {
+        "render_sample": render_sample,
+        "render_workers": pdf_generator.resolve_render_workers(render_workers),
+        "send_workers": send_workers or config.SEND_WORKERS,
+        "engine": engine or config.RENDER_ENGINE,
+        "pdf_profile": config.PDF_PROFILE,
+        "transport": transport,
+        "latency_ms": config.MAIL_LATENCY_MS if transport != "smtp" else None,
+        "seed": seed,
+    }
+    runs = []
+    for rows in sizes:
+        print(f"Benchmarking {rows} employees...", file=sys.stderr)
+        results = multiprocessing.Queue()
+        worker = multiprocessing.Process(target=_run_size, args=(rows, workdir, options, results))
+        worker.start()
+        run = _collect_run(rows, worker, results) # Read before join, so a large result cannot block the child
+        worker.join()
+        if "error" in run:
+            print(f"Benchmark of {rows} employees failed: {run['error']}", file=sys.stderr)
+        runs.append(run)
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "report_version": REPORT_VERSION,
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": options,
+        "runs": runs,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the payslip pipeline on synthetic workbooks.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=BENCHMARK_SIZES, help="Employee counts to benchmark")
+    parser.add_argument("--render-sample", type=int, default=DEFAULT_RENDER_SAMPLE,
+                        help="Rows rendered and sent per size (0 = every row)")
+    parser.add_argument("--render-workers", type=int, help="PDF render processes (0 = one per CPU core)")
+    parser.add_argument("--send-workers", type=int, help="Concurrent SMTP sessions")
+    parser.add_argument("--engine", choices=["platypus", "canvas"], help="PDF render engine")
+    parser.add_argument("--pdf-profile", choices=["optimized", "standard"], help="PDF output profile for the render stage")
+    parser.add_argument("--transport", choices=["smtp", "maildir", "eml", "null"], default="smtp",
+                        help="Where the send stage delivers: a null SMTP server on localhost (smtp) or an offline transport")
+    parser.add_argument("--latency-ms", type=float, help="Delay the offline transports add to each message")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic data")
+    parser.add_argument("--workdir", help="Keep the generated workbooks here and reuse them on later runs")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args(argv)
+    if args.pdf_profile:
+        config.PDF_PROFILE = args.pdf_profile
+    if args.latency_ms is not None:
+        config.MAIL_LATENCY_MS = args.latency_ms
+
+    with contextlib.ExitStack() as stack:
+        workdir = args.workdir or stack.enter_context(tempfile.TemporaryDirectory(prefix="paygen_bench_"))
+        Path(workdir).mkdir(parents=True, exist_ok=True)
+        report = run_benchmark(args.sizes, workdir, args.render_sample, args.render_workers,
+                               args.send_workers, args.engine, args.seed, args.transport)
+
+    report_json = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as report_file:
+            report_file.write(report_json + "\n")
+    print(report_json)
+    return 1 if any("error" in run for run in report["runs"]) else 0
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -1,17 +1,64 @@
 # calculations.py
+from functools import lru_cache
+import numpy as np
+import pandas as pd
 from num2words import num2words
-from config import EPF_RATE, PROF_TAX
+import metrics
+import payroll_config
+from config import WORDS_CACHE_SIZE
 
-def convert_to_inr_words(num):
-    """Converts a number to Indian currency in words."""
-    rupees = int(num)
-    paise = round((num - rupees) * 100)
+# --- Indian numbering (lakh/crore) word tables ---
+_ONES = ["zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten",
+         "eleven", "twelve", "thirteen", "fourteen", "fifteen", "sixteen", "seventeen", "eighteen", "nineteen"]
+_TENS = ["", "", "twenty", "thirty", "forty", "fifty", "sixty", "seventy", "eighty", "ninety"]
+_WORDS_MAX = 10**10 # num2words' en_IN limit; anything larger is passed through to it
+
+def _below_thousand_words(n):
+    hundreds, rest = divmod(n, 100)
+    if rest < 20:
+        rest_words = _ONES[rest]
+    else:
+        tens, ones = divmod(rest, 10)
+        rest_words = _TENS[tens] + (f"-{_ONES[ones]}" if ones else "")
+    if not hundreds:
+        return rest_words
+    if not rest:
+        return f"{_ONES[hundreds]} hundred"
+    return f"{_ONES[hundreds]} hundred and {rest_words}"
+
+# Words for 0-999, the building block of every lakh/crore group
+_BELOW_THOUSAND = [_below_thousand_words(n) for n in range(1000)]
+
+def number_to_words_en_in(n):
+    """Spells a non-negative integer in Indian numbering, matching num2words(n, lang='en_IN')."""
+    if n < 1000:
+        return _BELOW_THOUSAND[n]
+    if n >= _WORDS_MAX:
+        return num2words(n, lang='en_IN')
+    crore, n = divmod(n, 10**7)
+    lakh, n = divmod(n, 10**5)
+    thousand, hundreds = divmod(n, 1000)
+
+    groups = []
+    if crore:
+        groups.append(f"{_BELOW_THOUSAND[crore]} crore")
+    if lakh:
+        groups.append(f"{_BELOW_THOUSAND[lakh]} lakh")
+    if thousand:
+        groups.append(f"{_BELOW_THOUSAND[thousand]} thousand")
+    words = ", ".join(groups)
+    if hundreds:
+        words += (" and " if hundreds < 100 else ", ") + _BELOW_THOUSAND[hundreds]
+    return words
+
+@lru_cache(maxsize=WORDS_CACHE_SIZE)
+def _inr_words(rupees, paise):
     if rupees > 0:
-        words = f"{num2words(rupees, lang='en_IN')} rupees"
+        words = f"{number_to_words_en_in(rupees)} rupees"
     else:
         words = ""
     if paise > 0:
-        paise_words = num2words(paise, lang='en_IN')
+        paise_words = number_to_words_en_in(paise)
         if words:
             words += f" and {paise_words} paise"
         else:
@@ -20,22 +67,215 @@ def convert_to_inr_words(num):
         return "Zero Rupees Only"
     return words.title() + " Only"
 
+def convert_to_inr_words(num):
+    """Converts a number to Indian currency in words."""
+    rupees = int(num)
+    paise = round((num - rupees) * 100)
+    # Memoized on the amount split into rupees and paise, so a pay band sharing
+    # the same net amount is only spelled out once
+    return _inr_words(rupees, paise)
+
+def convert_to_inr_words_batch(amounts):
+    """Converts a whole column of amounts to words, spelling each distinct value once."""
+    amounts = pd.Series(amounts, dtype=float)
+    words_by_amount = {amount: convert_to_inr_words(float(amount)) for amount in amounts.unique()}
+    return amounts.map(words_by_amount).tolist()
+
+# --- Payroll rules ---
+PAYSLIP_EARNINGS = ('basic', 'hra', 'special_allowance') # Earnings the payslip shows, so the rules must define them
+
+def _rule_key(value):
+    """Case- and space-insensitive form of a state or grade, as matched against the rules."""
+    return str(value).strip().casefold()
+
+_BLANK_RULE_KEYS = {"", "nan", "none", "n/a"} # Empty cells, as _rule_keys renders them; these use 'default' silently
+
+def _rule_keys(values):
+    """_rule_key for a whole column at once."""
+    return values.astype(str).str.strip().str.casefold()
+
+def _check_number(where, value, allow_none=False):
+    if value is None and allow_none:
+        return
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0 or value != value:
+        raise ValueError(f"{where} must be a non-negative number, got {value!r}")
+
+def _check_slabs(state, slabs):
+    if not slabs:
+        raise ValueError(f"PROF_TAX_SLABS['{state}'] has no slabs")
+    for start, tax in slabs:
+        _check_number(f"PROF_TAX_SLABS['{state}'] slab start", start)
+        _check_number(f"PROF_TAX_SLABS['{state}'] tax", tax)
+    starts = [start for start, _ in slabs]
+    if starts[0] != 0:
+        raise ValueError(f"PROF_TAX_SLABS['{state}'] must start at 0, not {starts[0]}")
+    if any(later <= earlier for earlier, later in zip(starts, starts[1:])):
+        raise ValueError(f"PROF_TAX_SLABS['{state}'] slabs must be in ascending order")
+
+def _compile_slabs(slabs):
+    """Turns [(from, tax), ...] into a lookup over a whole column of amounts via searchsorted."""
+    starts = np.array([start for start, _ in slabs], dtype=float)
+    taxes = np.array([tax for _, tax in slabs], dtype=float)
+    def lookup(amounts):
+        return taxes[np.clip(np.searchsorted(starts, amounts, side="right") - 1, 0, None)]
+    return lookup
+
+def _per_grade(grades, default, by_grade):
+    """The rule value for every row: the grade's override where there is one, else default (a scalar if none apply)."""
+    if grades is None or not by_grade:
+        return default
+    values = grades.map(by_grade)
+    if values.isna().all():
+        return default
+    return values.fillna(default).to_numpy(dtype=float)
+
+def compile_payroll_rules(earnings, epf, prof_tax_slabs, state_column=None, grade_column=None, grade_overrides=None):
+    """
+    Checks the declarative salary rules (see payroll_config.py) and compiles them into
+    a function evaluate(employee_df, gross) that applies them column-wise to the whole
+    table: earnings as shares of gross or earlier earnings, EPF with its wage ceiling,
+    and professional tax from per-state slabs (looked up with np.searchsorted), all
+    with per-grade overrides. Returns a dict of arrays, one per earning plus 'epf' and
+    'prof_tax'. Raises ValueError naming the first problem in the rules.
+    """
+    # --- Validation ---
+    missing = [name for name in PAYSLIP_EARNINGS if name not in earnings]
+    if missing:
+        raise ValueError(f"EARNINGS must define {', '.join(missing)} (shown on the payslip)")
+    known = ['gross']
+    for name, rule in earnings.items():
+        _check_number(f"EARNINGS['{name}'] rate", rule.get('rate'))
+        if rule.get('of') not in known:
+            raise ValueError(f"EARNINGS['{name}'] must be a share of one of {', '.join(known)}, not {rule.get('of')!r}")
+        known.append(name)
+    _check_number("EPF rate", epf.get('rate'))
+    _check_number("EPF wage_ceiling", epf.get('wage_ceiling'), allow_none=True)
+    if epf.get('of') not in known:
+        raise ValueError(f"EPF must be a share of one of {', '.join(known)}, not {epf.get('of')!r}")
+    if 'default' not in prof_tax_slabs:
+        raise ValueError("PROF_TAX_SLABS must have a 'default' entry")
+    for state, slabs in prof_tax_slabs.items():
+        _check_slabs(state, slabs)
+    grade_overrides = grade_overrides or {}
+    for grade, overrides in grade_overrides.items():
+        for name, fields in overrides.items():
+            allowed = ('rate', 'wage_ceiling') if name == 'epf' else ('rate',) if name in earnings else ()
+            if not allowed:
+                raise ValueError(f"GRADE_OVERRIDES['{grade}'] overrides unknown rule {name!r}")
+            for field, value in fields.items():
+                if field not in allowed:
+                    raise ValueError(f"GRADE_OVERRIDES['{grade}']['{name}'] can only change {' or '.join(allowed)}, not {field!r}")
+                _check_number(f"GRADE_OVERRIDES['{grade}']['{name}'] {field}", value, allow_none=field == 'wage_ceiling')
+
+    # --- Compilation: everything row-independent is resolved here, once ---
+    def by_grade(name, field):
+        """Grade key -> overridden value of one rule field (a ceiling of None means none)."""
+        values = {}
+        for grade, overrides in grade_overrides.items():
+            if field in overrides.get(name, {}):
+                value = overrides[name][field]
+                values[_rule_key(grade)] = np.inf if value is None else value
+        return values
+    earning_steps = [(name, rule['of'], rule['rate'], by_grade(name, 'rate')) for name, rule in earnings.items()]
+    epf_of, epf_rate, epf_rate_by_grade = epf['of'], epf['rate'], by_grade('epf', 'rate')
+    epf_ceiling = np.inf if epf.get('wage_ceiling') is None else epf['wage_ceiling']
+    epf_ceiling_by_grade = by_grade('epf', 'wage_ceiling')
+    default_slabs = _compile_slabs(prof_tax_slabs['default'])
+    state_slabs = {_rule_key(state): _compile_slabs(slabs) for state, slabs in prof_tax_slabs.items() if state != 'default'}
+    uses_grades = bool(grade_column and grade_overrides)
+    reported_states = set() # Unmatched states already reported, so each is reported once per run
+
+    def report_unmatched_states(states):
+        """Prints the states with no slabs of their own (they use 'default'); states is None if the sheet has no state column."""
+        unmatched = {None} if states is None else {state for state in set(states) if isinstance(state, str)} - state_slabs.keys() - _BLANK_RULE_KEYS
+        unmatched -= reported_states
+        if not unmatched:
+            return
+        reported_states.update(unmatched)
+        if None in unmatched:
+            print(f"PROF_TAX_SLABS has per-state slabs, but the sheet has no '{state_column}' column. Every employee uses the 'default' slabs.")
+            return
+        metrics.count("unmatched_states", len(unmatched))
+        print(f"No PROF_TAX_SLABS entry for {', '.join(sorted(map(repr, unmatched)))} in '{state_column}'. "
+              "Those employees use the 'default' slabs.")
+
+    def evaluate(employee_df, gross):
+        grades = _rule_keys(employee_df[grade_column]) if uses_grades and grade_column in employee_df.columns else None
+        amounts = {'gross': gross}
+        for name, of, rate, rate_by_grade in earning_steps:
+            amounts[name] = _per_grade(grades, rate, rate_by_grade) * amounts[of]
+
+        epf_wages = amounts[epf_of]
+        ceiling = _per_grade(grades, epf_ceiling, epf_ceiling_by_grade)
+        if np.any(np.isfinite(ceiling)):
+            epf_wages = np.minimum(epf_wages, ceiling)
+        amounts['epf'] = _round2(epf_wages * _per_grade(grades, epf_rate, epf_rate_by_grade))
+
+        prof_tax = default_slabs(gross)
+        if state_slabs and state_column not in employee_df.columns:
+            report_unmatched_states(None)
+        elif state_slabs:
+            states = _rule_keys(employee_df[state_column]).to_numpy()
+            report_unmatched_states(states)
+            for state, lookup in state_slabs.items():
+                in_state = states == state
+                if in_state.any():
+                    prof_tax[in_state] = lookup(gross[in_state])
+        amounts['prof_tax'] = prof_tax
+        del amounts['gross']
+        return amounts
+    return evaluate
+
+_payroll_rules = None
+
+def get_payroll_rules():
+    """Returns the rules from payroll_config.py, compiled on first use."""
+    global _payroll_rules
+    if _payroll_rules is None:
+        _payroll_rules = compile_payroll_rules(payroll_config.EARNINGS, payroll_config.EPF, payroll_config.PROF_TAX_SLABS,
+                                               payroll_config.STATE_COLUMN, payroll_config.GRADE_COLUMN,
+                                               payroll_config.GRADE_OVERRIDES)
+    return _payroll_rules
+
 def calculate_salary(employee_data):
-    """Calculates all salary components for a single employee."""
-    gross = float(employee_data["Gross_Salary"])
-    income_tax = float(employee_data["Income_Tax"])
-
-    basic = 0.50 * gross # Basic is 50% of Gross
-    hra = 0.40 * basic # HRA is 40% of Basic or 20% of Gross
-    special_allowance = 0.30 * gross # Special Allowance is 30% of Gross
-    
-    epf = round(basic * EPF_RATE, 2)
-    total_ded = epf + income_tax + PROF_TAX
+    """Calculates all salary components for a single employee, with the same rules as calculate_salary_batch."""
+    salary = _calculate_salary_frame(pd.DataFrame([dict(employee_data)])).iloc[0]
+    return {key: value.item() if isinstance(value, np.generic) else value for key, value in salary.items()}
+
+def _round2(values):
+    """Rounds an array to 2 decimals exactly like Python's built-in round(x, 2)."""
+    rounded = np.round(values, 2)
+    # np.round scales by 100 before rounding, which can tip values sitting right on
+    # a half-paisa the other way. Re-round only those few with the built-in round.
+    scaled = values * 100
+    near_half = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    for i in np.flatnonzero(near_half):
+        rounded[i] = round(float(values[i]), 2)
+    return rounded
+
+def calculate_salary_batch(employee_df):
+    """
+    Calculates salary components for every employee in the DataFrame at once.
+    Returns a DataFrame with the same index and the same keys as calculate_salary,
+    so row i of the result matches calculate_salary(employee_df.loc[i]).
+    """
+    with metrics.timer("calculate_seconds"):
+        salaries = _calculate_salary_frame(employee_df)
+    metrics.count("salaries_calculated", len(salaries))
+    return salaries
+
+def _calculate_salary_frame(employee_df):
+    gross = employee_df["Gross_Salary"].to_numpy(dtype=float)
+    income_tax = employee_df["Income_Tax"].to_numpy(dtype=float)
+
+    amounts = get_payroll_rules()(employee_df, gross)
+    total_ded = amounts["epf"] + income_tax + amounts["prof_tax"]
     net = gross - total_ded
-    net_in_words = convert_to_inr_words(net)
+    net_in_words = convert_to_inr_words_batch(net)
 
-    return {
-        "basic": basic, "hra": hra, "special_allowance": special_allowance, "gross": gross, 
-        "epf": epf, "income_tax": income_tax, "prof_tax": PROF_TAX, "total_ded": total_ded, 
+    earnings = {name: amounts.pop(name) for name in list(amounts) if name not in ("epf", "prof_tax")}
+    return pd.DataFrame({
+        **earnings, "gross": gross,
+        "epf": amounts["epf"], "income_tax": income_tax, "prof_tax": amounts["prof_tax"], "total_ded": total_ded,
         "net": net, "net_in_words": net_in_words
-    }
\ No newline at end of file
+    }, index=employee_df.index)
@@ -0,0 +1,310 @@
+# cli.py
+"""
+Headless batch mode: runs the same load -> validate -> calculate -> render -> send
+pipeline as main.py without tkinter, for cron jobs and scripted runs.
+
+Example:
+    python cli.py --input april.xlsx --output-dir /srv/payslips --credentials env --on-invalid skip
+
+Several workbooks, a folder of them or (with --all-sheets) every sheet run as one
+batch; see batch.py. --resend-dead-letters sends the payslips an earlier run could
+not deliver again; see retry_queue.py.
+
+Progress goes to stderr; a JSON summary of the run is printed to stdout.
+"""
+import time
+_STARTED = time.perf_counter() # Taken before any other import so startup_seconds covers them
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import sys
+import batch
+import config
+import data_handler
+import calculations
+import pdf_generator
+import email_sender
+import metrics
+import pipeline
+import retry_queue
+from email_config import SMTP_SERVERS, LOCAL_SENDER
+
+# --- Exit codes ---
+EXIT_OK = 0 # Every valid payslip was generated (and sent, unless --no-email)
+EXIT_PARTIAL = 1 # The run finished but some payslips failed to generate or send
+EXIT_USAGE = 2 # Bad arguments or credentials (also argparse's own code)
+EXIT_INPUT = 3 # The workbook could not be read, lacks essential columns or has invalid rows
+EXIT_SMTP = 4 # Could not connect or log in to the mail server
+EXIT_ERROR = 5 # Unexpected error
+
+ENV_EMAIL = "PAYGEN_SMTP_EMAIL"
+ENV_PASSWORD = "PAYGEN_SMTP_PASSWORD"
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate and email payslips without the GUI.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", nargs="+",
+                        help="Monthly employee Excel file(s), or folders of them; more than one runs as a batch")
+    source.add_argument("--resend-dead-letters", nargs="+", metavar="PATH",
+                        help="Send again the payslips listed in dead_letters.jsonl files, or in any found under these folders")
+    parser.add_argument("--all-sheets", action="store_true",
+                        help="Process every sheet of each workbook, one entity per sheet")
+    parser.add_argument("--output-dir", default=config.OUTPUT_ROOT, help="Folder that receives the Payslips_<Mon_YYYY> folders")
+    parser.add_argument("--credentials", default="env",
+                        help=f"Sender credential source: 'env' ({ENV_EMAIL}/{ENV_PASSWORD}), 'keyring' "
+                             "(saved by the desktop app) or 'file:PATH' (JSON with email and password)")
+    parser.add_argument("--on-invalid", choices=["abort", "skip"], default="abort",
+                        help="What to do with rows missing essential data (default: abort)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Read the workbooks in chunks and start on the first rows while the rest is read (needs --on-invalid skip)")
+    parser.add_argument("--no-email", action="store_true", help="Only generate the payslips")
+    parser.add_argument("--smtp-provider", choices=sorted(SMTP_SERVERS), help="Override the provider detected from the sender address")
+    parser.add_argument("--render-workers", type=int, help="PDF render processes (0 = one per CPU core)")
+    parser.add_argument("--send-workers", type=int, help="Concurrent SMTP sessions")
+    parser.add_argument("--send-backend", choices=["threads", "asyncio"], help="SMTP delivery backend")
+    parser.add_argument("--transport", choices=["smtp", "maildir", "eml", "null"],
+                        help="Mail transport (default: MAIL_TRANSPORT); the others deliver offline and need no credentials")
+    parser.add_argument("--outbox", help="Folder the maildir and eml transports write to (default: MAIL_OUTBOX)")
+    parser.add_argument("--latency-ms", type=float, help="Delay added to each message by the offline transports")
+    parser.add_argument("--engine", choices=["platypus", "canvas"], help="PDF render engine")
+    parser.add_argument("--pdf-profile", choices=["optimized", "standard"], help="PDF output profile (default: PDF_PROFILE)")
+    parser.add_argument("--combined-pdf", action="store_true", help="Also write every payslip into one multi-page PDF per period")
+    parser.add_argument("--zip", action="store_true", help="Also pack every payslip into one ZIP per period")
+    parser.add_argument("--no-individual-files", action="store_true",
+                        help="Do not keep the per-employee PDFs (use with --combined-pdf and/or --zip)")
+    parser.add_argument("--no-resume", action="store_true", help="Ignore the delivery manifest and process every row")
+    parser.add_argument("--metrics", default=config.METRICS_FILE or None,
+                        help="Write the run's metrics here (Prometheus text for .prom files, otherwise JSON)")
+    args = parser.parse_args(argv)
+    if args.resend_dead_letters and args.no_email:
+        parser.error("--resend-dead-letters cannot be combined with --no-email")
+    if args.stream and args.on_invalid != "skip":
+        # Aborting on invalid rows means checking every row before the first payslip goes out
+        parser.error("--stream needs --on-invalid skip")
+    if args.no_individual_files and not (args.combined_pdf or args.zip or config.COMBINED_PDF or config.ZIP_ARCHIVE):
+        # Nothing would be written: every payslip would be rendered and thrown away
+        parser.error("--no-individual-files needs --combined-pdf or --zip")
+    return args
+
+def load_credentials(source):
+    """Returns (email, password) from the chosen source, or raises ValueError."""
+    if source == "env":
+        email, password = os.environ.get(ENV_EMAIL), os.environ.get(ENV_PASSWORD)
+    elif source == "keyring":
+        import keyring
+        email = keyring.get_password(config.KEYRING_SERVICE_NAME, "user_email")
+        password = keyring.get_password(config.KEYRING_SERVICE_NAME, "user_password")
+    elif source.startswith("file:"):
+        with open(source[len("file:"):], encoding="utf-8") as credentials_file:
+            credentials = json.load(credentials_file)
+        email, password = credentials.get("email"), credentials.get("password")
+    else:
+        raise ValueError(f"Unknown credential source: {source}")
+    if not email or not password:
+        raise ValueError(f"No sender email/password found in credential source '{source}'")
+    return email, password
+
+def run(args, summary):
+    """Runs the pipeline for the parsed arguments, filling in summary. Returns the exit code."""
+    config.OUTPUT_ROOT = args.output_dir
+    if args.engine:
+        config.RENDER_ENGINE = args.engine
+    if args.pdf_profile:
+        config.PDF_PROFILE = args.pdf_profile
+    if args.latency_ms is not None:
+        config.MAIL_LATENCY_MS = args.latency_ms
+    send_workers = args.send_workers or config.SEND_WORKERS
+
+    email = password = None
+    offline = (args.transport or config.MAIL_TRANSPORT) != "smtp"
+    no_login = args.smtp_provider is not None and not SMTP_SERVERS[args.smtp_provider].get('login', True)
+    if not args.no_email and (offline or no_login):
+        # Offline transports and servers without login need no credentials; the From address may still come from the environment
+        email = os.environ.get(ENV_EMAIL) or LOCAL_SENDER
+    elif not args.no_email:
+        try:
+            email, password = load_credentials(args.credentials)
+        except (ValueError, OSError) as e:
+            summary["error"] = str(e)
+            return EXIT_USAGE
+    if args.resend_dead_letters:
+        return run_resend(args, summary, email, password, send_workers)
+
+    try:
+        pdf_generator.register_fonts()
+    except Exception as e:
+        summary["error"] = f"Could not load font files: {e}"
+        return EXIT_USAGE
+
+    workbooks = batch.expand_inputs(args.input)
+    if not workbooks:
+        summary["error"] = "No Excel workbooks found in the given input."
+        return EXIT_INPUT
+    if len(workbooks) > 1 or args.all_sheets:
+        return run_batch(args, summary, workbooks, email, password, send_workers)
+
+    stream = None
+    if args.stream:
+        try:
+            stream = data_handler.EmployeeStream(workbooks[0])
+        except Exception as e:
+            summary["error"] = f"Failed to load or read the Excel file: {e}"
+            return EXIT_INPUT
+        missing_essential = data_handler.missing_essential_columns(stream.header)
+        if missing_essential:
+            stream.close()
+            summary["error"] = f"Essential columns are missing: {', '.join(missing_essential)}"
+            return EXIT_INPUT
+        summary["invalid_rows"], periods = [], set()
+        jobs = pipeline.iter_salary_jobs(stream, summary["invalid_rows"], periods)
+    else:
+        employee_df = data_handler.load_employee_data(workbooks[0])
+        if employee_df is None:
+            summary["error"] = "Failed to load or read the Excel file."
+            return EXIT_INPUT
+
+        missing_essential = data_handler.missing_essential_columns(employee_df)
+        if missing_essential:
+            summary["error"] = f"Essential columns are missing: {', '.join(missing_essential)}"
+            return EXIT_INPUT
+
+        employee_df, summary["invalid_rows"] = data_handler.normalize_employee_data(employee_df)
+        for problem in data_handler.format_invalid_rows(summary["invalid_rows"]):
+            print(problem)
+        if summary["invalid_rows"] and args.on_invalid == "abort":
+            summary["error"] = f"{len(summary['invalid_rows'])} rows have missing or invalid essential data (use --on-invalid skip to leave them out)."
+            return EXIT_INPUT
+        valid_employee_df = employee_df.drop(index=[entry["row"] for entry in summary["invalid_rows"]])
+        if valid_employee_df.empty:
+            summary["error"] = "No valid employee records found to process."
+            return EXIT_INPUT
+        jobs = batch.salary_jobs(valid_employee_df)
+        periods = set(valid_employee_df['Period'])
+
+    server = None
+    try:
+        if not args.no_email:
+            server = connect(args, email, password, send_workers)
+            if not server:
+                summary["error"] = "Could not connect to the email server."
+                return EXIT_SMTP
+        results = pipeline.run_pipeline(jobs, None if args.no_email else pipeline.email_send_fn(server, email),
+                                        **pipeline_options(args, send_workers))
+    finally:
+        if stream is not None:
+            stream.close()
+        if server:
+            email_sender.close_connection(server)
+
+    if not results and summary["invalid_rows"]:
+        summary["error"] = "No valid employee records found to process."
+        return EXIT_INPUT
+    summary.update(pipeline.summarize_results(results))
+    summary["output_dirs"] = sorted({str(pdf_generator.payslip_output_dir(period).resolve()) for period in periods})
+    report_metrics(args, summary)
+    return EXIT_PARTIAL if summary["failed"] else EXIT_OK
+
+def run_batch(args, summary, workbooks, email, password, send_workers):
+    """Runs several workbooks (or sheets) as one batch with shared fonts, render workers and SMTP sessions."""
+    entities = batch.list_entities(workbooks, all_sheets=args.all_sheets)
+    streams = []
+    if args.stream:
+        entity_jobs, streams = batch.stream_batch(entities)
+    else:
+        employee_dfs = batch.load_batch(entities, on_invalid=args.on_invalid)
+        entity_jobs = [None if employee_df is None else batch.salary_jobs(employee_df) for employee_df in employee_dfs]
+    summary["workbooks"] = entities
+    if all(jobs is None for jobs in entity_jobs):
+        summary.update(batch.summarize_batch(entities))
+        summary["error"] = "None of the workbooks could be processed."
+        return EXIT_INPUT
+
+    server = None
+    try:
+        if not args.no_email:
+            server = connect(args, email, password, send_workers)
+            if not server:
+                summary["error"] = "Could not connect to the email server."
+                return EXIT_SMTP
+        batch.run_batch(entities, entity_jobs, None if args.no_email else pipeline.email_send_fn(server, email),
+                        **pipeline_options(args, send_workers))
+    finally:
+        for stream in streams:
+            stream.close()
+        if server:
+            email_sender.close_connection(server)
+
+    summary.update(batch.summarize_batch(entities))
+    summary["output_dirs"] = sorted({output_dir for entity in entities for output_dir in entity["output_dirs"]})
+    print("Batch summary:\n" + batch.format_batch_summary(entities))
+    report_metrics(args, summary)
+    return EXIT_PARTIAL if summary["failed"] or summary["not_processed"] else EXIT_OK
+
+def run_resend(args, summary, email, password, send_workers):
+    """Sends the payslips listed in earlier runs' dead-letter files again."""
+    dead_letter_files = retry_queue.find_dead_letters(args.resend_dead_letters)
+    if not dead_letter_files:
+        summary["error"] = "No dead-letter files found in the given paths."
+        return EXIT_INPUT
+
+    summary.update(sent=0, already_sent=0, no_address=0, failed=[])
+    server = connect(args, email, password, send_workers)
+    if not server:
+        summary["error"] = "Could not connect to the email server."
+        return EXIT_SMTP
+    try:
+        for dead_letter_path in dead_letter_files:
+            resent = retry_queue.resend_dead_letters(dead_letter_path, server, email, workers=send_workers)
+            summary["sent"] += resent["sent"]
+            summary["already_sent"] += resent["already_sent"]
+            summary["no_address"] += resent["no_address"]
+            summary["failed"] += resent["failed"]
+    finally:
+        email_sender.close_connection(server)
+
+    summary["dead_letter_files"] = [str(path.resolve()) for path in dead_letter_files if path.exists()] # Still undelivered
+    report_metrics(args, summary)
+    return EXIT_PARTIAL if summary["failed"] else EXIT_OK
+
+def connect(args, email, password, send_workers):
+    return email_sender.connect_transport(email, password, size=send_workers, transport=args.transport,
+                                          provider=args.smtp_provider, backend=args.send_backend, outbox=args.outbox)
+
+def pipeline_options(args, send_workers):
+    """The run_pipeline keyword arguments chosen on the command line."""
+    return dict(render_workers=args.render_workers, send_workers=send_workers,
+                resume=False if args.no_resume else None,
+                in_memory=True if args.no_individual_files else None,
+                archive=False if args.no_individual_files else None,
+                combined_pdf=args.combined_pdf or None, zip_archive=args.zip or None)
+
+def report_metrics(args, summary):
+    if metrics.enabled():
+        print("Run metrics:\n" + metrics.format_summary())
+        if args.metrics:
+            metrics.export(args.metrics)
+            summary["metrics_file"] = os.path.abspath(args.metrics)
+
+def main(argv=None):
+    args = parse_args(argv)
+    started = time.perf_counter()
+    inputs = args.input or args.resend_dead_letters
+    summary = {"input": inputs[0] if len(inputs) == 1 else inputs, "output_dir": os.path.abspath(args.output_dir), "error": None,
+               "startup_seconds": round(started - _STARTED, 3)}
+    # Keep stdout clean for the JSON summary; the modules' progress prints go to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            exit_code = run(args, summary)
+        except Exception as e:
+            summary["error"] = f"An unexpected error occurred: {e}"
+            exit_code = EXIT_ERROR
+    summary["exit_code"] = exit_code
+    summary["elapsed_seconds"] = round(time.perf_counter() - started, 3)
+    print(json.dumps(summary, default=str))
+    return exit_code
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
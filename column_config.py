@@ -5,7 +5,8 @@ COLUMN_MAP = {
     'Employee_Email'    : ['Employee Email', 'Email', 'Email ID'],
     'Department'        : ['Department'],
     'Designation'       : ['Designation'],
-    'Location'          : ['Location', 'Address', 'City', 'State', 'Place', 'Work Location', 'Work_Location'],
+    'Location'          : ['Location', 'Address', 'City', 'Place', 'Work Location', 'Work_Location'],
+    'State'             : ['State', 'Work State', 'State of Employment'],
     'Date_of_Joining'   : ['Date of Joining', 'DOJ', 'Joining Date', 'Join Date', 'Date Joined', 'Date_Of_Joining', 'DateJoined', 'Date_of_Joining'],
     'Bank_Name'         : ['Bank Name', 'Bank_Name'],
     'Bank_Account_No'   : ['Bank Account No', 'Account No', 'Account Number', 'Bank Account Number', 'Bank_Account_No', 'BankAccountNo', 'BankAccountNumber'],
@@ -18,6 +19,7 @@ COLUMN_MAP = {
     'LOP_Days'          : ['LOP Days', 'Loss of Pay Days', 'LOP', 'LOP_Days'],
     'Gross_Salary'      : ['Gross Salary', 'Gross'],
     'Income_Tax'        : ['Income Tax', 'IT Deduction'],
+    'Grade'             : ['Grade', 'Pay Grade', 'Salary Grade', 'Band'],
     'Basic'             : ['Basic', 'Basic Salary'],
     'HRA'               : ['HRA', 'House Rent Allowance'],
     'Special_Allowance' : ['Special Allowance', 'Allowance', 'Special Allowances', 'Allowances'],
@@ -4,6 +4,49 @@
 EPF_RATE = 0.12 
 PROF_TAX = 200
 
+# --- Output ---
+OUTPUT_ROOT = "." # Folder that receives the Payslips_<Mon_YYYY> folders
+KEYRING_SERVICE_NAME = "PayslipApp" # Saved sender credentials live under this keyring service
+
+# --- Performance Settings ---
+CACHE_DIR = ".paygen_cache" # Local cache folder for parsed workbooks and other reusable run data
+USE_INPUT_CACHE = True # Reuse the parsed workbook when the same file is loaded again
+USE_FONT_CACHE = True # Keep the parsed DejaVu font metrics in CACHE_DIR so later launches skip parsing the TTF files
+INPUT_CACHE_ENTRIES = 8 # Parsed workbooks kept in the cache
+LOAD_WORKERS = 0 # Processes parsing workbooks concurrently in a batch run: 0 = one per CPU core
+STREAM_INPUT = False # Desktop app: read the workbook in chunks and start on the first rows while the rest is read; invalid rows are then skipped and listed at the end instead of asked about first
+EXCEL_CHUNK_ROWS = 1000 # Rows per chunk when streaming a workbook (data_handler.EmployeeStream)
+WORDS_CACHE_SIZE = 4096 # Distinct net amounts kept in the amount-to-words memo
+RENDER_WORKERS = 0 # PDF render processes: 0 = one per CPU core, 1 = render serially
+PIPELINE_QUEUE_SIZE = 32 # Rendered slips allowed to wait for the senders before rendering pauses
+SEND_WORKERS = 4 # Sender threads draining the render queue, each with its own pooled SMTP session
+SEND_BACKEND = "threads" # "threads" (one blocking smtplib session per sender) or "asyncio" (async_email_sender)
+ASYNC_MAX_IN_FLIGHT = 16 # asyncio backend: SMTP sessions, and so messages in flight at once, whatever SEND_WORKERS is
+SEND_RETRIES = 4 # Further attempts for a send that failed with a transient error (4xx reply, dropped connection, timeout)
+RETRY_BASE_SECONDS = 2 # Backoff before the first retry; it doubles for each further retry, with random jitter
+RETRY_MAX_SECONDS = 60 # Longest backoff between two attempts
+MAIL_TRANSPORT = "smtp" # "smtp" (SEND_BACKEND pool), or offline: "maildir"/"eml" (written to MAIL_OUTBOX) or "null" (counted and discarded)
+MAIL_OUTBOX = "outbox" # Folder the "maildir" and "eml" transports deliver into
+MAIL_LATENCY_MS = 0 # Delay the offline transports add to each message, standing in for an SMTP round trip
+MAIL_LATENCY_JITTER_MS = 0 # Random extra delay of up to this much per message on the offline transports
+RENDER_ENGINE = "platypus" # "platypus" (flowable layout) or "canvas" (fixed-layout fast path)
+PDF_PROFILE = "optimized" # "optimized" (downsampled, pre-encoded logo and compressed streams) or "standard" (full-resolution logo)
+LOGO_DPI = 200 # Resolution the logo is downsampled to in the optimized profile
+LOGO_JPEG_QUALITY = 90 # JPEG quality of the optimized logo
+DETERMINISTIC_PDFS = False # Fixed creation date and document ID, so re-rendering an unchanged slip gives identical bytes (always on with PDF_STORE)
+PDF_STORE = False # Reuse identical slips from CACHE_DIR/payslips, keyed by row, salary and template version, instead of rendering them again. The store holds copies of every payslip (bank and salary details), so keep CACHE_DIR somewhere private
+PDF_STORE_MAX_MB = 1024 # Size the payslip store is pruned back to after each run (oldest slips go first)
+PDF_STORE_MAX_DAYS = 45 # Slips not used for this many days are removed from the store after each run
+PDF_IN_MEMORY = True # Hand rendered PDFs to the mailer in memory instead of re-reading them from disk
+ARCHIVE_PAYSLIPS = True # Also keep a copy of every payslip in Payslips_<Mon_YYYY> (written in the background)
+COMBINED_PDF = False # Also build All_Payslips_<Mon_YYYY>.pdf, every payslip as one page of a single printable PDF
+ZIP_ARCHIVE = False # Also pack every payslip into Payslips_<Mon_YYYY>.zip (with ARCHIVE_PAYSLIPS off, instead of the individual files)
+ARCHIVE_BATCH_SIZE = 50 # Payslips written per batch by the background archiver
+RESUMABLE_RUNS = True # Track each employee in a per-period manifest so re-runs skip payslips already sent
+# Employees are tracked by Employee_ID, or rows without one by email, name and bank account; rows that repeat an earlier one of the same period are invalid
+METRICS_ENABLED = True # Record per-stage timings, sizes and error counts (see metrics.py)
+METRICS_FILE = "" # If set, main.py writes each run's metrics here: Prometheus text for .prom files, otherwise JSON
+
 # --- Company Details ---
 COMPANY_NAME = "EMCUBE Cloud Private Limited"
 COMPANY_ADDR_LINE1 = "DHARA Cornor, 701, Plot No.95, Sector 10,"
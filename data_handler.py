@@ -1,23 +1,423 @@
 # data_handler.py
+import datetime
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from itertools import islice
+from pathlib import Path
+import numpy as np
 import pandas as pd
+from openpyxl import load_workbook
+import config
+import metrics
 from column_config import COLUMN_MAP
 
-def load_employee_data(filepath):
-    """Loads employee data from the specified Excel file."""
+HEADER_ROW = 3 # Zero-based row holding the column headers, below the title rows
+# A payslip cannot be produced without these; a missing column stops the run, a missing value drops the row
+ESSENTIAL_FIELDS = ['Employee_Name', 'Employee_Email', 'Period', 'Gross_Salary', 'Income_Tax']
+MISSING_TEXT = "N/A" # Shown on the payslip for optional details the sheet does not provide
+# Optional fields and the value used when the column or the cell is empty
+OPTIONAL_DEFAULTS = {
+    'Employee_ID': MISSING_TEXT, 'Department': MISSING_TEXT, 'Designation': MISSING_TEXT,
+    'Location': MISSING_TEXT, 'Date_of_Joining': MISSING_TEXT, 'Bank_Name': MISSING_TEXT,
+    'Bank_Account_No': MISSING_TEXT, 'PAN_Number': MISSING_TEXT, 'PF_Account_Number': MISSING_TEXT,
+    'ESI_Number': MISSING_TEXT, 'UAN_Number': MISSING_TEXT, 'Days_Worked': MISSING_TEXT, 'LOP_Days': "0",
+}
+TEXT_FIELDS = ['Employee_ID', 'Employee_Name', 'Employee_Email', 'Department', 'Designation', 'Location', 'State',
+               'Bank_Name', 'Bank_Account_No', 'PAN_Number', 'PF_Account_Number', 'ESI_Number', 'UAN_Number', 'Grade']
+AMOUNT_FIELDS = ['Gross_Salary', 'Income_Tax']
+DAY_FIELDS = ['Days_Worked', 'LOP_Days']
+EMAIL_PATTERN = r"^[^@\s]+@[^@\s]+\.[^@\s]+$"
+EXCEL_EPOCH = "1899-12-30" # Day zero of Excel serial dates
+
+# --- Header matching ---
+def _header_key(name):
+    """Case-, whitespace- and underscore-insensitive form of a column header."""
+    return " ".join(str(name).replace("_", " ").split()).casefold()
+
+# Header key -> (internal name, position in its COLUMN_MAP list); earlier names win
+_HEADER_INDEX = {}
+for _internal_name, _possible_names in COLUMN_MAP.items():
+    for _rank, _excel_name in enumerate([_internal_name] + _possible_names):
+        _HEADER_INDEX.setdefault(_header_key(_excel_name), (_internal_name, _rank))
+
+def _column_rename_map(columns):
+    """Maps the Excel column names to the internal names defined in COLUMN_MAP."""
+    best_match = {} # internal name -> (rank, Excel column)
+    for col in columns:
+        match = _HEADER_INDEX.get(_header_key(col))
+        if match is None:
+            continue
+        internal_name, rank = match
+        if internal_name not in best_match or rank < best_match[internal_name][0]:
+            best_match[internal_name] = (rank, col)
+    return {col: internal_name for internal_name, (_, col) in best_match.items()}
+
+def missing_essential_columns(df):
+    """Returns the essential columns the sheet does not have."""
+    return [field for field in ESSENTIAL_FIELDS if field not in df.columns]
+
+# --- Schema normalization ---
+def _strip_strings(values):
+    """Stripped strings, NaN for every cell that is not text (vectorized via .str)."""
+    try:
+        return values.str.strip()
+    except AttributeError: # No text cells at all
+        return pd.Series(np.nan, index=values.index, dtype=object)
+
+def _text_value(value):
+    """One non-text cell as a clean string: Excel numbers lose their '.0'."""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+def _coerce_text(values):
+    """IDs and text as stripped strings, with blanks as None."""
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        text = _number_text(values.astype(float))
+    elif pd.api.types.is_datetime64_any_dtype(values):
+        text = values.map(_text_value, na_action="ignore")
+    else:
+        text = _strip_strings(values) # The usual all-text column needs nothing else
+        others = text.isna() & values.notna()
+        if others.any():
+            text[others] = values[others].map(_text_value)
+    text = text.astype(object)
+    return text.where(text.notna() & (text != ""), None)
+
+def _coerce_numbers(values):
+    """Amounts as floats; text such as '50,000' or 'Rs. 50,000' is accepted, anything else becomes NaN."""
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(float)
+    cleaned = values.astype(str).str.replace(r"(?i)rs\.?|inr|[₹,\s]", "", regex=True)
+    return pd.to_numeric(cleaned.where(values.notna()), errors="coerce")
+
+def _coerce_dates(values):
+    """
+    Dates column-wise: real dates as they are, numbers as Excel serial dates, and
+    text as ISO (2025-04-01) or else day-first (01/04/2025, April 2025).
+    Unparseable values become NaT.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.astype("datetime64[ns]")
+    kinds = values.map(type)
+    result = pd.Series(pd.NaT, index=values.index, dtype="datetime64[ns]")
+    is_date = kinds.map(lambda kind: issubclass(kind, datetime.date))
+    is_number = kinds.map(lambda kind: kind in (int, float)) & values.notna()
+    is_text = kinds == str
+    if is_date.any():
+        result[is_date] = pd.to_datetime(values[is_date]).astype("datetime64[ns]")
+    if is_number.any():
+        result[is_number] = pd.to_datetime(values[is_number].astype(float), unit="D", origin=EXCEL_EPOCH).astype("datetime64[ns]")
+    if is_text.any():
+        text = values[is_text].str.strip()
+        parsed = pd.to_datetime(text, errors="coerce", format="ISO8601")
+        unparsed = parsed.isna()
+        if unparsed.any():
+            parsed[unparsed] = pd.to_datetime(text[unparsed], errors="coerce", format="mixed", dayfirst=True)
+        result[is_text] = parsed.astype("datetime64[ns]")
+    return result
+
+def _number_text(numbers):
+    """Numbers as display text without a trailing '.0': 30.0 -> '30', 29.5 -> '29.5', NaN stays NaN."""
+    text = numbers.astype(str).astype(object)
+    whole = numbers.notna() & (numbers == np.floor(numbers)) & (numbers.abs() < 2**63)
+    text[whole] = numbers[whole].astype("int64").astype(str)
+    return text.where(numbers.notna())
+
+def _date_text(dates, date_format):
+    """Formats each distinct date once; payroll sheets repeat the same few dates many times."""
+    distinct = dates.dropna().unique()
+    formatted = pd.Series(pd.DatetimeIndex(distinct).strftime(date_format), index=distinct)
+    return dates.map(formatted).astype(object)
+
+def _keep_unparsed(parsed, raw):
+    """Fills cells that could not be parsed with the sheet's own text, so they are shown as written."""
+    unparsed = parsed.isna() & raw.notna()
+    if unparsed.any():
+        parsed = parsed.copy()
+        parsed[unparsed] = _coerce_text(raw[unparsed])
+    return parsed
+
+def _is_blank(values):
+    if not (pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values)):
+        return values.isna()
+    return values.isna() | (_strip_strings(values) == "")
+
+def _describe(value):
+    return "" if value is None or (not isinstance(value, str) and pd.isna(value)) else f" '{value}'"
+
+def _key_text(values):
+    """A column as the text employee keys are built from: missing and MISSING_TEXT cells become ''."""
+    return values.astype(object).where(values.notna() & (values != MISSING_TEXT), "").astype(str)
+
+def employee_keys(df):
+    """
+    Identifies every employee across runs: the Employee ID or, for rows without one,
+    email, name and bank account number together. Content only, never the row's
+    position, so inserting or deleting rows leaves every other key unchanged.
+    """
+    field_text = lambda field: _key_text(df[field]) if field in df.columns else pd.Series("", index=df.index)
+    fallback = field_text('Employee_Email') + "|" + field_text('Employee_Name') + "|" + field_text('Bank_Account_No')
+    ids = field_text('Employee_ID')
+    return ids.where(ids != "", fallback)
+
+def employee_key(employee_row):
+    """employee_keys for a single row."""
+    def field_text(field):
+        value = employee_row.get(field)
+        return "" if value is None or pd.isna(value) or value == MISSING_TEXT else str(value)
+    return field_text('Employee_ID') or "|".join(map(field_text, ('Employee_Email', 'Employee_Name', 'Bank_Account_No')))
+
+def normalize_employee_data(df, seen_keys=None):
+    """
+    Brings a loaded sheet into the shape the rest of the pipeline relies on, in one
+    column-wise pass: IDs and text as stripped strings, amounts as floats, Period
+    as a Timestamp, Date_of_Joining and day counts as display text, and every
+    optional column present with OPTIONAL_DEFAULTS filled in.
+    Rows whose employee_keys value repeats an earlier row of the same period are invalid
+    too, as the delivery manifest could not tell them apart; seen_keys (a dict, kept
+    between calls) extends that check across the chunks of a stream.
+    Returns (normalized_df, invalid_rows). invalid_rows lists every row that cannot
+    become a payslip as {"row": index, "excel_row": ..., "employee_name": ...,
+    "reasons": [...]}, where excel_row is the row number shown in Excel; those rows
+    stay in normalized_df so the caller decides whether to drop them.
+    Expects the essential columns to exist (see missing_essential_columns).
+    """
+    with metrics.timer("validate_seconds"):
+        normalized = df.copy()
+        reasons = {}
+
+        def flag(field, mask, problem):
+            """Records `problem` for every row in mask, quoting the cell as it was in the sheet."""
+            for index, raw in df.loc[mask, field].items():
+                reasons.setdefault(index, []).append(f"{field}{_describe(raw)} {problem}")
+
+        for field in ESSENTIAL_FIELDS:
+            flag(field, _is_blank(df[field]), "is missing")
+
+        for field in TEXT_FIELDS:
+            if field in normalized.columns:
+                normalized[field] = _coerce_text(df[field])
+        email = normalized['Employee_Email']
+        flag('Employee_Email', email.notna() & ~email.fillna("").str.match(EMAIL_PATTERN), "is not a valid address")
+
+        for field in AMOUNT_FIELDS:
+            normalized[field] = _coerce_numbers(df[field])
+            flag(field, ~_is_blank(df[field]) & normalized[field].isna(), "is not a number")
+        flag('Gross_Salary', normalized['Gross_Salary'] <= 0, "must be greater than zero")
+
+        normalized['Period'] = _coerce_dates(df['Period'])
+        flag('Period', ~_is_blank(df['Period']) & normalized['Period'].isna(), "is not a date")
+
+        if 'Date_of_Joining' in normalized.columns:
+            joined = _coerce_dates(df['Date_of_Joining'])
+            normalized['Date_of_Joining'] = _keep_unparsed(_date_text(joined, '%d-%b-%Y'), df['Date_of_Joining'])
+        for field in DAY_FIELDS:
+            if field in normalized.columns:
+                normalized[field] = _keep_unparsed(_number_text(_coerce_numbers(df[field])), df[field])
+
+        if 'Location' not in normalized.columns and 'State' in normalized.columns:
+            # Older sheets label the location column "State": it still fills Location on the payslip
+            normalized['Location'] = normalized['State']
+        defaulted = [field for field in OPTIONAL_DEFAULTS if field not in normalized.columns]
+        for field, default in OPTIONAL_DEFAULTS.items():
+            if field in normalized.columns:
+                normalized[field] = normalized[field].astype(object).where(normalized[field].notna(), default)
+            else:
+                normalized[field] = default
+        if defaulted:
+            print(f"Optional columns not in the sheet, using defaults: {', '.join(defaulted)}")
+
+        seen_keys = {} if seen_keys is None else seen_keys
+        has_id = normalized['Employee_ID'] != MISSING_TEXT
+        for index, period, key, by_id in zip(normalized.index, normalized['Period'].astype(str), employee_keys(normalized), has_id):
+            if index in reasons:
+                continue
+            first = seen_keys.setdefault((period, key), index)
+            if first != index:
+                what = "Employee_ID is" if by_id else "Email, name and bank account are"
+                reasons[index] = [f"{what} the same as on row {_excel_row(first)}, so the two cannot be told apart"]
+
+    names = normalized['Employee_Name']
+    invalid_rows = [{"row": int(index) if isinstance(index, (int, np.integer)) else index,
+                     "excel_row": _excel_row(index), "employee_name": names[index], "reasons": reasons[index]}
+                    for index in normalized.index if index in reasons]
+    metrics.count("invalid_rows", len(invalid_rows))
+    return normalized, invalid_rows
+
+def _excel_row(index):
+    """Excel's 1-based row number for a DataFrame index, which counts rows from just below the header row."""
+    return int(index) + HEADER_ROW + 2 if isinstance(index, (int, np.integer)) else index
+
+def format_invalid_rows(invalid_rows):
+    """One line per invalid row, by its Excel row number, e.g. 'Row 7 (Asha Rao): Gross_Salary is missing'."""
+    return [f"Row {entry['excel_row']} ({entry['employee_name'] or 'no name'}): {'; '.join(entry['reasons'])}"
+            for entry in invalid_rows]
+
+# --- Parsed-input cache ---
+# Bump when the cached DataFrame layout changes, so stale entries are never read back
+CACHE_FORMAT_VERSION = 2
+
+def _input_cache_path(filepath, sheet_name=0):
+    """Cache file for a workbook sheet, keyed by the file contents, the sheet and the column mapping in use."""
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as workbook:
+        for block in iter(lambda: workbook.read(1024 * 1024), b""):
+            digest.update(block)
+    digest.update(repr((CACHE_FORMAT_VERSION, HEADER_ROW, COLUMN_MAP, sheet_name)).encode("utf-8"))
+    return Path(config.CACHE_DIR) / "input" / f"{digest.hexdigest()}.pkl"
+
+def _prune_input_cache(cache_dir):
+    """Keeps only the most recently used INPUT_CACHE_ENTRIES cached workbooks."""
+    entries = sorted(cache_dir.glob("*.pkl"), key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in entries[config.INPUT_CACHE_ENTRIES:]:
+        entry.unlink(missing_ok=True)
+
+def _record_load(df, started):
+    metrics.observe("load_seconds", time.perf_counter() - started)
+    metrics.count("rows_loaded", len(df))
+
+def load_employee_data(filepath, use_cache=None, sheet_name=0):
+    """
+    Loads employee data from the specified Excel file (its first sheet, unless sheet_name says otherwise).
+    The column-mapped DataFrame is cached on disk, keyed by a hash of the file contents
+    and COLUMN_MAP, so re-running on an unchanged workbook skips parsing it; any edit to
+    the workbook (or the mapping) produces a new key and a fresh parse.
+    """
+    use_cache = config.USE_INPUT_CACHE if use_cache is None else use_cache
+    started = time.perf_counter()
     try:
-        df = pd.read_excel(filepath, header=3)
+        cache_path = _input_cache_path(filepath, sheet_name) if use_cache else None
+        if cache_path and cache_path.exists():
+            try:
+                df = pd.read_pickle(cache_path)
+                cache_path.touch() # Mark as recently used for pruning
+                print(f"Loaded employee data from cache ({cache_path.name[:12]}...).")
+                metrics.count("input_cache_hits")
+                _record_load(df, started)
+                return df
+            except Exception as e:
+                print(f"Ignoring unreadable cache entry {cache_path}: {e}")
+
+        df = pd.read_excel(filepath, sheet_name=sheet_name, header=HEADER_ROW)
         # Clean up column names
-        rename_dict = {}
-        excel_columns_cleaned = {col.strip(): col for col in df.columns}
-
-        for internal_name, possible_names in COLUMN_MAP.items():
-            for excel_name in possible_names:
-                if excel_name in excel_columns_cleaned:
-                    rename_dict[excel_columns_cleaned[excel_name]] = internal_name
-                    break # Found a match, move to the next internal name
-        
-        df.rename(columns=rename_dict, inplace=True)
+        df.rename(columns=_column_rename_map(df.columns), inplace=True)
+
+        if cache_path:
+            try:
+                cache_path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = cache_path.with_suffix(".tmp")
+                df.to_pickle(tmp_path)
+                tmp_path.replace(cache_path) # Atomic, so a crash never leaves half an entry
+                _prune_input_cache(cache_path.parent)
+            except Exception as e:
+                print(f"Could not write input cache: {e}")
+        _record_load(df, started)
         return df
     except Exception as e:
         print(f"Error loading Excel file: {e}")
-        return None
\ No newline at end of file
+        metrics.count("load_errors")
+        return None
+
+class EmployeeStream:
+    """
+    A sheet (the first, unless sheet_name says otherwise) read as DataFrame chunks of
+    up to chunk_rows rows with openpyxl's read-only row iterator, so the sheet is never
+    loaded whole and the first chunk is ready while the rest of the file is still being
+    read. The header row is read when the stream is opened: `header` is an empty
+    DataFrame with the columns mapped exactly as in load_employee_data, so
+    missing_essential_columns(stream.header) can be checked before any row is read.
+    Rows are indexed and kept exactly as load_employee_data's: blank rows between
+    filled ones stay (and fail validation), trailing blank rows are dropped. The workbook is closed once the chunks run out, or by close().
+    """
+    def __init__(self, filepath, sheet_name=0, chunk_rows=None):
+        self.chunk_rows = chunk_rows or config.EXCEL_CHUNK_ROWS
+        self._workbook = load_workbook(filepath, read_only=True, data_only=True)
+        try:
+            sheet = self._workbook.worksheets[sheet_name] if isinstance(sheet_name, int) else self._workbook[sheet_name]
+            self._rows = sheet.iter_rows(values_only=True)
+            header = next(islice(self._rows, HEADER_ROW, None), None) or ()
+            # Same naming as pandas for blank header cells
+            columns = [f"Unnamed: {i}" if cell is None else str(cell) for i, cell in enumerate(header)]
+            rename_dict = _column_rename_map(columns)
+            self.header = pd.DataFrame(columns=[rename_dict.get(col, col) for col in columns])
+            # From the sheet's stored dimensions, so only an estimate (blank rows included)
+            self.row_estimate = max((sheet.max_row or 0) - HEADER_ROW - 1, 0)
+        except Exception:
+            self.close()
+            raise
+
+    def _chunk(self, rows, index):
+        metrics.count("rows_loaded", len(rows))
+        return pd.DataFrame(rows, columns=self.header.columns, index=pd.Index(index))
+
+    def __iter__(self):
+        width = len(self.header.columns)
+        blank_row = (None,) * width
+        try:
+            rows, index, blanks = [], [], []
+            for position, values in enumerate(self._rows):
+                if all(value is None for value in values):
+                    blanks.append(position) # Kept only if a filled row follows, as pandas drops trailing blank rows
+                    continue
+                pending = [(blank_row, blank) for blank in blanks]
+                # Read-only rows can be shorter or longer than the header row
+                pending.append((tuple(values[:width]) + (None,) * (width - len(values)), position))
+                blanks = []
+                for row, row_position in pending:
+                    rows.append(row)
+                    index.append(row_position)
+                    if len(rows) == self.chunk_rows:
+                        yield self._chunk(rows, index)
+                        rows, index = [], []
+            if rows:
+                yield self._chunk(rows, index)
+        finally:
+            self.close()
+
+    def close(self):
+        self._workbook.close()
+
+# --- Several workbooks at once ---
+# Settings a load worker process must share with the parent
+LOAD_WORKER_SETTINGS = ("CACHE_DIR", "USE_INPUT_CACHE", "INPUT_CACHE_ENTRIES", "METRICS_ENABLED")
+
+def sheet_names(filepath):
+    """Returns the names of every sheet in the workbook, in workbook order."""
+    with pd.ExcelFile(filepath) as workbook:
+        return list(workbook.sheet_names)
+
+def init_load_worker(settings=None):
+    """Prepares a load worker process: applies the parent's settings and starts its own metrics."""
+    for name, value in (settings or {}).items():
+        setattr(config, name, value)
+    metrics.reset()
+
+def _load_job(job):
+    filepath, sheet_name = job
+    return load_employee_data(filepath, sheet_name=sheet_name)
+
+def load_employee_workbooks(sheets, workers=None):
+    """
+    Loads several (filepath, sheet_name) pairs at once across worker processes, as
+    parsing a workbook is CPU-bound. workers defaults to config.LOAD_WORKERS (0 = one
+    per CPU core). Returns the DataFrames in input order, None for any that could not
+    be read. Loads serially when only one worker is needed or the pool is unavailable.
+    """
+    sheets = list(sheets)
+    workers = config.LOAD_WORKERS if workers is None else workers
+    workers = min(workers if workers > 0 else (os.cpu_count() or 1), len(sheets))
+
+    if workers > 1:
+        try:
+            settings = {name: getattr(config, name) for name in LOAD_WORKER_SETTINGS}
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_load_worker, initargs=(settings,)) as pool:
+                return [metrics.unwrap(collected) for collected in pool.map(partial(metrics.collect, _load_job), sheets)]
+        except (OSError, BrokenProcessPool) as e:
+            print(f"Parallel loading unavailable ({e}). Falling back to serial loading.")
+
+    return [_load_job(job) for job in sheets]
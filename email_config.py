@@ -1,12 +1,29 @@
 # email_config.py
 
+# max_per_minute throttles the connection pool per provider (0 = unlimited).
+# 'local' is a plain, unauthenticated stand-in server for testing, e.g.
+#   python -m aiosmtpd -n -l localhost:1025
 SMTP_SERVERS = {
     'gmail': {
         'server': 'smtp.gmail.com',
-        'port': 587
+        'port': 587,
+        'max_per_minute': 60
     },
     'microsoft': {
         'server': 'smtp.office365.com',
-        'port': 587
+        'port': 587,
+        'max_per_minute': 30
     },
-}
\ No newline at end of file
+    'local': {
+        'server': 'localhost',
+        'port': 1025,
+        'starttls': False,
+        'login': False,
+        'max_per_minute': 0
+    },
+}
+
+SMTP_TIMEOUT = 60 # Seconds before a stalled SMTP command is treated as a dead session
+SMTP_IDLE_CHECK = 30 # Pooled sessions idle longer than this are probed with NOOP before reuse
+SMTP_MESSAGE_TIMEOUT = 120 # Seconds one message may take from MAIL FROM to the end of DATA (asyncio backend)
+LOCAL_SENDER = "payroll@localhost" # From address of offline runs (MAIL_TRANSPORT other than "smtp") without credentials
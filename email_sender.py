@@ -1,10 +1,30 @@
 # email_sender.py
+import queue
 import smtplib
+import threading
+import time
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
-from email_config import SMTP_SERVERS
+import config
+import metrics
+from email_config import SMTP_SERVERS, SMTP_TIMEOUT, SMTP_IDLE_CHECK
+
+def detect_provider(sender_email):
+    """Picks the SMTP_SERVERS entry for the sender's address."""
+    if 'gmail.com' in sender_email:
+        return 'gmail'
+    return 'microsoft' # Default to Microsoft for custom domains
+
+def _open_session(server_config, sender_email, sender_password):
+    """Opens one SMTP session for a SMTP_SERVERS entry, with STARTTLS and login unless disabled."""
+    server = smtplib.SMTP(server_config['server'], server_config['port'], timeout=SMTP_TIMEOUT)
+    if server_config.get('starttls', True):
+        server.starttls()
+    if server_config.get('login', True):
+        server.login(sender_email, sender_password)
+    return server
 
 def connect_to_server(sender_email, sender_password):
     """
@@ -12,62 +32,254 @@ def connect_to_server(sender_email, sender_password):
     Returns the active server connection object.
     """
     # Auto-detect the email provider
-    provider = 'microsoft' # Default to Microsoft for custom domains
-    if 'gmail.com' in sender_email:
-        provider = 'gmail'
+    provider = detect_provider(sender_email)
     
     server_config = SMTP_SERVERS[provider]
-    smtp_server, smtp_port = server_config['server'], server_config['port']
+    smtp_server = server_config['server']
     print(f"Detected provider: {provider.title()}. Connecting to {smtp_server}...")
 
     try:
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        server.login(sender_email, sender_password)
+        server = _open_session(server_config, sender_email, sender_password)
         print("Connection and login successful.")
         return server
     except Exception as e:
         print(f"Failed to connect or log in: {e}")
         return None
 
-def send_single_email(server, sender_email, recipient_email, employee_name, period, pdf_path):
-    """Creates and sends a single email using an existing server connection."""
+class _RateLimiter:
+    """Spaces messages evenly so no more than max_per_minute go out per minute."""
+    def __init__(self, max_per_minute):
+        self._interval = 60.0 / max_per_minute if max_per_minute else 0.0
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Claims the next send slot and returns how many seconds to wait for it."""
+        if not self._interval:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self._interval
+        if slot > now:
+            metrics.observe("smtp_throttle_seconds", slot - now)
+        return slot - now
+
+    def wait(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+class SMTPConnectionPool:
+    """
+    Holds `size` authenticated SMTP sessions shared by concurrent sender threads.
+    Sessions that have gone quiet are probed with NOOP and dead ones are reopened
+    transparently; a send that hits a dropped session is retried once on a fresh one.
+    Sending is throttled to the provider's max_per_minute from SMTP_SERVERS.
+    It offers send_message() and quit() like smtplib.SMTP, so it can be passed
+    anywhere a single connection is used.
+    """
+    def __init__(self, sender_email, sender_password, size=1, provider=None):
+        self.provider = provider or detect_provider(sender_email)
+        self.server_config = SMTP_SERVERS[self.provider]
+        self.size = size
+        self._sender_email = sender_email
+        self._sender_password = sender_password
+        self._idle = queue.LifoQueue() # Reuse the most recently used (warmest) session first
+        self._limiter = _RateLimiter(self.server_config.get('max_per_minute', 0))
+        self.reconnects = 0
+
+    def _connect(self):
+        return _open_session(self.server_config, self._sender_email, self._sender_password)
+
+    def open(self):
+        """Opens every session up front, so a login problem shows before any payslip is sent."""
+        for _ in range(self.size):
+            self._idle.put((self._connect(), time.monotonic()))
+
+    def _is_alive(self, server, last_used):
+        if server is None:
+            return False
+        if time.monotonic() - last_used < SMTP_IDLE_CHECK:
+            return True
+        try:
+            return server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _discard(self, server):
+        try:
+            server.close()
+        except Exception:
+            pass
+
+    def send_message(self, msg):
+        """Sends a message on a free pooled session, reconnecting it if it has dropped."""
+        server, last_used = self._idle.get()
+        try:
+            if not self._is_alive(server, last_used):
+                if server is not None:
+                    self._discard(server)
+                server = None
+                server = self._connect()
+                self.reconnects += 1
+                metrics.count("smtp_reconnects")
+            self._limiter.wait()
+            try:
+                return server.send_message(msg)
+            except OSError as e:
+                # SMTP replies (also OSErrors) belong to the message; only a dropped session is retried
+                if isinstance(e, smtplib.SMTPException) and not isinstance(e, smtplib.SMTPServerDisconnected):
+                    raise
+                # The server dropped the session mid-run; retry once on a new one
+                self._discard(server)
+                server = None
+                server = self._connect()
+                self.reconnects += 1
+                metrics.count("smtp_reconnects")
+                return server.send_message(msg)
+        finally:
+            self._idle.put((server, time.monotonic()))
+
+    def quit(self):
+        """Closes every pooled session."""
+        while True:
+            try:
+                server, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            if server is not None:
+                try:
+                    server.quit()
+                except Exception:
+                    self._discard(server)
+
+def connect_pool(sender_email, sender_password, size, provider=None, backend=None):
+    """
+    Opens a pool of SMTP sessions for concurrent sending.
+    backend is "threads" (`size` smtplib sessions) or "asyncio" (async_email_sender,
+    with config.ASYNC_MAX_IN_FLIGHT sessions driven from one event loop); both pools
+    offer the same send_message()/quit(). Defaults to config.SEND_BACKEND.
+    Returns the pool, or None if the sessions could not be opened.
+    """
+    backend = backend or config.SEND_BACKEND
+    if backend == "asyncio":
+        import async_email_sender
+        size = config.ASYNC_MAX_IN_FLIGHT
+        pool = async_email_sender.AsyncSMTPPool(sender_email, sender_password, size=size, provider=provider)
+    elif backend == "threads":
+        pool = SMTPConnectionPool(sender_email, sender_password, size=size, provider=provider)
+    else:
+        raise ValueError(f"Unknown send backend: {backend}")
+    print(f"Detected provider: {pool.provider.title()}. Opening {size} connection(s) to {pool.server_config['server']}...")
+    try:
+        pool.open()
+        print("Connection and login successful.")
+        return pool
+    except Exception as e:
+        print(f"Failed to connect or log in: {e}")
+        pool.quit()
+        return None
+
+def connect_transport(sender_email, sender_password, size, transport=None, provider=None, backend=None, outbox=None):
+    """
+    Opens the mail transport the payslips are delivered through: "smtp" opens
+    connect_pool(...); "maildir", "eml" and "null" are the offline transports of
+    mail_transports, delivering into outbox (default: config.MAIL_OUTBOX) or nowhere.
+    Every transport offers send_message()/quit(). Defaults to config.MAIL_TRANSPORT.
+    Returns the transport, or None if it could not be opened.
+    """
+    transport = transport or config.MAIL_TRANSPORT
+    if transport == "smtp":
+        return connect_pool(sender_email, sender_password, size, provider=provider, backend=backend)
+    import mail_transports
     try:
-        # --- Email Content ---
-        subject = f"Your Payslip for {period.strftime('%B %Y')}"
-        html_body = f"""
-        <html>
-          <body>
-            <p>Dear {employee_name},</p>
-            <p>Please find your payslip for <b>{period.strftime('%B %Y')}</b> attached to this email.</p>
-            <p>If you have any questions, please contact the HR department.</p>
-            <br>
-            <p>Best Regards,</p>
-            <p><b>HR Department</b></p>
-          </body>
-        </html>
-        """
-        
-        # --- Create the Email Message ---
-        msg = MIMEMultipart()
-        msg['From'] = sender_email
-        msg['To'] = recipient_email
-        msg['Subject'] = subject
-        msg.attach(MIMEText(html_body, 'html'))
-
-        # --- Attach the PDF File ---
+        local_transport = mail_transports.open_local_transport(transport, outbox)
+    except OSError as e:
+        print(f"Failed to open the {transport} transport: {e}")
+        return None
+    where = f" into {local_transport.path.resolve()}" if transport != "null" else ""
+    print(f"Delivering to the offline {transport} transport{where}; no email leaves this machine.")
+    return local_transport
+
+def build_payslip_message(sender_email, recipient_email, employee_name, period, pdf_path=None, pdf_bytes=None, pdf_name=None):
+    """
+    Builds the payslip email with the PDF attached.
+    The payslip is attached from pdf_bytes/pdf_name when given, otherwise read from pdf_path.
+    """
+    # --- Email Content ---
+    subject = f"Your Payslip for {period.strftime('%B %Y')}"
+    html_body = f"""
+    <html>
+      <body>
+        <p>Dear {employee_name},</p>
+        <p>Please find your payslip for <b>{period.strftime('%B %Y')}</b> attached to this email.</p>
+        <p>If you have any questions, please contact the HR department.</p>
+        <br>
+        <p>Best Regards,</p>
+        <p><b>HR Department</b></p>
+      </body>
+    </html>
+    """
+
+    # --- Create the Email Message ---
+    msg = MIMEMultipart()
+    msg['From'] = sender_email
+    msg['To'] = recipient_email
+    msg['Subject'] = subject
+    msg.attach(MIMEText(html_body, 'html'))
+
+    # --- Attach the PDF File ---
+    if pdf_bytes is None:
         with open(pdf_path, "rb") as attachment:
-            part = MIMEBase('application', 'octet-stream')
-            part.set_payload(attachment.read())
-        encoders.encode_base64(part)
-        part.add_header('Content-Disposition', f"attachment; filename= {pdf_path.name}")
-        msg.attach(part)
-        
-        # --- Send using the existing connection ---
+            pdf_bytes = attachment.read()
+        pdf_name = pdf_path.name
+    part = MIMEBase('application', 'octet-stream')
+    part.set_payload(pdf_bytes)
+    encoders.encode_base64(part)
+    part.add_header('Content-Disposition', f"attachment; filename= {pdf_name}")
+    msg.attach(part)
+    return msg
+
+def is_transient_error(error):
+    """
+    True for send failures worth retrying later: 4xx replies (throttling, greylisting,
+    mailbox busy), dropped connections and timeouts. 5xx replies, rejected logins
+    and problems with the message itself are permanent.
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return isinstance(error, (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError))
+
+def deliver_payslip(server, sender_email, recipient_email, employee_name, period, pdf_path=None, pdf_bytes=None, pdf_name=None):
+    """
+    Creates and sends a single email using an existing server connection, raising on
+    failure so the caller can tell transient errors from permanent ones.
+    The payslip is attached from pdf_bytes/pdf_name when given, otherwise read from pdf_path.
+    """
+    with metrics.timer("mime_build_seconds"):
+        msg = build_payslip_message(sender_email, recipient_email, employee_name, period, pdf_path, pdf_bytes, pdf_name)
+
+    # --- Send using the existing connection ---
+    with metrics.timer("smtp_send_seconds"):
         server.send_message(msg)
-        print(f"Successfully sent email to {recipient_email}")
+    metrics.count("emails_sent")
+    if metrics.enabled():
+        metrics.count("attachment_bytes", len(msg.get_payload()[-1].get_payload()))
+    print(f"Successfully sent email to {recipient_email}")
+
+def send_single_email(server, sender_email, recipient_email, employee_name, period, pdf_path=None, pdf_bytes=None, pdf_name=None):
+    """
+    Like deliver_payslip, but returns (ok, message) instead of raising.
+    The payslip is attached from pdf_bytes/pdf_name when given, otherwise read from pdf_path.
+    """
+    try:
+        deliver_payslip(server, sender_email, recipient_email, employee_name, period, pdf_path, pdf_bytes, pdf_name)
         return True, "Email sent successfully!"
     except Exception as e:
+        metrics.count("send_errors")
         error_msg = f"Failed to send email to {recipient_email}: {e}"
         print(error_msg)
         return False, error_msg
@@ -2,7 +2,10 @@
 import tkinter as tk
 from tkinter import filedialog, ttk
 import os
+import queue
 import sys
+import threading
+import time
 
 # --- Helper function to get resource path for PyInstaller compatibility ---
 def resource_path(relative_path):
@@ -146,7 +149,7 @@ def get_input_file(root):
     filepath = filedialog.askopenfilename(
         parent=root,
         title="Please select the monthly employee Excel file",
-        filetypes=[("Excel Files", "*.xlsx *.xls")]
+        filetypes=[("Excel Files", "*.xlsx *.xlsm")]
     )
     return filepath
 
@@ -190,4 +193,114 @@ def ask_to_continue_with_defaults(root, message):
 
 def get_credentials(root):
     dialog = CustomLoginDialog(root)
-    return dialog.result
\ No newline at end of file
+    return dialog.result
+
+# --- Progress window for long runs ---
+class ProgressWindow(BaseDialog):
+    """
+    Shows a run's progress: payslips generated and sent, failures, throughput and ETA,
+    with a Cancel button. The run itself happens on a background thread, which reports
+    through report() and set_status(); both only put events on a queue, and the window
+    polls that queue with after(), so the Tk widgets are only ever touched from the
+    main thread. Cancel (or closing the window) sets cancel_event, which the worker
+    passes on to pipeline.run_pipeline.
+    """
+    POLL_MS = 100
+
+    def __init__(self, parent, total, title="Processing Payslips", icon_path="app_icon.ico"):
+        super().__init__(parent, title, icon_path)
+        self.total = total
+        self.cancel_event = threading.Event()
+        self._events = queue.Queue()
+        self._started = time.monotonic()
+        self._worker = None
+        self.done = self.generated = self.sent = self.skipped = self.failed = 0
+
+        main_frame = tk.Frame(self)
+        main_frame.pack(padx=20, pady=15, fill="both", expand=True)
+
+        self.status_label = tk.Label(main_frame, text="Starting...", font=("DejaVuSans", 10, "bold"), anchor="w")
+        self.status_label.pack(fill="x")
+        self.progress_bar = ttk.Progressbar(main_frame, length=360, maximum=max(total, 1))
+        self.progress_bar.pack(fill="x", pady=(8, 4))
+        self.counts_label = tk.Label(main_frame, justify="left", anchor="w")
+        self.counts_label.pack(fill="x")
+        self.rate_label = tk.Label(main_frame, justify="left", anchor="w")
+        self.rate_label.pack(fill="x")
+
+        tk.Label(main_frame, text="Problems:", anchor="w").pack(fill="x", pady=(8, 0))
+        self.failures_list = tk.Listbox(main_frame, height=6, width=60)
+        self.failures_list.pack(fill="both", expand=True)
+
+        self.cancel_button = ttk.Button(self, text="Cancel", command=self.cancel)
+        self.cancel_button.pack(pady=(0, 15))
+        self.protocol("WM_DELETE_WINDOW", self.cancel) # Closing the window cancels; it closes itself when the worker stops
+
+        self._refresh()
+        center_window(self)
+
+    # Called from the worker thread
+    def report(self, result):
+        """Records one finished employee (a pipeline result dict)."""
+        self._events.put(("result", result))
+
+    def set_status(self, text):
+        self._events.put(("status", text))
+
+    # Main thread only
+    def cancel(self):
+        if not self.cancel_event.is_set():
+            self.cancel_event.set()
+            self.cancel_button.config(state="disabled", text="Cancelling...")
+            self.status_label.config(text="Cancelling: finishing the payslips already in progress...")
+
+    def run(self, target, *args):
+        """Runs target(*args) on a background thread, keeping the window live until it returns."""
+        self._worker = threading.Thread(target=target, args=args, daemon=True)
+        self._worker.start()
+        self.after(self.POLL_MS, self._poll)
+        self.wait_window(self)
+
+    def _poll(self):
+        changed = False
+        while True:
+            try:
+                kind, payload = self._events.get_nowait()
+            except queue.Empty:
+                break
+            changed = True
+            if kind == "status":
+                if not self.cancel_event.is_set():
+                    self.status_label.config(text=payload)
+            else:
+                self._count(payload)
+        if changed:
+            self._refresh()
+        if self._worker.is_alive():
+            self.after(self.POLL_MS, self._poll)
+        else:
+            self.destroy()
+
+    def _count(self, result):
+        self.done += 1
+        self.generated += result["rendered"] and not result["skipped"]
+        self.sent += result["sent"]
+        self.skipped += result["skipped"]
+        if result["error"]:
+            self.failed += 1
+            self.failures_list.insert("end", result["error"])
+            self.failures_list.see("end")
+
+    def _refresh(self):
+        self.progress_bar["value"] = self.done
+        self.counts_label.config(text=f"Generated: {self.generated}    Sent: {self.sent}    Skipped: {self.skipped}    "
+                                      f"Failed: {self.failed}    ({self.done} of {self.total} done)")
+        elapsed = time.monotonic() - self._started
+        if self.done and elapsed > 0:
+            rate = self.done / elapsed
+            remaining = (self.total - self.done) / rate
+            self.rate_label.config(text=f"Throughput: {rate * 60:.0f} payslips/min    "
+                                        f"Time left: about {int(remaining // 60)}m {int(remaining % 60):02d}s")
+        else:
+            self.rate_label.config(text="Throughput: -    Time left: -")
+
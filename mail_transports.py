@@ -0,0 +1,114 @@
+# mail_transports.py
+"""
+Local mail transports, for load tests and offline end-to-end runs. Every transport
+offers the interface the pipeline's senders use: send_message(msg) delivers one
+email.message.Message (raising on failure) and quit() releases it. The SMTP pools
+in email_sender and async_email_sender offer the same interface, so
+email_sender.connect_transport can hand any of them to the pipeline.
+
+Each local transport can inject a delay per message (latency plus up to jitter
+seconds) that stands in for an SMTP round trip. The delay is slept without
+holding any lock, so concurrent senders overlap it as they would on a network.
+"""
+import itertools
+import mailbox
+import random
+import re
+import threading
+import time
+from pathlib import Path
+import config
+
+class MailTransport:
+    """Base class for the local transports: counts messages and injects latency."""
+    name = "base"
+
+    def __init__(self, latency=None, jitter=None):
+        self.latency = config.MAIL_LATENCY_MS / 1000 if latency is None else latency
+        self.jitter = config.MAIL_LATENCY_JITTER_MS / 1000 if jitter is None else jitter
+        self.messages = 0
+        self.bytes_delivered = 0
+        self._lock = threading.Lock()
+
+    def open(self):
+        pass
+
+    def _delay(self):
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _deliver(self, msg, data):
+        raise NotImplementedError
+
+    def send_message(self, msg):
+        """Delivers one message, like smtplib.SMTP.send_message."""
+        data = msg.as_bytes() # Serialized as SMTP would, so the CPU cost matches a real send
+        self._delay()
+        self._deliver(msg, data)
+        with self._lock:
+            self.messages += 1
+            self.bytes_delivered += len(data)
+        return {}
+
+    def quit(self):
+        print(f"{self.name.title()} transport delivered {self.messages} messages ({self.bytes_delivered:,} bytes).")
+
+class NullTransport(MailTransport):
+    """Discards every message, only counting them."""
+    name = "null"
+
+    def _deliver(self, msg, data):
+        pass
+
+class MaildirTransport(MailTransport):
+    """Delivers into a Maildir folder (new/ holds the messages), readable by any mail client."""
+    name = "maildir"
+
+    def __init__(self, path, latency=None, jitter=None):
+        super().__init__(latency, jitter)
+        self.path = Path(path)
+        self._maildir = None
+        self._write_lock = threading.Lock() # mailbox.Maildir's unique-name counter is not thread-safe
+
+    def open(self):
+        self._maildir = mailbox.Maildir(self.path, create=True)
+
+    def _deliver(self, msg, data):
+        with self._write_lock:
+            self._maildir.add(data)
+
+class EmlTransport(MailTransport):
+    """Writes each message as a numbered .eml file in a folder."""
+    name = "eml"
+
+    def __init__(self, path, latency=None, jitter=None):
+        super().__init__(latency, jitter)
+        self.path = Path(path)
+        self._numbers = itertools.count(1)
+        self._prefix = time.strftime("%Y%m%d-%H%M%S")
+
+    def open(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def _deliver(self, msg, data):
+        with self._lock:
+            number = next(self._numbers)
+        recipient = re.sub(r"[^\w.@-]", "_", str(msg['To'] or "unknown"))
+        eml_path = self.path / f"{self._prefix}-{number:06d}-{recipient}.eml"
+        tmp_path = eml_path.with_suffix(".eml.tmp")
+        tmp_path.write_bytes(data)
+        tmp_path.replace(eml_path) # Mail readers watching the folder never see half a message
+
+LOCAL_TRANSPORTS = {"null": NullTransport, "maildir": MaildirTransport, "eml": EmlTransport}
+
+def open_local_transport(kind, outbox=None, latency=None, jitter=None):
+    """Opens a local transport: "null", or "maildir"/"eml" writing to outbox (default: config.MAIL_OUTBOX)."""
+    if kind == "null":
+        transport = NullTransport(latency, jitter)
+    elif kind in LOCAL_TRANSPORTS:
+        transport = LOCAL_TRANSPORTS[kind](outbox or config.MAIL_OUTBOX, latency, jitter)
+    else:
+        raise ValueError(f"Unknown mail transport: {kind}")
+    transport.open()
+    return transport
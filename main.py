@@ -1,24 +1,21 @@
 # main.py
+import time
+_STARTED = time.perf_counter() # Taken before any other import so the startup report covers them
+import multiprocessing
 import tkinter as tk
-import pandas as pd
-import keyring
+import config
 import gui
-import data_handler
-import calculations
-import pdf_generator
-import email_sender
+import metrics
+# pandas, ReportLab, keyring and the modules built on them are imported by
+# run_payslip_process at the stage that first needs them, so the first dialog
+# appears without waiting for them.
 
-SERVICE_NAME = "PayslipApp"
+SERVICE_NAME = config.KEYRING_SERVICE_NAME
 
 def run_payslip_process(root):
     """The main process for the payslip generator application."""
-    try:
-        pdf_generator.register_fonts()
-    except Exception as e:
-        gui.show_error(root,f"Could not load font files. Please ensure the 'fonts' folder is correct.\n\nError: {e}")
-        return
-
     # --- Credential Handling ---
+    import keyring
     email = keyring.get_password(SERVICE_NAME, "user_email")
     password = keyring.get_password(SERVICE_NAME, "user_password")
     
@@ -52,76 +49,158 @@ def run_payslip_process(root):
         print("No file selected.")
         return
 
-    employee_df = data_handler.load_employee_data(input_file)
-    if employee_df is None:
-        gui.show_error(root,"Failed to load or read the Excel file. Please check the file format.")
-        return
+    import batch
+    import data_handler
+    import pipeline
+    stream = None
+    if config.STREAM_INPUT:
+        # Read in chunks while the pipeline runs; invalid rows are skipped and listed at the end
+        try:
+            stream = data_handler.EmployeeStream(input_file)
+        except Exception as e:
+            print(f"Error loading Excel file: {e}")
+            gui.show_error(root,"Failed to load or read the Excel file. Please check the file format.")
+            return
+        missing_essential = data_handler.missing_essential_columns(stream.header)
+        if missing_essential:
+            stream.close()
+            gui.show_error(root,f"Process stopped. Essential columns are missing: {', '.join(missing_essential)}")
+            return
+        invalid_rows = []
+        jobs, total = pipeline.iter_salary_jobs(stream, invalid_rows), stream.row_estimate
+    else:
+        employee_df = data_handler.load_employee_data(input_file)
+        if employee_df is None:
+            gui.show_error(root,"Failed to load or read the Excel file. Please check the file format.")
+            return
 
-    # 1. Check for missing essential columns
-    essential_fields = ['Employee_Email', 'Gross_Salary', 'Income_Tax']
-    missing_essential = [field for field in essential_fields if field not in employee_df.columns]
-    if missing_essential:
-        gui.show_error(root,f"Process stopped. Essential columns are missing: {', '.join(missing_essential)}")
-        return
+        # 1. Check for missing essential columns
+        missing_essential = data_handler.missing_essential_columns(employee_df)
+        if missing_essential:
+            gui.show_error(root,f"Process stopped. Essential columns are missing: {', '.join(missing_essential)}")
+            return
 
-    # 2. Check for missing optional columns and fill with defaults
-    # ... (code for handling optional columns) ...
-
-    # 3. Pre-scan for empty/invalid rows in essential fields
-    invalid_rows = employee_df[essential_fields].isnull().any(axis=1) | (employee_df['Gross_Salary'] == 0)
-    invalid_employee_df = employee_df[invalid_rows]
-    if not invalid_employee_df.empty:
-        names = "\n - ".join(invalid_employee_df['Employee_Name'].tolist())
-        message = f"The following employees have missing essential data:\n\n - {names}\n\nContinue with only the valid employees?"
-        if not gui.ask_to_continue_with_defaults(root, message):
-            gui.show_error(root,"Process stopped by user. Input the correct data and try again.")
+        # 2. Normalize types, fill missing optional columns with defaults and
+        # 3. pre-scan every row for missing or invalid essential data, in one pass
+        employee_df, invalid_rows = data_handler.normalize_employee_data(employee_df)
+        if invalid_rows:
+            problems = "\n - ".join(data_handler.format_invalid_rows(invalid_rows))
+            message = f"The following rows have missing or invalid essential data:\n\n - {problems}\n\nContinue with only the valid employees?"
+            if not gui.ask_to_continue_with_defaults(root, message):
+                gui.show_error(root,"Process stopped by user. Input the correct data and try again.")
+                return
+
+        valid_employee_df = employee_df.drop(index=[entry['row'] for entry in invalid_rows])
+        if valid_employee_df.empty:
+            gui.show_error(root,"No valid employee records found to process.")
             return
+        # Salary for every employee in one vectorized pass when the run starts
+        jobs, total = batch.salary_jobs(valid_employee_df), len(valid_employee_df)
 
-    valid_employee_df = employee_df.drop(invalid_employee_df.index)
-    if valid_employee_df.empty:
-        gui.show_error(root,"No valid employee records found to process.")
+    import pdf_generator
+    try:
+        pdf_generator.register_fonts()
+    except Exception as e:
+        gui.show_error(root,f"Could not load font files. Please ensure the 'fonts' folder is correct.\n\nError: {e}")
+        if stream is not None:
+            stream.close()
+        return
+
+    # --- Render and send on a background thread, with a live progress window ---
+    outcome = {}
+    progress = gui.ProgressWindow(root, total=total)
+    try:
+        progress.run(_deliver_payslips, outcome, progress, email, password, jobs)
+    finally:
+        if stream is not None:
+            stream.close()
+
+    if outcome.get('connected') and is_new_login:
+        print("Login successful. Saving new credentials...")
+        if old_credentials_existed:
+            keyring.delete_password(SERVICE_NAME, "user_email")
+            keyring.delete_password(SERVICE_NAME, "user_password")
+        keyring.set_password(SERVICE_NAME, "user_email", email)
+        keyring.set_password(SERVICE_NAME, "user_password", password)
+        print("Credentials saved.")
+
+    if outcome.get('error'):
+        gui.show_error(root, outcome['error'])
         return
 
+    results = outcome['results']
+    summary = pipeline.summarize_results(results)
+    _report_metrics()
+
+    output_dirs = {result['pdf_path'].parent for result in results if result['pdf_path']}
+    message = f"{summary['generated']} of {summary['total']} payslips generated, {summary['sent']} emailed."
+    if progress.cancel_event.is_set():
+        message = f"Run cancelled after {summary['total']} of {'about ' if stream else ''}{total} employees. {message}"
+        if summary['cancelled']:
+            message += f" {summary['cancelled']} generated payslips were not sent; running again will send them."
+    if summary['skipped']:
+        message += f" {summary['skipped']} were already sent in an earlier run and were skipped."
+    if stream is not None and invalid_rows:
+        problems = "\n - ".join(data_handler.format_invalid_rows(invalid_rows))
+        message += f"\n\nThese rows have missing or invalid essential data and were skipped:\n\n - {problems}"
+    if summary['dead_letter_files']:
+        message += (f"\n\nPayslips that could not be delivered are listed in {', '.join(summary['dead_letter_files'])}. "
+                    "Running the same file again retries them.")
+    if output_dirs:
+        message += f"\n\nCheck the '{', '.join(str(d.resolve()) for d in output_dirs)}' folder."
+    if summary['failed']:
+        failures = "\n - ".join(summary['failed'])
+        gui.show_error(root, f"{message}\n\nThe following payslips had problems:\n\n - {failures}")
+    else:
+        gui.show_success(root, message)
+
+def _deliver_payslips(outcome, progress, email, password, jobs):
+    """
+    Background part of the run: connects, then calculates salaries, renders and sends
+    the (employee_row, salary_details) jobs, which are read lazily from here.
+    Runs off the Tk thread, so it only talks to the GUI through the progress window's
+    thread-safe report()/set_status(). Fills outcome with 'connected', and 'results'
+    or 'error'.
+    """
+    import email_sender
+    import pipeline
+
     server = None
     try:
-        server = email_sender.connect_to_server(email, password)
+        progress.set_status("Connecting to the email server...")
+        server = email_sender.connect_transport(email, password, size=config.SEND_WORKERS)
         if not server:
-            gui.show_error(root,"Could not connect to the email server. Please check credentials and network.")
+            outcome['error'] = "Could not connect to the email server. Please check credentials and network."
             return
+        outcome['connected'] = True
 
-        if is_new_login:
-            print("Login successful. Saving new credentials...")
-            if old_credentials_existed:
-                keyring.delete_password(SERVICE_NAME, "user_email")
-                keyring.delete_password(SERVICE_NAME, "user_password")
-            keyring.set_password(SERVICE_NAME, "user_email", email)
-            keyring.set_password(SERVICE_NAME, "user_password", password)
-            print("Credentials saved.")
-
-        output_dir = None
-        for index, employee_row in valid_employee_df.iterrows():
-            salary_details = calculations.calculate_salary(employee_row)
-            pdf_path, output_dir = pdf_generator.create_payslip(employee_row, salary_details)
-            if pdf_path:
-                recipient_email = employee_row.get('Employee_Email')
-                if recipient_email and recipient_email != 'N/A':
-                    email_sender.send_single_email(server, email, recipient_email, employee_row['Employee_Name'], employee_row['Period'], pdf_path)
-        
-        if output_dir:
-            gui.show_success(root,f"All valid payslips generated successfully!\n\nCheck the '{output_dir.resolve()}' folder.")
-        else:
-            gui.show_success(root,"Process complete!")
-    
+        # Rendering and sending overlap; each employee's outcome is collected instead of aborting the run
+        progress.set_status("Generating and sending payslips...")
+        outcome['results'] = pipeline.run_pipeline(jobs, pipeline.email_send_fn(server, email),
+                                                   progress=progress.report, cancel=progress.cancel_event)
     except Exception as e:
-        gui.show_error(root,f"An unexpected error occurred: {e}")
-    
+        outcome['error'] = f"An unexpected error occurred: {e}"
     finally:
         if server:
             email_sender.close_connection(server)
 
+def _report_metrics():
+    """Prints where the run's time went and, if METRICS_FILE is set, exports the metrics."""
+    if not metrics.enabled():
+        return
+    print("Run metrics:\n" + metrics.format_summary())
+    if config.METRICS_FILE:
+        try:
+            metrics.export(config.METRICS_FILE)
+            print(f"Metrics written to {config.METRICS_FILE}")
+        except OSError as e:
+            print(f"Could not write metrics file: {e}")
+
 if __name__ == "__main__":
+    multiprocessing.freeze_support() # Needed for the render worker processes in the PyInstaller build
     app_root = tk.Tk()
     app_root.withdraw()
+    print(f"Startup took {time.perf_counter() - _STARTED:.2f}s.")
     run_payslip_process(app_root)
     app_root.destroy()
     # run_payslip_process()
@@ -0,0 +1,138 @@
+# manifest.py
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+from data_handler import employee_key
+from pdf_generator import employee_output_dir
+
+MANIFEST_NAME = "manifest.sqlite3"
+
+def row_hash(employee_row, salary_details):
+    """Hashes everything that ends up on the payslip, so any relevant change gives a new hash."""
+    payload = {
+        "row": {str(field): str(value) for field, value in dict(employee_row).items()},
+        "salary": {field: str(value) for field, value in salary_details.items()},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+def file_hash(pdf_path=None, pdf_bytes=None):
+    """Hashes a payslip from memory or, failing that, from disk."""
+    if pdf_bytes is None:
+        with open(pdf_path, "rb") as pdf_file:
+            pdf_bytes = pdf_file.read()
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+class DeliveryManifest:
+    """
+    Durable record of every employee's payslip for a pay period: the hash of the input
+    row, the generated PDF and its hash, and the send status. Kept as a small SQLite
+    database in each Payslips_<Mon_YYYY> folder, so a re-run after a crash or network
+    loss only renders and sends rows that changed, failed or were never processed.
+    Safe to share between the render and sender threads.
+    """
+    def __init__(self):
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def _db(self, employee_row):
+        output_dir = employee_output_dir(employee_row)
+        db = self._connections.get(output_dir)
+        if db is None:
+            output_dir.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(output_dir / MANIFEST_NAME, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS payslips (
+                    employee_key TEXT PRIMARY KEY,
+                    row_hash TEXT NOT NULL,
+                    pdf_path TEXT,
+                    pdf_hash TEXT,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            db.commit()
+            self._connections[output_dir] = db
+        return db
+
+    def plan(self, employee_row, salary_details):
+        """
+        Decides what a row still needs, with a single primary-key lookup.
+        Returns (action, row_hash, pdf_path) where action is "skip" (already sent,
+        unchanged), "send" (unchanged and rendered, only the send is missing) or "render".
+        """
+        current_hash = row_hash(employee_row, salary_details)
+        with self._lock:
+            entry = self._db(employee_row).execute(
+                "SELECT row_hash, pdf_path, pdf_hash, status FROM payslips WHERE employee_key = ?",
+                (employee_key(employee_row),)).fetchone()
+        if entry is None or entry[0] != current_hash:
+            return "render", current_hash, None
+        _, pdf_path, pdf_hash, status = entry
+        if status == "sent":
+            return "skip", current_hash, pdf_path
+        if status in ("rendered", "send_failed") and pdf_path:
+            try:
+                if file_hash(pdf_path) == pdf_hash:
+                    return "send", current_hash, pdf_path
+            except OSError:
+                pass # Archived copy is gone; render it again
+        return "render", current_hash, None
+
+    def _upsert(self, employee_row, **fields):
+        fields["updated_at"] = time.time()
+        columns = ", ".join(fields)
+        placeholders = ", ".join("?" for _ in fields)
+        updates = ", ".join(f"{column} = excluded.{column}" for column in fields)
+        with self._lock:
+            db = self._db(employee_row)
+            db.execute(f"INSERT INTO payslips (employee_key, {columns}) VALUES (?, {placeholders}) "
+                       f"ON CONFLICT(employee_key) DO UPDATE SET {updates}",
+                       (employee_key(employee_row), *fields.values()))
+            db.commit()
+
+    def record_render(self, employee_row, current_hash, pdf_path=None, pdf_bytes=None, error=None):
+        """Records the outcome of rendering a row."""
+        if error:
+            self._upsert(employee_row, row_hash=current_hash, pdf_path=None, pdf_hash=None, status="render_failed", error=error)
+            return
+        pdf_hash = file_hash(pdf_path, pdf_bytes) if (pdf_path or pdf_bytes is not None) else None
+        self._upsert(employee_row, row_hash=current_hash, pdf_path=str(pdf_path) if pdf_path else None,
+                     pdf_hash=pdf_hash, status="rendered", error=None)
+
+    def record_send(self, employee_row, ok, error=None):
+        """Records whether the payslip reached the employee."""
+        with self._lock:
+            db = self._db(employee_row)
+            db.execute("UPDATE payslips SET status = ?, error = ?, updated_at = ? WHERE employee_key = ?",
+                       ("sent" if ok else "send_failed", None if ok else error, time.time(), employee_key(employee_row)))
+            db.commit()
+
+    def close(self):
+        with self._lock:
+            for db in self._connections.values():
+                db.close()
+            self._connections.clear()
+
+def send_status(output_dir, key):
+    """Send status of one employee in the manifest of output_dir, or None if it is not recorded there."""
+    manifest_path = Path(output_dir) / MANIFEST_NAME
+    if not manifest_path.exists():
+        return None
+    with closing(sqlite3.connect(manifest_path)) as db:
+        entry = db.execute("SELECT status FROM payslips WHERE employee_key = ?", (key,)).fetchone()
+    return entry[0] if entry else None
+
+def mark_sent(output_dir, key):
+    """Records a payslip delivered outside the pipeline (e.g. re-sent from the dead-letter file) as sent."""
+    manifest_path = Path(output_dir) / MANIFEST_NAME
+    if not manifest_path.exists():
+        return
+    with closing(sqlite3.connect(manifest_path)) as db:
+        db.execute("UPDATE payslips SET status = 'sent', error = NULL, updated_at = ? WHERE employee_key = ?", (time.time(), key))
+        db.commit()
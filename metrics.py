@@ -0,0 +1,235 @@
+# metrics.py
+"""
+Run instrumentation: counters (rows, bytes, errors) and histograms (per-item
+timings and sizes) recorded by data_handler, calculations, pdf_generator and
+email_sender. Query with snapshot() at the end of a run, or export() it as JSON
+or Prometheus text format. With config.METRICS_ENABLED off, every hook returns
+straight away.
+
+Render worker processes keep their own registry; collect() ships what a job
+recorded back with its result and unwrap() merges it into the parent's.
+"""
+import json
+import threading
+import time
+import config
+
+PROMETHEUS_PREFIX = "paygen_"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (10_000, 50_000, 100_000, 250_000, 500_000, 1_000_000, 2_500_000, 5_000_000, 10_000_000)
+
+class _Histogram:
+    """Fixed-bucket histogram; quantiles are estimated as the upper bound of the bucket they fall in."""
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # Last slot is the +Inf bucket
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        slot = 0
+        while slot < len(self.buckets) and value > self.buckets[slot]:
+            slot += 1
+        self.counts[slot] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, data):
+        if tuple(data["buckets"]) != self.buckets:
+            raise ValueError("Cannot merge histograms with different buckets")
+        self.counts = [mine + theirs for mine, theirs in zip(self.counts, data["counts"])]
+        self.count += data["count"]
+        self.sum += data["sum"]
+        for bound, pick in (("min", min), ("max", max)):
+            if data[bound] is not None:
+                setattr(self, bound, data[bound] if getattr(self, bound) is None else pick(getattr(self, bound), data[bound]))
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        target, seen = q * self.count, 0
+        for slot, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return min(self.buckets[slot], self.max) if slot < len(self.buckets) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            "buckets": list(self.buckets), "counts": list(self.counts),
+            "count": self.count, "sum": self.sum, "min": self.min, "max": self.max,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.quantile(0.5), "p90": self.quantile(0.9), "p99": self.quantile(0.99),
+        }
+
+class MetricsRegistry:
+    """Thread-safe store of named counters and histograms."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+            self._started = time.time()
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = _Histogram(buckets)
+            histogram.observe(value)
+
+    def snapshot(self):
+        """Everything recorded so far, as plain JSON-ready data."""
+        with self._lock:
+            return {
+                "started_at": self._started,
+                "elapsed_seconds": time.time() - self._started,
+                "counters": dict(self._counters),
+                "histograms": {name: histogram.to_dict() for name, histogram in self._histograms.items()},
+            }
+
+    def merge(self, snapshot):
+        """Adds another registry's snapshot (e.g. from a worker process) to this one."""
+        with self._lock:
+            for name, amount in snapshot["counters"].items():
+                self._counters[name] = self._counters.get(name, 0) + amount
+            for name, data in snapshot["histograms"].items():
+                histogram = self._histograms.get(name)
+                if histogram is None:
+                    histogram = self._histograms[name] = _Histogram(data["buckets"])
+                histogram.merge(data)
+
+    def drain(self):
+        """Returns the snapshot and starts over, so the same data is never merged twice."""
+        with self._lock:
+            snapshot = {
+                "started_at": self._started,
+                "elapsed_seconds": time.time() - self._started,
+                "counters": self._counters,
+                "histograms": {name: histogram.to_dict() for name, histogram in self._histograms.items()},
+            }
+            self._counters = {}
+            self._histograms = {}
+        return snapshot
+
+REGISTRY = MetricsRegistry()
+
+# --- Recording hooks ---
+class _Timer:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        REGISTRY.observe(self.name, time.perf_counter() - self.started)
+        return False
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+def enabled():
+    return config.METRICS_ENABLED
+
+def count(name, amount=1):
+    """Adds amount to a counter, e.g. rows loaded, bytes written or errors."""
+    if config.METRICS_ENABLED:
+        REGISTRY.count(name, amount)
+
+def observe(name, value, buckets=LATENCY_BUCKETS):
+    """Records one value (a duration in seconds, or a size with SIZE_BUCKETS) in a histogram."""
+    if config.METRICS_ENABLED:
+        REGISTRY.observe(name, value, buckets)
+
+def timer(name):
+    """Context manager that records how long its block took in the `name` histogram."""
+    return _Timer(name) if config.METRICS_ENABLED else _NULL_TIMER
+
+def snapshot():
+    return REGISTRY.snapshot()
+
+def reset():
+    REGISTRY.reset()
+
+# --- Worker processes ---
+def collect(fn, *args, **kwargs):
+    """Runs fn in a worker process and returns (result, metrics recorded by it) for unwrap()."""
+    result = fn(*args, **kwargs)
+    return result, REGISTRY.drain() if config.METRICS_ENABLED else None
+
+def unwrap(collected):
+    """Merges the worker's metrics from collect() into this process and returns the job's result."""
+    result, worker_metrics = collected
+    if worker_metrics:
+        REGISTRY.merge(worker_metrics)
+    return result
+
+# --- Export ---
+def to_json(data=None):
+    return json.dumps(data or snapshot(), indent=2)
+
+def _prometheus_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def to_prometheus(data=None):
+    """Renders a snapshot in the Prometheus text exposition format."""
+    data = data or snapshot()
+    lines = []
+    for name, amount in sorted(data["counters"].items()):
+        metric = f"{PROMETHEUS_PREFIX}{name}_total"
+        lines += [f"# TYPE {metric} counter", f"{metric} {_prometheus_number(amount)}"]
+    for name, histogram in sorted(data["histograms"].items()):
+        metric = f"{PROMETHEUS_PREFIX}{name}"
+        lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for bound, bucket_count in zip(list(histogram["buckets"]) + ["+Inf"], histogram["counts"]):
+            cumulative += bucket_count
+            lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+        lines += [f"{metric}_sum {_prometheus_number(histogram['sum'])}", f"{metric}_count {histogram['count']}"]
+    return "\n".join(lines) + "\n"
+
+def export(path, data=None):
+    """Writes the metrics to path: Prometheus text format for .prom files, JSON otherwise."""
+    text = to_prometheus(data) if str(path).endswith(".prom") else to_json(data)
+    with open(path, "w", encoding="utf-8") as metrics_file:
+        metrics_file.write(text)
+
+def format_summary(data=None):
+    """Short human-readable table of the recorded timings and counters, for the console."""
+    data = data or snapshot()
+    lines = []
+    for name, histogram in sorted(data["histograms"].items()):
+        if not histogram["count"]:
+            continue
+        if name.endswith("_seconds"):
+            lines.append(f"  {name:<28} n={histogram['count']:<7} total={histogram['sum']:.3f}s "
+                         f"mean={histogram['mean'] * 1000:.1f}ms p90<={histogram['p90'] * 1000:.1f}ms")
+        else:
+            lines.append(f"  {name:<28} n={histogram['count']:<7} total={histogram['sum']:.0f} "
+                         f"mean={histogram['mean']:.0f} p90<={histogram['p90']:.0f}")
+    for name, amount in sorted(data["counters"].items()):
+        lines.append(f"  {name:<28} {amount}")
+    return "\n".join(lines)
@@ -0,0 +1,31 @@
+# payroll_config.py
+# Salary rules. calculations.compile_payroll_rules checks them and compiles them
+# once into column-wise NumPy expressions, evaluated over the whole employee table.
+from config import EPF_RATE, PROF_TAX
+
+# Earnings, in order: each is `rate` x `of`, where `of` is 'gross' or an earning listed above it
+EARNINGS = {
+    'basic'             : {'rate': 0.50, 'of': 'gross'},
+    'hra'               : {'rate': 0.40, 'of': 'basic'},
+    'special_allowance' : {'rate': 0.30, 'of': 'gross'},
+}
+
+# Employee EPF: `rate` x `of`, with `of` capped at `wage_ceiling` (None = no ceiling, e.g. 15000)
+EPF = {'rate': EPF_RATE, 'of': 'basic', 'wage_ceiling': None}
+
+# Professional tax by state: [(monthly gross from, tax), ...] in ascending order, starting at 0.
+# The state is read from STATE_COLUMN (matched case-insensitively); rows with none use
+# 'default', and states with no entry here also use 'default' and are reported in the log.
+STATE_COLUMN = 'State'
+PROF_TAX_SLABS = {
+    'default'     : [(0, PROF_TAX)],
+    # 'Maharashtra' : [(0, 0), (7500, 175), (10000, 200)],
+    # 'Karnataka'   : [(0, 0), (25000, 200)],
+}
+
+# Per-grade changes to the rules above, by the value in GRADE_COLUMN: the rate of
+# any earning, and the rate or wage_ceiling of EPF
+GRADE_COLUMN = 'Grade'
+GRADE_OVERRIDES = {
+    # 'M1' : {'basic': {'rate': 0.40}, 'epf': {'wage_ceiling': 15000}},
+}
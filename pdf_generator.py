@@ -1,18 +1,33 @@
 # pdf_generator.py
+import hashlib
+import io
+import json
 import os
+import pickle
+import queue
 import sys
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
 from pathlib import Path
-import pandas as pd
+from weakref import WeakKeyDictionary
+from reportlab import Version as REPORTLAB_VERSION
 from reportlab.platypus import (
-    SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
+    SimpleDocTemplate, Frame, Table, TableStyle, Paragraph, Spacer, Image
 )
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib import colors
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfgen import canvas
 from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfbase.ttfonts import TTFont, TTFontFace
 from reportlab.graphics.shapes import Drawing, Line
 import config
+import metrics
 
 def resource_path(relative_path):
     """ Get absolute path to resource, works for dev and for PyInstaller """
@@ -22,128 +37,787 @@ def resource_path(relative_path):
         base_path = os.path.abspath(".")
     return os.path.join(base_path, relative_path)
 
+FONT_FILES = {
+    "DejaVuSans": "fonts/DejaVuSans.ttf",
+    "DejaVuSans-Bold": "fonts/DejaVuSans-Bold.ttf",
+    "DejaVuSans-Oblique": "fonts/DejaVuSans-Oblique.ttf",
+}
+FONT_CACHE_VERSION = 1
+
+# --- Font metrics cache ---
+def _font_cache_path(font_name, font_path):
+    """Cache file for a parsed font, keyed by the TTF file's size and mtime and the ReportLab version."""
+    stat = os.stat(font_path)
+    key = f"{font_name}-{stat.st_size}-{stat.st_mtime_ns}-{REPORTLAB_VERSION}-v{FONT_CACHE_VERSION}"
+    return Path(config.CACHE_DIR) / "fonts" / f"{key}.pkl"
+
+def _load_cached_font(cache_path):
+    """Rebuilds a TTFont from its cached attributes, restoring the two that cannot be pickled."""
+    with open(cache_path, "rb") as cache_file:
+        font_attrs, face_attrs = pickle.load(cache_file)
+    face = TTFontFace.__new__(TTFontFace)
+    face.__dict__.update(face_attrs)
+    scale = 1000 / face.unitsPerEm
+    face._pdfScale = (lambda x: x) if face.unitsPerEm == 1000 else (lambda x: x * scale)
+    font = TTFont.__new__(TTFont)
+    font.__dict__.update(font_attrs)
+    font.face = face
+    font.state = WeakKeyDictionary() # Per-document subsetting state, always empty for a fresh font
+    return font
+
+def _save_cached_font(cache_path, font):
+    font_attrs = {name: value for name, value in vars(font).items() if name not in ("face", "state")}
+    face_attrs = {name: value for name, value in vars(font.face).items() if name != "_pdfScale"}
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_suffix(".tmp")
+    with open(tmp_path, "wb") as cache_file:
+        pickle.dump((font_attrs, face_attrs), cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp_path.replace(cache_path) # Atomic, so a crash never leaves half an entry
+
+def load_font(font_name, font_path, use_cache=None):
+    """
+    Returns the TTFont for font_path. Parsing a TTF file means walking all of its
+    tables, so the parsed metrics are cached in CACHE_DIR and later launches only
+    unpickle them. A changed font file or ReportLab upgrade gives a new cache key.
+    """
+    use_cache = config.USE_FONT_CACHE if use_cache is None else use_cache
+    cache_path = _font_cache_path(font_name, font_path) if use_cache else None
+    if cache_path and cache_path.exists():
+        try:
+            return _load_cached_font(cache_path)
+        except Exception as e:
+            print(f"Ignoring unreadable font cache entry {cache_path}: {e}")
+
+    font = TTFont(font_name, font_path)
+    if cache_path:
+        try:
+            _save_cached_font(cache_path, font)
+        except Exception as e:
+            print(f"Could not write font cache: {e}")
+    return font
+
 def register_fonts():
     """Registers the necessary fonts for ReportLab."""
-    pdfmetrics.registerFont(TTFont("DejaVuSans", resource_path("fonts/DejaVuSans.ttf")))
-    pdfmetrics.registerFont(TTFont("DejaVuSans-Bold", resource_path("fonts/DejaVuSans-Bold.ttf")))
-    pdfmetrics.registerFont(TTFont("DejaVuSans-Oblique", resource_path("fonts/DejaVuSans-Oblique.ttf")))
+    with metrics.timer("font_register_seconds"):
+        for font_name, relative_path in FONT_FILES.items():
+            if font_name not in pdfmetrics.getRegisteredFontNames():
+                pdfmetrics.registerFont(load_font(font_name, resource_path(relative_path)))
 
-def create_payslip(employee_data, salary_details):
-    """Generates and saves a single PDF payslip with the new layout."""
-    print(f"Generating payslip for {employee_data['Employee_Name']}...")
-    pay_period = employee_data['Period']
-    output_dir_name = f"Payslips_{pay_period.strftime('%b_%Y')}"
-    output_dir = Path(output_dir_name)
-    output_dir.mkdir(exist_ok=True)
-
-    pdf_path = output_dir / f"{employee_data['Employee_Name']}.pdf"    
-    doc = SimpleDocTemplate(str(pdf_path), pagesize=A4, rightMargin=40, leftMargin=40, topMargin=40, bottomMargin=40)
-    elements = []
-
-    styles = getSampleStyleSheet()
-    normal_style = ParagraphStyle("normal", parent=styles["Normal"], fontName="DejaVuSans", fontSize=9, leading=12)
-    bold_style = ParagraphStyle("bold", parent=normal_style, fontName="DejaVuSans-Bold")
-    right_align_style = ParagraphStyle("right_align", parent=normal_style, alignment=2)
-    bold_style_right = ParagraphStyle("bold_right", parent=bold_style, alignment=2)
-
-    # --- NEW: Header table with Logo on left and Company Address on right ---
+# --- Output profiles ---
+PDF_PROFILES = ("optimized", "standard")
+LOGO_SIZE = (200, 80) # Points the logo is drawn at on every slip
+
+def encode_logo(logo_path, dpi=None, quality=None):
+    """
+    Downsamples the logo to the resolution it is printed at (LOGO_DPI at LOGO_SIZE)
+    and encodes it once as a JPEG, flattened onto the white page. ReportLab embeds
+    JPEG data as it is, so no slip has to compress the image again.
+    Returns the JPEG as a file-like object.
+    """
+    from PIL import Image as PILImage # Pillow ships with ReportLab
+    dpi = dpi or config.LOGO_DPI
+    quality = quality or config.LOGO_JPEG_QUALITY
+    with PILImage.open(logo_path) as source:
+        source = source.convert("RGBA")
+        width = min(source.width, round(LOGO_SIZE[0] * dpi / 72))
+        height = min(source.height, round(LOGO_SIZE[1] * dpi / 72))
+        logo = source.resize((width, height), PILImage.LANCZOS)
+    flattened = PILImage.new("RGB", logo.size, "white")
+    flattened.paste(logo, mask=logo.getchannel("A"))
+    encoded = io.BytesIO()
+    flattened.save(encoded, "JPEG", quality=quality, optimize=True)
+    encoded.seek(0)
+    return encoded
+
+# Bump whenever the payslip layout changes, so slips in the payslip store are not reused
+TEMPLATE_VERSION = 1
+
+def template_version_key(profile, invariant):
+    """
+    Hash of everything besides the employee's data that shapes a payslip: the layout
+    version, profile, company details, logo and font files and the ReportLab version.
+    """
+    digest = hashlib.sha256(repr((
+        TEMPLATE_VERSION, profile, invariant, REPORTLAB_VERSION, config.LOGO_DPI, config.LOGO_JPEG_QUALITY,
+        config.COMPANY_NAME, config.COMPANY_ADDR_LINE1, config.COMPANY_ADDR_LINE2, config.COMPANY_ADDR_LINE3,
+    )).encode("utf-8"))
+    for relative_path in ["company_logo.png", *FONT_FILES.values()]:
+        try:
+            with open(resource_path(relative_path), "rb") as resource_file:
+                digest.update(resource_file.read())
+        except OSError:
+            digest.update(b"missing")
+    return digest.hexdigest()
+
+class PayslipTemplate:
+    """
+    Holds every employee-independent piece of the payslip: styles, the decoded
+    logo, the company address block and the table styles. Build it once per run
+    and pass it to create_payslip so only the per-employee cells are created per slip.
+    profile is "optimized" (logo downsampled and pre-encoded by encode_logo, streams
+    compressed) or "standard" (the full-resolution logo as it is); it defaults to
+    config.PDF_PROFILE. Fonts are always embedded as subsets of the glyphs used.
+    """
+    def __init__(self, profile=None):
+        self.profile = profile or config.PDF_PROFILE
+        if self.profile not in PDF_PROFILES:
+            raise ValueError(f"Unknown PDF profile: {self.profile}")
+        # None leaves compression to ReportLab's rl_config.pageCompression
+        self.page_compression = 1 if self.profile == "optimized" else None
+        # Invariant documents get a fixed creation date and ID, so the same slip is always the same bytes.
+        # The store needs that to tell unchanged slips apart; otherwise the real creation date is kept.
+        self.invariant = 1 if (config.DETERMINISTIC_PDFS or config.PDF_STORE) else 0
+        self.version_key = template_version_key(self.profile, self.invariant)
+        styles = getSampleStyleSheet()
+        self.normal_style = ParagraphStyle("normal", parent=styles["Normal"], fontName="DejaVuSans", fontSize=9, leading=12)
+        self.bold_style = ParagraphStyle("bold", parent=self.normal_style, fontName="DejaVuSans-Bold")
+        self.right_align_style = ParagraphStyle("right_align", parent=self.normal_style, alignment=2)
+        self.bold_style_right = ParagraphStyle("bold_right", parent=self.bold_style, alignment=2)
+        self.heading_style = ParagraphStyle("heading", fontName="DejaVuSans-Bold", fontSize=13, alignment=1, spaceBefore=15, spaceAfter=15)
+
+        # --- Logo is read and decoded (or, optimized, encoded) once, then drawn on every slip ---
+        try:
+            if self.profile == "optimized":
+                self.logo = Image(encode_logo(resource_path("company_logo.png")), width=LOGO_SIZE[0], height=LOGO_SIZE[1], lazy=0)
+                self.logo_reader = self.logo._img
+            else:
+                self.logo = Image(resource_path("company_logo.png"), width=LOGO_SIZE[0], height=LOGO_SIZE[1], lazy=0)
+                self.logo_reader = self.logo._img
+                self.logo_reader.getRGBData()
+        except Exception:
+            self.logo = Paragraph("<b>LOGO</b>", self.bold_style)
+            self.logo_reader = None
+
+        company_address = f"""
+            <b>{config.COMPANY_NAME}</b><br/>
+            {config.COMPANY_ADDR_LINE1}<br/>
+            {config.COMPANY_ADDR_LINE2}<br/>
+            {config.COMPANY_ADDR_LINE3}
+        """
+        self.company_address = Paragraph(company_address, self.right_align_style)
+
+        self.header_table_style = TableStyle([
+            ('VALIGN', (0,0), (0,0), 'TOP'),
+        ])
+        self.details_table_style = TableStyle([
+            ('FONTNAME', (0,0), (-1,-1), 'DejaVuSans'),
+            ('FONTSIZE', (0,0), (-1,-1), 9),
+            ('GRID', (0,0), (-1,-1), 0.5, colors.black),
+            # Style for the label columns (0 and 2)
+            ('BACKGROUND', (0,0), (0,-1), colors.lightgrey),
+            ('BACKGROUND', (2,0), (2,-1), colors.lightgrey),
+            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+            ('TOPPADDING', (0,0), (-1,-1), 4),
+            ('BOTTOMPADDING', (0,0), (-1,-1), 4),
+            # Style for the value columns (1 and 3)
+            ('ALIGN', (1,0), (1,-1), 'LEFT'),
+            ('ALIGN', (3,0), (3,-1), 'LEFT'),
+        ])
+        self.salary_table_style = TableStyle([
+            ("FONTNAME", (0,1), (0,-2), "DejaVuSans"),
+            ("FONTNAME", (2,1), (2,-2), "DejaVuSans"),
+            ("BACKGROUND", (0,0), (-1,0), colors.lightgrey),
+            ("GRID", (0,0), (-1,-1), 0.5, colors.black),
+            ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
+            ("BACKGROUND", (0,-1), (-1,-1), colors.whitesmoke),
+        ])
+        self.summary_table_style = TableStyle([
+            ('GRID', (0,0), (-1,-1), 0.5, colors.black),
+            ('BACKGROUND', (0,0), (-1,-1), colors.lightgreen),
+            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+            ('FONTSIZE', (0,0), (-1,-1), 10),
+            ('FONTNAME', (0,0), (0,0), 'DejaVuSans-Bold'),
+        ])
+
+        # --- Per-slip timing breakdown (seconds per stage) ---
+        self.last_timings = {}
+        self._timing_totals = {}
+        self.slip_count = 0
+
+    def build_elements(self, employee_data, salary_details):
+        """Creates the per-employee flowables around the cached template pieces."""
+        bold_style = self.bold_style
+        right_align_style = self.right_align_style
+        bold_style_right = self.bold_style_right
+        elements = []
+
+        header_table = Table([[self.logo, self.company_address]], colWidths=['50%', '50%'])
+        header_table.setStyle(self.header_table_style)
+        elements.append(header_table)
+
+        elements.append(Paragraph(f"<b>Payslip for {employee_data['Period'].strftime('%B %Y')}</b>", self.heading_style))
+
+        # --- Bordered table for Employee Details ---
+        # Values arrive as display text from data_handler.normalize_employee_data
+        details_data = [
+            [Paragraph('<b>Employee Name</b>', bold_style), employee_data['Employee_Name'], Paragraph('<b>Bank Name</b>', bold_style), employee_data['Bank_Name']],
+            [Paragraph('<b>Employee Number</b>', bold_style), employee_data['Employee_ID'], Paragraph('<b>Bank Account No</b>', bold_style), employee_data['Bank_Account_No']],
+            [Paragraph('<b>Department</b>', bold_style), employee_data['Department'], Paragraph('<b>PAN Number</b>', bold_style), employee_data['PAN_Number']],
+            [Paragraph('<b>Designation</b>', bold_style), employee_data['Designation'], Paragraph('<b>PF Account Number</b>', bold_style), employee_data['PF_Account_Number']],
+            [Paragraph('<b>Location</b>', bold_style), employee_data['Location'], Paragraph('<b>ESI Number</b>', bold_style), employee_data['ESI_Number']],
+            [Paragraph('<b>Date of Joining</b>', bold_style), employee_data['Date_of_Joining'], Paragraph('<b>UAN Number</b>', bold_style), employee_data['UAN_Number']],
+            [Paragraph('<b>Days Worked</b>', bold_style), employee_data['Days_Worked'], Paragraph('<b>LOP Days</b>', bold_style), employee_data['LOP_Days']],
+        ]
+
+        details_table = Table(details_data, colWidths=['25%', '25%', '25%', '25%'])
+        details_table.setStyle(self.details_table_style)
+        elements.append(details_table)
+        elements.append(Spacer(1, 20))
+
+        # --- Salary Table ---
+        data = [
+            [Paragraph("<b>Earnings</b>", bold_style_right), Paragraph("<b>Amount (₹)</b>", bold_style_right), Paragraph("<b>Deductions</b>", bold_style_right), Paragraph("<b>Amount (₹)</b>", bold_style_right)], 
+            [Paragraph("Basic", right_align_style), Paragraph(f"₹ {salary_details['basic']:,.2f}", right_align_style), Paragraph("EPF", right_align_style), Paragraph(f"₹ {salary_details['epf']:,.2f}", right_align_style)], 
+            [Paragraph("HRA", right_align_style), Paragraph(f"₹ {salary_details['hra']:,.2f}", right_align_style), Paragraph("Professional Tax", right_align_style), Paragraph(f"₹ {salary_details['prof_tax']:,.2f}", right_align_style)], 
+            [Paragraph("Special Allowance", right_align_style), Paragraph(f"₹ {salary_details['special_allowance']:,.2f}", right_align_style), Paragraph("Income Tax", right_align_style), Paragraph(f"₹ {salary_details['income_tax']:,.2f}", right_align_style)], 
+            [Paragraph("<b>Gross Pay</b>", bold_style_right), Paragraph(f"<b>₹ {salary_details['gross']:,.2f}</b>", bold_style_right), Paragraph("<b>Total Deductions</b>", bold_style_right), Paragraph(f"<b>₹ {salary_details['total_ded']:,.2f}</b>", bold_style_right)], 
+        ] 
+
+        table = Table(data, colWidths=['25%', '25%', '25%', '25%'])
+        table.setStyle(self.salary_table_style)
+        elements.append(table) 
+        elements.append(Spacer(1, 20))
+
+        # --- Combined Net Pay and "In Words" table ---
+        net_pay_in_words = f"<b>In Words: </b> {salary_details['net_in_words']}"
+        summary_data = [[
+            Paragraph(f"<b>Net Pay: ₹ {salary_details['net']:,.2f}</b>", bold_style_right),
+            Paragraph(net_pay_in_words, right_align_style)
+        ]]
+
+        summary_table = Table(summary_data, colWidths=['40%', '60%'])
+        summary_table.setStyle(self.summary_table_style)
+        elements.append(summary_table)
+        return elements
+
+    def record_timings(self, **timings):
+        """Stores the stage timings of the slip just rendered and adds them to the run totals."""
+        self.last_timings = timings
+        self.slip_count += 1
+        for stage, seconds in timings.items():
+            self._timing_totals[stage] = self._timing_totals.get(stage, 0.0) + seconds
+            metrics.observe(f"render_{stage}_seconds", seconds)
+
+    def timing_summary(self):
+        """Returns the average seconds per slip for each stage rendered with this template."""
+        if not self.slip_count:
+            return {}
+        return {stage: total / self.slip_count for stage, total in self._timing_totals.items()}
+
+_default_templates = {} # profile -> template
+
+def get_default_template(profile=None):
+    """Returns the template shared by every slip rendered in this process, building it on first use."""
+    profile = profile or config.PDF_PROFILE
+    template = _default_templates.get(profile)
+    if template is None:
+        template = _default_templates[profile] = PayslipTemplate(profile)
+    return template
+
+def payslip_output_dir(pay_period, entity=None):
+    """
+    Returns the archive folder for a pay period, e.g. Payslips_Apr_2025 under config.OUTPUT_ROOT.
+    Batch runs over several workbooks (see batch.py) give each one its own entity
+    folder: OUTPUT_ROOT/<entity>/Payslips_Apr_2025.
+    """
+    root = Path(config.OUTPUT_ROOT) if entity is None else Path(config.OUTPUT_ROOT) / entity
+    return root / f"Payslips_{pay_period.strftime('%b_%Y')}"
+
+def employee_output_dir(employee_data):
+    """Returns the archive folder for an employee row, from its Period and, in batch runs, its Entity."""
+    return payslip_output_dir(employee_data['Period'], employee_data.get('Entity'))
+
+def _render_payslip(target, employee_data, salary_details, template, engine):
+    """
+    Renders one payslip into target, a file path or a writable buffer.
+    engine is "platypus" (flowable layout) or "canvas" (fixed-coordinate fast path);
+    it defaults to config.RENDER_ENGINE.
+    """
+    template = template or get_default_template()
+    engine = engine or config.RENDER_ENGINE
+    started = time.perf_counter()
     try:
-        logo = Image(resource_path("company_logo.png"), width=200, height=80)
-    except:
-        logo = Paragraph("<b>LOGO</b>", bold_style)
-
-    company_address = f"""
-        <b>{config.COMPANY_NAME}</b><br/>
-        {config.COMPANY_ADDR_LINE1}<br/>
-        {config.COMPANY_ADDR_LINE2}<br/>
-        {config.COMPANY_ADDR_LINE3}
-    """
-    header_data = [[logo, Paragraph(company_address, right_align_style)]]
-    
-    header_table = Table(header_data, colWidths=['50%', '50%'])
-    header_table.setStyle(TableStyle([
-        ('VALIGN', (0,0), (0,0), 'TOP'),
-    ]))
-    elements.append(header_table)
-
-    elements.append(Paragraph(f"<b>Payslip for {employee_data['Period'].strftime('%B %Y')}</b>", ParagraphStyle("heading", fontName="DejaVuSans-Bold", fontSize=13, alignment=1, spaceBefore=15, spaceAfter=15)))
-
-    # --- Bordered table for Employee Details ---
-    doj = employee_data['Date_of_Joining']
-    if isinstance(doj, pd.Timestamp):
-        doj_str = doj.strftime('%d-%b-%Y')
+        _build_payslip(target, employee_data, salary_details, template, engine, started)
+    except Exception:
+        metrics.count("render_errors")
+        raise
+    metrics.observe("render_seconds", time.perf_counter() - started)
+    metrics.count("payslips_rendered")
+
+def _build_payslip(target, employee_data, salary_details, template, engine, started):
+    if engine == "canvas":
+        prepared = time.perf_counter()
+        canv = canvas.Canvas(target, pagesize=A4, pageCompression=template.page_compression, invariant=template.invariant)
+        draw_payslip_canvas(canv, employee_data, salary_details, template)
+        canv.showPage()
+        assembled = time.perf_counter()
+        canv.save()
+    elif engine == "platypus":
+        doc = SimpleDocTemplate(target, pagesize=A4, rightMargin=40, leftMargin=40, topMargin=40, bottomMargin=40,
+                                pageCompression=template.page_compression, invariant=template.invariant)
+        prepared = time.perf_counter()
+        elements = template.build_elements(employee_data, salary_details)
+        assembled = time.perf_counter()
+        doc.build(elements)
     else:
-        doj_str = str(doj)
-
-    details_data = [
-        [Paragraph('<b>Employee Name</b>', bold_style), employee_data['Employee_Name'], Paragraph('<b>Bank Name</b>', bold_style), employee_data['Bank_Name']],
-        [Paragraph('<b>Employee Number</b>', bold_style), employee_data['Employee_ID'], Paragraph('<b>Bank Account No</b>', bold_style), employee_data['Bank_Account_No']],
-        [Paragraph('<b>Department</b>', bold_style), employee_data['Department'], Paragraph('<b>PAN Number</b>', bold_style), employee_data['PAN_Number']],
-        [Paragraph('<b>Designation</b>', bold_style), employee_data['Designation'], Paragraph('<b>PF Account Number</b>', bold_style), employee_data['PF_Account_Number']],
-        [Paragraph('<b>Location</b>', bold_style), employee_data['Location'], Paragraph('<b>ESI Number</b>', bold_style), employee_data['ESI_Number']],
-        [Paragraph('<b>Date of Joining</b>', bold_style), doj_str, Paragraph('<b>UAN Number</b>', bold_style), employee_data['UAN_Number']],
-        [Paragraph('<b>Days Worked</b>', bold_style), employee_data['Days_Worked'], Paragraph('<b>LOP Days</b>', bold_style), employee_data['LOP_Days']],
-    ]
-    
-    details_table = Table(details_data, colWidths=['25%', '25%', '25%', '25%'])
-    details_table.setStyle(TableStyle([
-        ('FONTNAME', (0,0), (-1,-1), 'DejaVuSans'),
-        ('FONTSIZE', (0,0), (-1,-1), 9),
-        ('GRID', (0,0), (-1,-1), 0.5, colors.black),
-        # Style for the label columns (0 and 2)
-        ('BACKGROUND', (0,0), (0,-1), colors.lightgrey),
-        ('BACKGROUND', (2,0), (2,-1), colors.lightgrey),
-        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-        ('TOPPADDING', (0,0), (-1,-1), 4),
-        ('BOTTOMPADDING', (0,0), (-1,-1), 4),
-        # Style for the value columns (1 and 3)
-        ('ALIGN', (1,0), (1,-1), 'LEFT'),
-        ('ALIGN', (3,0), (3,-1), 'LEFT'),
-    ]))
-    elements.append(details_table)
-    elements.append(Spacer(1, 20))
-
-    # --- Salary Table ---
-    data = [
-        [Paragraph("<b>Earnings</b>", bold_style_right), Paragraph("<b>Amount (₹)</b>", bold_style_right), Paragraph("<b>Deductions</b>", bold_style_right), Paragraph("<b>Amount (₹)</b>", bold_style_right)], 
-        [Paragraph("Basic", right_align_style), Paragraph(f"₹ {salary_details['basic']:,.2f}", right_align_style), Paragraph("EPF", right_align_style), Paragraph(f"₹ {salary_details['epf']:,.2f}", right_align_style)], 
-        [Paragraph("HRA", right_align_style), Paragraph(f"₹ {salary_details['hra']:,.2f}", right_align_style), Paragraph("Professional Tax", right_align_style), Paragraph(f"₹ {salary_details['prof_tax']:,.2f}", right_align_style)], 
-        [Paragraph("Special Allowance", right_align_style), Paragraph(f"₹ {salary_details['special_allowance']:,.2f}", right_align_style), Paragraph("Income Tax", right_align_style), Paragraph(f"₹ {salary_details['income_tax']:,.2f}", right_align_style)], 
-        [Paragraph("<b>Gross Pay</b>", bold_style_right), Paragraph(f"<b>₹ {salary_details['gross']:,.2f}</b>", bold_style_right), Paragraph("<b>Total Deductions</b>", bold_style_right), Paragraph(f"<b>₹ {salary_details['total_ded']:,.2f}</b>", bold_style_right)], 
-    ] 
-    
-    # ... Table styling ... 
-    table = Table(data, colWidths=['25%', '25%', '25%', '25%'])
-    table.setStyle(TableStyle([ 
-        ("FONTNAME", (0,1), (0,-2), "DejaVuSans"),
-        ("FONTNAME", (2,1), (2,-2), "DejaVuSans"),
-        ("BACKGROUND", (0,0), (-1,0), colors.lightgrey),
-        ("GRID", (0,0), (-1,-1), 0.5, colors.black),
-        ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
-        ("BACKGROUND", (0,-1), (-1,-1), colors.whitesmoke), 
-    ])) 
-
-    elements.append(table) 
-    elements.append(Spacer(1, 20))
-
-    # --- Combined Net Pay and "In Words" table ---
-    net_pay_in_words = f"<b>In Words: </b> {salary_details['net_in_words']}"
-    summary_data = [[
-        Paragraph(f"<b>Net Pay: ₹ {salary_details['net']:,.2f}</b>", bold_style_right),
-        Paragraph(net_pay_in_words, right_align_style)
-    ]]
-
-    summary_table = Table(summary_data, colWidths=['40%', '60%'])
-    summary_table.setStyle(TableStyle([
-        ('GRID', (0,0), (-1,-1), 0.5, colors.black),
-        ('BACKGROUND', (0,0), (-1,-1), colors.lightgreen),
-        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-        ('FONTSIZE', (0,0), (-1,-1), 10),
-        ('FONTNAME', (0,0), (0,0), 'DejaVuSans-Bold'),
-    ]))
-    elements.append(summary_table)
-
-    doc.build(elements)
+        raise ValueError(f"Unknown render engine: {engine}")
+    built = time.perf_counter()
+    template.record_timings(prepare=prepared - started, elements=assembled - prepared, build=built - assembled)
+
+def _record_pdf_size(size):
+    metrics.observe("pdf_bytes", size, buckets=metrics.SIZE_BUCKETS)
+
+# --- Content-addressed payslip store ---
+def payslip_key(employee_data, salary_details, template=None, engine=None):
+    """Hashes the employee row, the salary result and the template version into the slip's store key."""
+    template = template or get_default_template()
+    payload = {
+        "row": {str(field): str(value) for field, value in dict(employee_data).items()},
+        "salary": {field: str(value) for field, value in salary_details.items()},
+        "template": template.version_key,
+        "engine": engine or config.RENDER_ENGINE,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+def _store_path(key):
+    return Path(config.CACHE_DIR) / "payslips" / key[:2] / f"{key}.pdf"
+
+def _render_or_reuse(employee_data, salary_details, template, engine):
+    """
+    Returns the slip's PDF bytes, taken from the payslip store when an identical slip
+    was rendered before (same row, salary, template and engine), else rendered and
+    added to the store.
+    """
+    template = template or get_default_template()
+    store_path = _store_path(payslip_key(employee_data, salary_details, template, engine)) if config.PDF_STORE else None
+    if store_path is not None:
+        try:
+            pdf_bytes = store_path.read_bytes()
+            os.utime(store_path) # Mark as recently used for pruning
+            metrics.count("pdf_store_hits")
+            return pdf_bytes
+        except OSError:
+            metrics.count("pdf_store_misses")
+
+    buffer = io.BytesIO()
+    _render_payslip(buffer, employee_data, salary_details, template, engine)
+    pdf_bytes = buffer.getvalue()
+    if store_path is not None:
+        try:
+            store_path.parent.mkdir(parents=True, exist_ok=True)
+            # Unique temporary name, as render workers may store the same slip at once
+            tmp_path = store_path.with_name(f"{store_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp_path.write_bytes(pdf_bytes)
+            tmp_path.replace(store_path)
+        except OSError as e:
+            print(f"Could not add the payslip to the store: {e}")
+    return pdf_bytes
+
+def prune_payslip_store(max_mb=None, max_days=None):
+    """
+    Deletes slips not used for PDF_STORE_MAX_DAYS, then the least recently used ones
+    until the store fits in PDF_STORE_MAX_MB.
+    """
+    max_bytes = (config.PDF_STORE_MAX_MB if max_mb is None else max_mb) * 1024 * 1024
+    oldest = time.time() - (config.PDF_STORE_MAX_DAYS if max_days is None else max_days) * 24 * 3600
+    entries = []
+    for entry in (Path(config.CACHE_DIR) / "payslips").glob("*/*.pdf"):
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        if stat.st_mtime < oldest:
+            entry.unlink(missing_ok=True)
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry))
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries, key=lambda item: item[0]):
+        if total <= max_bytes:
+            break
+        entry.unlink(missing_ok=True)
+        total -= size
+
+def create_payslip(employee_data, salary_details, template=None, engine=None):
+    """
+    Generates and saves a single PDF payslip with the new layout.
+    An identical slip from the payslip store is reused, and an existing file that
+    already holds exactly these bytes is left untouched.
+    """
+    print(f"Generating payslip for {employee_data['Employee_Name']}...")
+    output_dir = employee_output_dir(employee_data)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    pdf_path = output_dir / f"{employee_data['Employee_Name']}.pdf"
+    if config.PDF_STORE:
+        pdf_bytes = _render_or_reuse(employee_data, salary_details, template, engine)
+        if not (pdf_path.exists() and pdf_path.stat().st_size == len(pdf_bytes) and pdf_path.read_bytes() == pdf_bytes):
+            pdf_path.write_bytes(pdf_bytes)
+    else:
+        _render_payslip(str(pdf_path), employee_data, salary_details, template, engine)
+    if metrics.enabled():
+        _record_pdf_size(os.path.getsize(pdf_path))
     print(f"Successfully created payslip for {employee_data['Employee_Name']}: {pdf_path}")
 
-    return pdf_path, output_dir
\ No newline at end of file
+    return pdf_path, output_dir
+
+def render_payslip_bytes(employee_data, salary_details, template=None, engine=None):
+    """
+    Renders a single payslip into memory instead of a file (or reuses it from the payslip store).
+    Returns (pdf_bytes, pdf_name, output_dir) so the caller can email it straight
+    away and archive it later under output_dir / pdf_name.
+    """
+    print(f"Generating payslip for {employee_data['Employee_Name']}...")
+    pdf_bytes = _render_or_reuse(employee_data, salary_details, template, engine)
+    _record_pdf_size(len(pdf_bytes))
+    return pdf_bytes, f"{employee_data['Employee_Name']}.pdf", employee_output_dir(employee_data)
+
+def profile_size_report(employee_rows, salary_details_list, engine=None):
+    """
+    Renders the same slips in memory with every PDF profile and returns the average
+    attachment size of each, plus how much smaller the optimized one is, e.g.
+    {"standard": 1455965, "optimized": 70698, "reduction_percent": 95.1}.
+    Always renders, bypassing the payslip store.
+    """
+    report = {}
+    for profile in PDF_PROFILES:
+        template = get_default_template(profile)
+        sizes = []
+        for employee_data, salary_details in zip(employee_rows, salary_details_list):
+            buffer = io.BytesIO()
+            _render_payslip(buffer, employee_data, salary_details, template, engine)
+            sizes.append(len(buffer.getvalue()))
+        report[profile] = round(sum(sizes) / len(sizes)) if sizes else 0
+    if report["standard"]:
+        report["reduction_percent"] = round(100 * (1 - report["optimized"] / report["standard"]), 1)
+    return report
+
+class PayslipArchiver:
+    """
+    Writes in-memory payslips to disk on a background thread, a batch at a time,
+    so a slow or network-mounted archive folder never holds up rendering or sending.
+    """
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or config.ARCHIVE_BATCH_SIZE
+        self._queue = queue.Queue(maxsize=self.batch_size * 4)
+        self._created_dirs = set()
+        self.written = 0
+        self.errors = []
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, pdf_path, pdf_bytes):
+        """Queues one payslip for writing; blocks only if the writer is several batches behind."""
+        self._queue.put((Path(pdf_path), pdf_bytes))
+
+    def _write_batch(self, batch):
+        for pdf_path, pdf_bytes in batch:
+            try:
+                if pdf_path.parent not in self._created_dirs:
+                    pdf_path.parent.mkdir(parents=True, exist_ok=True)
+                    self._created_dirs.add(pdf_path.parent)
+                pdf_path.write_bytes(pdf_bytes)
+                self.written += 1
+                metrics.count("archive_bytes", len(pdf_bytes))
+            except OSError as e:
+                metrics.count("archive_errors")
+                self.errors.append(f"Failed to archive {pdf_path}: {e}")
+                print(self.errors[-1])
+
+    def _run(self):
+        finished = False
+        while not finished:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                batch.pop()
+                finished = True
+            self._write_batch(batch)
+
+    def close(self):
+        """Writes everything still queued and stops the background writer."""
+        self._queue.put(None)
+        self._thread.join()
+
+# --- Canvas fast path ---
+# The payslip layout never changes, so the canvas engine draws it at fixed
+# coordinates that mirror what Platypus computes for the same A4 page with
+# 40pt margins (plus the 6pt frame padding), skipping measure/wrap/split.
+PAGE_WIDTH, PAGE_HEIGHT = A4
+CONTENT_X = 40 + 6
+CONTENT_WIDTH = PAGE_WIDTH - 2 * CONTENT_X
+CONTENT_TOP = PAGE_HEIGHT - 40 - 6
+CELL_PADDING = 6
+QUARTER_WIDTH = CONTENT_WIDTH / 4
+HEADER_HEIGHT = 80 + 2 * 3 # Logo height plus the default cell padding
+TITLE_SPACE = 15 # spaceBefore/spaceAfter of the heading style
+DETAILS_ROW_HEIGHT = 12 + 4 + 4
+SALARY_ROW_HEIGHT = 12 + 3 + 3
+SECTION_GAP = 20
+SUMMARY_SPLIT = CONTENT_WIDTH * 0.40
+LINE_LEADING = 12
+
+def _draw_grid_table(canv, top, row_height, rows, backgrounds):
+    """Draws the cell backgrounds and the 0.5pt grid of a 4-column table. Returns the bottom y."""
+    bottom = top - row_height * rows
+    for (col_start, row_start, col_end, row_end), color in backgrounds:
+        canv.setFillColor(color)
+        x = CONTENT_X + col_start * QUARTER_WIDTH
+        y = top - (row_end + 1) * row_height
+        canv.rect(x, y, (col_end - col_start + 1) * QUARTER_WIDTH, (row_end - row_start + 1) * row_height, stroke=0, fill=1)
+    canv.setFillColor(colors.black)
+    canv.setLineWidth(0.5)
+    canv.grid([CONTENT_X + i * QUARTER_WIDTH for i in range(5)], [top - i * row_height for i in range(rows + 1)])
+    return bottom
+
+def draw_payslip_canvas(canv, employee_data, salary_details, template):
+    """Draws one payslip page straight onto a ReportLab canvas using the fixed layout."""
+    # --- Header: logo on the left, company address right-aligned ---
+    header_bottom = CONTENT_TOP - HEADER_HEIGHT
+    if template.logo_reader is not None:
+        canv.drawImage(template.logo_reader, CONTENT_X + CELL_PADDING, header_bottom + 3, width=LOGO_SIZE[0], height=LOGO_SIZE[1], mask="auto")
+    else:
+        canv.setFont("DejaVuSans-Bold", 9)
+        canv.drawString(CONTENT_X + CELL_PADDING, CONTENT_TOP - 3 - 9, "LOGO")
+    address_right = CONTENT_X + CONTENT_WIDTH - CELL_PADDING
+    address_lines = [config.COMPANY_NAME, config.COMPANY_ADDR_LINE1, config.COMPANY_ADDR_LINE2, config.COMPANY_ADDR_LINE3]
+    baseline = header_bottom + 3 + LINE_LEADING * len(address_lines) - 9
+    # The Platypus path renders the <b> company name in the regular face, so match it
+    canv.setFont("DejaVuSans", 9)
+    for line in address_lines:
+        canv.drawRightString(address_right, baseline, line)
+        baseline -= LINE_LEADING
+
+    # --- Title ---
+    canv.setFont("DejaVuSans-Bold", 13)
+    canv.drawCentredString(CONTENT_X + CONTENT_WIDTH / 2, header_bottom - TITLE_SPACE - 13, f"Payslip for {employee_data['Period'].strftime('%B %Y')}")
+
+    # --- Employee Details grid ---
+    details_rows = [
+        ('Employee Name', employee_data['Employee_Name'], 'Bank Name', employee_data['Bank_Name']),
+        ('Employee Number', employee_data['Employee_ID'], 'Bank Account No', employee_data['Bank_Account_No']),
+        ('Department', employee_data['Department'], 'PAN Number', employee_data['PAN_Number']),
+        ('Designation', employee_data['Designation'], 'PF Account Number', employee_data['PF_Account_Number']),
+        ('Location', employee_data['Location'], 'ESI Number', employee_data['ESI_Number']),
+        ('Date of Joining', employee_data['Date_of_Joining'], 'UAN Number', employee_data['UAN_Number']),
+        ('Days Worked', employee_data['Days_Worked'], 'LOP Days', employee_data['LOP_Days']),
+    ]
+    details_top = header_bottom - 2 * TITLE_SPACE - LINE_LEADING
+    _draw_grid_table(canv, details_top, DETAILS_ROW_HEIGHT, len(details_rows),
+                     [((0, 0, 0, 6), colors.lightgrey), ((2, 0, 2, 6), colors.lightgrey)])
+    for row, cells in enumerate(details_rows):
+        baseline = details_top - (row + 1) * DETAILS_ROW_HEIGHT + 7
+        for col, value in enumerate(cells):
+            canv.setFont("DejaVuSans-Bold" if col % 2 == 0 else "DejaVuSans", 9)
+            canv.drawString(CONTENT_X + col * QUARTER_WIDTH + CELL_PADDING, baseline, str(value))
+
+    # --- Salary grid (every cell right-aligned) ---
+    def amount(key):
+        return f"₹ {salary_details[key]:,.2f}"
+    salary_rows = [
+        ("Earnings", "Amount (₹)", "Deductions", "Amount (₹)"),
+        ("Basic", amount('basic'), "EPF", amount('epf')),
+        ("HRA", amount('hra'), "Professional Tax", amount('prof_tax')),
+        ("Special Allowance", amount('special_allowance'), "Income Tax", amount('income_tax')),
+        ("Gross Pay", amount('gross'), "Total Deductions", amount('total_ded')),
+    ]
+    salary_top = details_top - len(details_rows) * DETAILS_ROW_HEIGHT - SECTION_GAP
+    salary_bottom = _draw_grid_table(canv, salary_top, SALARY_ROW_HEIGHT, len(salary_rows),
+                                     [((0, 0, 3, 0), colors.lightgrey), ((0, 4, 3, 4), colors.whitesmoke)])
+    for row, cells in enumerate(salary_rows):
+        bold = row in (0, len(salary_rows) - 1)
+        canv.setFont("DejaVuSans-Bold" if bold else "DejaVuSans", 9)
+        baseline = salary_top - (row + 1) * SALARY_ROW_HEIGHT + 6
+        for col, text in enumerate(cells):
+            canv.drawRightString(CONTENT_X + (col + 1) * QUARTER_WIDTH - CELL_PADDING, baseline, text)
+
+    # --- Net pay bar with the amount in words wrapped on the right ---
+    words_lines = simpleSplit(f"In Words: {salary_details['net_in_words']}", "DejaVuSans", 9,
+                              CONTENT_WIDTH - SUMMARY_SPLIT - 2 * CELL_PADDING)
+    summary_height = LINE_LEADING * len(words_lines) + 6
+    summary_top = salary_bottom - SECTION_GAP
+    summary_bottom = summary_top - summary_height
+    canv.setFillColor(colors.lightgreen)
+    canv.rect(CONTENT_X, summary_bottom, CONTENT_WIDTH, summary_height, stroke=0, fill=1)
+    canv.setFillColor(colors.black)
+    canv.grid([CONTENT_X, CONTENT_X + SUMMARY_SPLIT, CONTENT_X + CONTENT_WIDTH], [summary_top, summary_bottom])
+
+    canv.setFont("DejaVuSans-Bold", 9)
+    canv.drawRightString(CONTENT_X + SUMMARY_SPLIT - CELL_PADDING, summary_bottom + summary_height / 2 - 3,
+                         f"Net Pay: ₹ {salary_details['net']:,.2f}")
+    canv.setFont("DejaVuSans", 9)
+    baseline = summary_top - 3 - 9
+    for line in words_lines:
+        canv.drawRightString(CONTENT_X + CONTENT_WIDTH - CELL_PADDING, baseline, line)
+        baseline -= LINE_LEADING
+
+# --- Bulk outputs: one combined PDF and one ZIP per pay period ---
+def combined_pdf_path(pay_period, entity=None):
+    """Returns the combined multi-page PDF for a pay period, e.g. Payslips_Apr_2025/All_Payslips_Apr_2025.pdf."""
+    return payslip_output_dir(pay_period, entity) / f"All_Payslips_{pay_period.strftime('%b_%Y')}.pdf"
+
+def zip_archive_path(pay_period, entity=None):
+    """Returns the ZIP of every payslip for a pay period, e.g. Payslips_Apr_2025/Payslips_Apr_2025.zip."""
+    return payslip_output_dir(pay_period, entity) / f"Payslips_{pay_period.strftime('%b_%Y')}.zip"
+
+def draw_payslip_page(canv, employee_data, salary_details, template=None, engine=None):
+    """
+    Draws one payslip as the next page of canv. For Platypus the slip's flowables are
+    laid out in a frame with SimpleDocTemplate's geometry, so the page matches the
+    individual PDF while every page shares the canvas's fonts and logo image.
+    """
+    template = template or get_default_template()
+    engine = engine or config.RENDER_ENGINE
+    if engine == "canvas":
+        draw_payslip_canvas(canv, employee_data, salary_details, template)
+    elif engine == "platypus":
+        frame = Frame(40, 40, PAGE_WIDTH - 80, PAGE_HEIGHT - 80)
+        elements = template.build_elements(employee_data, salary_details)
+        frame.addFromList(elements, canv)
+        if elements:
+            print(f"Payslip for {employee_data['Employee_Name']} did not fit on one page of the combined PDF.")
+    else:
+        raise ValueError(f"Unknown render engine: {engine}")
+    canv.showPage()
+
+class BulkPayslipWriter:
+    """
+    Produces the per-period bulk outputs next to (or instead of) the individual files:
+    a ZIP of every slip and one combined multi-page PDF. Both are written as slips
+    arrive, in the order they are added, so neither holds the month in memory. Each
+    file is built under a temporary name and only appears once close() finishes it.
+    """
+    def __init__(self, zip_archive=True, combined_pdf=True, template=None, engine=None):
+        self.zip_archive = zip_archive
+        self.combined_pdf = combined_pdf
+        self.template = template
+        self.engine = engine
+        self._zips = {} # final path -> open ZipFile
+        self._zip_names = {} # final path -> names already in the archive
+        self._canvases = {} # final path -> canvas
+        self.pages = 0
+        self.errors = []
+
+    def _zip_for(self, zip_path):
+        archive = self._zips.get(zip_path)
+        if archive is None:
+            zip_path.parent.mkdir(parents=True, exist_ok=True)
+            archive = zipfile.ZipFile(zip_path.with_suffix(".zip.tmp"), "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1)
+            self._zips[zip_path] = archive
+            self._zip_names[zip_path] = set()
+        return archive
+
+    def _unique_name(self, zip_path, pdf_name):
+        """Employees who share a name get 'Name (2).pdf' instead of a duplicate entry."""
+        names = self._zip_names[zip_path]
+        stem, suffix, count = pdf_name[:-4], pdf_name[-4:], 1
+        while pdf_name in names:
+            count += 1
+            pdf_name = f"{stem} ({count}){suffix}"
+        names.add(pdf_name)
+        return pdf_name
+
+    def _canvas_for(self, pdf_path):
+        canv = self._canvases.get(pdf_path)
+        if canv is None:
+            pdf_path.parent.mkdir(parents=True, exist_ok=True)
+            template = self.template or get_default_template()
+            canv = canvas.Canvas(str(pdf_path.with_suffix(".pdf.tmp")), pagesize=A4,
+                                 pageCompression=template.page_compression, invariant=template.invariant)
+            self._canvases[pdf_path] = canv
+        return canv
+
+    def add(self, employee_data, salary_details, pdf_name, pdf_bytes=None, pdf_path=None):
+        """Adds one payslip: the rendered PDF (bytes, or a file on disk) to the ZIP and a page to the combined PDF."""
+        period, entity = employee_data['Period'], employee_data.get('Entity')
+        if self.zip_archive:
+            try:
+                zip_path = zip_archive_path(period, entity)
+                archive = self._zip_for(zip_path)
+                name = self._unique_name(zip_path, pdf_name)
+                if pdf_bytes is None and pdf_path is not None and Path(pdf_path).exists():
+                    archive.write(pdf_path, name)
+                else:
+                    if pdf_bytes is None: # Nothing kept from an earlier run; render it again for the archive
+                        pdf_bytes, _, _ = render_payslip_bytes(employee_data, salary_details, self.template, self.engine)
+                    archive.writestr(name, pdf_bytes)
+            except Exception as e:
+                self.errors.append(f"Failed to add {pdf_name} to the ZIP archive: {e}")
+                print(self.errors[-1])
+        if self.combined_pdf:
+            try:
+                draw_payslip_page(self._canvas_for(combined_pdf_path(period, entity)), employee_data, salary_details,
+                                  self.template, self.engine)
+                self.pages += 1
+            except Exception as e:
+                self.errors.append(f"Failed to add {employee_data['Employee_Name']} to the combined PDF: {e}")
+                print(self.errors[-1])
+
+    def close(self):
+        """Finishes every ZIP and combined PDF and returns their paths."""
+        written = []
+        for zip_path, archive in self._zips.items():
+            archive.close()
+            zip_path.with_suffix(".zip.tmp").replace(zip_path)
+            written.append(zip_path)
+        for pdf_path, canv in self._canvases.items():
+            canv.save()
+            pdf_path.with_suffix(".pdf.tmp").replace(pdf_path)
+            written.append(pdf_path)
+        self._zips.clear()
+        self._canvases.clear()
+        return written
+
+# --- Parallel rendering ---
+# Settings a render worker process must share with the parent, which may have
+# changed them at runtime (e.g. from command-line options)
+WORKER_SETTINGS = ("OUTPUT_ROOT", "CACHE_DIR", "RENDER_ENGINE", "PDF_PROFILE", "DETERMINISTIC_PDFS", "PDF_STORE",
+                   "METRICS_ENABLED")
+
+def worker_settings():
+    """Snapshots the settings that render worker processes need from this process."""
+    return {name: getattr(config, name) for name in WORKER_SETTINGS}
+
+def init_render_worker(settings=None):
+    """Prepares a render worker process: applies the parent's settings and registers fonts once."""
+    for name, value in (settings or {}).items():
+        setattr(config, name, value)
+    metrics.reset() # A forked worker starts with a copy of the parent's metrics; only report its own
+    register_fonts()
+
+def _render_job(job):
+    employee_data, salary_details, engine, in_memory = job
+    if in_memory:
+        return render_payslip_bytes(employee_data, salary_details, engine=engine)
+    return create_payslip(employee_data, salary_details, engine=engine)
+
+def resolve_render_workers(workers=None):
+    """Returns the number of render processes to use; 0 or None means one per CPU core."""
+    if workers is None:
+        workers = config.RENDER_WORKERS
+    return workers if workers > 0 else (os.cpu_count() or 1)
+
+def create_payslips_parallel(employee_rows, salary_details_list, workers=None, engine=None, in_memory=False):
+    """
+    Renders a batch of payslips across a pool of worker processes.
+    Fonts are registered once per worker. Returns the (pdf_path, output_dir)
+    results, or the render_payslip_bytes results when in_memory is set, in the
+    same order as the input rows. Renders serially when only
+    one worker is requested or the process pool cannot be used.
+    """
+    jobs = [(employee_data, salary_details, engine, in_memory) for employee_data, salary_details in zip(employee_rows, salary_details_list)]
+    workers = min(resolve_render_workers(workers), len(jobs))
+
+    if workers > 1:
+        try:
+            chunksize = max(1, len(jobs) // (workers * 4))
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_render_worker, initargs=(worker_settings(),)) as pool:
+                collected = pool.map(partial(metrics.collect, _render_job), jobs, chunksize=chunksize)
+                return [metrics.unwrap(result) for result in collected]
+        except (OSError, BrokenProcessPool) as e:
+            print(f"Parallel rendering unavailable ({e}). Falling back to serial rendering.")
+
+    return [_render_job(job) for job in jobs]
@@ -0,0 +1,491 @@
+# pipeline.py
+import queue
+import threading
+import time
+from collections import deque
+from itertools import chain
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+import calculations
+import config
+import data_handler
+import email_sender
+import manifest
+import metrics
+import pdf_generator
+import retry_queue
+
+_END = object() # Sentinel telling a sender worker that rendering is finished
+
+def _new_result(employee_row):
+    return {
+        "employee_name": employee_row['Employee_Name'],
+        "employee_email": employee_row.get('Employee_Email'),
+        "entity": employee_row.get('Entity'),
+        "pdf_path": None, "pdf_name": None, "pdf_bytes": None,
+        "rendered": False, "sent": False, "skipped": False, "cancelled": False, "error": None,
+        "attempts": 0, "dead_letter": None,
+    }
+
+def _cancelled(cancel):
+    return cancel is not None and cancel.is_set()
+
+class _InputOrder:
+    """
+    Hands slips to a BulkPayslipWriter in input order. Resumed slips are ready at once
+    while earlier rows are still rendering in parallel, so each slip waits here,
+    by its row index, until every row before it has been added or skipped.
+    """
+    def __init__(self, bulk):
+        self._bulk = bulk
+        self._next = 0
+        self._waiting = {}
+
+    def add(self, index, *args, **kwargs):
+        self._waiting[index] = (args, kwargs)
+        self._release()
+
+    def skip(self, index):
+        """Marks a row that has no slip for the bulk outputs (its render failed)."""
+        self._waiting[index] = None
+        self._release()
+
+    def _release(self):
+        while self._next in self._waiting:
+            entry = self._waiting.pop(self._next)
+            if entry is not None:
+                self._bulk.add(*entry[0], **entry[1])
+            self._next += 1
+
+def _check_manifest(slip_queue, index, employee_row, salary_details, manifest, bulk=None):
+    """
+    Looks the row up in the delivery manifest and returns (row_hash, needs_render).
+    Rows that need no rendering are queued straight to the senders (and still
+    added to the bulk outputs, so those cover the whole period).
+    """
+    if manifest is None:
+        return None, True
+    action, current_hash, pdf_path = manifest.plan(employee_row, salary_details)
+    if action == "render":
+        return current_hash, True
+    result = _new_result(employee_row)
+    result["pdf_path"] = Path(pdf_path) if pdf_path else None
+    result["pdf_name"] = result["pdf_path"].name if pdf_path else None
+    if action == "skip":
+        result["skipped"] = True
+        print(f"Skipping {result['employee_name']}: payslip already sent and unchanged.")
+    else:
+        result["rendered"] = True # Reuse the unchanged PDF from the last run, only send it
+    if bulk is not None:
+        bulk.add(index, employee_row, salary_details, result["pdf_name"] or f"{result['employee_name']}.pdf", pdf_path=result["pdf_path"])
+    slip_queue.put((index, employee_row, result))
+    return current_hash, False
+
+def _finish_render(slip_queue, index, employee_row, salary_details, render, archiver, manifest=None, current_hash=None, bulk=None):
+    """Runs one render callable, records the outcome and hands the slip to the senders."""
+    result = _new_result(employee_row)
+    try:
+        if archiver is False:
+            result["pdf_path"], _ = render()
+            result["pdf_name"] = result["pdf_path"].name
+        else:
+            result["pdf_bytes"], result["pdf_name"], output_dir = render()
+            if archiver is not None:
+                result["pdf_path"] = output_dir / result["pdf_name"]
+                archiver.submit(result["pdf_path"], result["pdf_bytes"])
+        result["rendered"] = True
+    except BrokenProcessPool:
+        raise # Not this payslip's fault: the render stage falls back to serial rendering
+    except Exception as e:
+        result["error"] = f"Failed to generate payslip for {result['employee_name']}: {e}"
+        print(result["error"])
+    if bulk is not None:
+        if result["rendered"]:
+            bulk.add(index, employee_row, salary_details, result["pdf_name"], result["pdf_bytes"], result["pdf_path"])
+        else:
+            bulk.skip(index)
+    if manifest is not None:
+        manifest.record_render(employee_row, current_hash, result["pdf_path"], result["pdf_bytes"], result["error"])
+    slip_queue.put((index, employee_row, result)) # Blocks while the senders are behind
+
+def _finish_oldest(in_flight, slip_queue, archiver, manifest, bulk):
+    """Finishes the oldest parallel render. It stays in in_flight until then, so a broken pool renders it again serially."""
+    index, employee_row, salary_details, current_hash, future = in_flight[0]
+    _finish_render(slip_queue, index, employee_row, salary_details, lambda: metrics.unwrap(future.result()),
+                   archiver, manifest, current_hash, bulk)
+    in_flight.popleft()
+
+def _render_stage(jobs, slip_queue, render_workers, engine, archiver, manifest=None, bulk=None, cancel=None):
+    """
+    Renders every job and pushes the finished slips onto the queue in input order.
+    jobs is consumed lazily, so it may be a generator still reading the workbook.
+    archiver is False to render straight to files, otherwise slips are rendered in
+    memory and handed to the archiver (None = do not archive).
+    With a manifest, rows that are unchanged since the last run are not rendered again.
+    Every slip, in input order, is also handed to bulk (a BulkPayslipWriter) if given.
+    Once cancel (a threading.Event) is set no new job is started; renders already
+    in flight are finished.
+    """
+    render = pdf_generator.create_payslip if archiver is False else pdf_generator.render_payslip_bytes
+    bulk = _InputOrder(bulk) if bulk is not None else None
+    jobs = enumerate(jobs)
+    if render_workers > 1:
+        # Keep only a couple of renders per worker in flight so finished slips never pile up in memory
+        in_flight = deque()
+        try:
+            with ProcessPoolExecutor(max_workers=render_workers, initializer=pdf_generator.init_render_worker,
+                                     initargs=(pdf_generator.worker_settings(),)) as pool:
+                for index, (employee_row, salary_details) in jobs:
+                    if _cancelled(cancel):
+                        break
+                    current_hash, needs_render = _check_manifest(slip_queue, index, employee_row, salary_details, manifest, bulk)
+                    if not needs_render:
+                        continue
+                    # Queued before submitting, so the job is not lost if the pool breaks on submit
+                    in_flight.append([index, employee_row, salary_details, current_hash, None])
+                    in_flight[-1][4] = pool.submit(metrics.collect, render, employee_row, salary_details, engine=engine)
+                    if len(in_flight) >= render_workers * 2:
+                        _finish_oldest(in_flight, slip_queue, archiver, manifest, bulk)
+                while in_flight:
+                    _finish_oldest(in_flight, slip_queue, archiver, manifest, bulk)
+        except (OSError, BrokenProcessPool) as e:
+            print(f"Parallel rendering unavailable ({e}). Falling back to serial rendering.")
+            # Whatever was still in flight is rendered again below, ahead of the remaining jobs
+            jobs = chain([(index, (employee_row, salary_details)) for index, employee_row, salary_details, _, _ in in_flight], jobs)
+
+    for index, (employee_row, salary_details) in jobs:
+        if _cancelled(cancel):
+            print("Run cancelled. No further payslips will be generated.")
+            break
+        current_hash, needs_render = _check_manifest(slip_queue, index, employee_row, salary_details, manifest, bulk)
+        if needs_render:
+            _finish_render(slip_queue, index, employee_row, salary_details,
+                           lambda: render(employee_row, salary_details, engine=engine), archiver, manifest, current_hash, bulk)
+
+def _should_send(item, send_fn, cancel):
+    """False for slips with nothing to send: not rendered, already sent, or (once cancel is set) cancelled."""
+    result = item[2]
+    if send_fn is None or not result["rendered"] or result["skipped"]:
+        return False
+    if _cancelled(cancel):
+        result["cancelled"] = True # Left "rendered" in the manifest, so a re-run sends it
+        return False
+    return True
+
+def _send_slip(item, send_fn, manifest, cancel, retries, dead_letters):
+    """
+    Sends one slip and records the outcome in its result (see _settle_send).
+    Returns False if it was handed to retries for another attempt.
+    """
+    if not _should_send(item, send_fn, cancel):
+        return True
+    index, employee_row, result = item
+    result["attempts"] += 1
+    try:
+        outcome = send_fn(employee_row, result)
+    except Exception as e:
+        outcome = e
+    return _settle_send(item, outcome, manifest, retries, dead_letters)
+
+def _settle_send(item, outcome, manifest, retries, dead_letters):
+    """
+    Records a send's outcome, the (ok, message) send_fn returned or the exception it
+    raised, in the slip's result. A transient failure is handed to retries for another
+    attempt after a backoff (returns False); other failures, and transient ones after
+    SEND_RETRIES, go to dead_letters. A slip that send_fn refuses by returning
+    (False, message), e.g. one without an email address, only fails: it cannot be
+    resent until the workbook is corrected.
+    """
+    index, employee_row, result = item
+    transient = refused = False
+    if isinstance(outcome, Exception):
+        transient = email_sender.is_transient_error(outcome)
+        result["error"] = f"Failed to send payslip to {result['employee_email']}: {outcome}"
+        if transient and retries is not None and result["attempts"] <= config.SEND_RETRIES:
+            delay = retry_queue.backoff_delay(result["attempts"])
+            print(f"{result['error']} Retrying in {delay:.1f}s (attempt {result['attempts'] + 1} of {config.SEND_RETRIES + 1}).")
+            metrics.count("send_retries")
+            result["error"] = None
+            retries.schedule(item, delay)
+            return False
+        print(result["error"])
+    else:
+        ok, message = outcome
+        result["sent"] = ok
+        if not ok:
+            refused = True
+            result["error"] = message
+            print(message)
+    if result["error"]:
+        metrics.count("send_errors")
+        if dead_letters is not None and not refused:
+            result["dead_letter"] = str(dead_letters.add(employee_row, result, "transient" if transient else "permanent"))
+    if manifest is not None:
+        manifest.record_send(employee_row, result["sent"], result["error"])
+    return True
+
+def _finish_slip(item, results, progress):
+    index, employee_row, result = item
+    result["pdf_bytes"] = None # Sent (or failed); the archiver holds its own reference
+    results[index] = result
+    if progress is not None:
+        progress(result)
+
+def _slip_error(item, results, error):
+    """Records an error raised while finishing a slip (e.g. a locked manifest or a failing progress callback) on its result."""
+    index, employee_row, result = item
+    result["error"] = result["error"] or f"Could not finish the payslip for {result['employee_name']}: {error}"
+    result["pdf_bytes"] = None
+    results[index] = result
+    print(result["error"])
+
+def _send_stage(slip_queue, send_fn, results, manifest=None, progress=None, cancel=None, retries=None, dead_letters=None):
+    """
+    Drains rendered slips from the queue and sends each one, until the end sentinel arrives.
+    Calls progress(result) as each employee is done. Once cancel is set, slips still
+    waiting are marked cancelled instead of sent. Transient send failures wait in
+    retries (a retry_queue.RetryQueue), which puts them back on the queue; undeliverable
+    slips are written to dead_letters (a retry_queue.DeadLetterLog). An error while
+    finishing one slip is recorded on its result and the sender carries on.
+    """
+    while True:
+        item = slip_queue.get()
+        if item is _END:
+            slip_queue.task_done()
+            return
+        retried = item[2]["attempts"] > 0
+        try:
+            if _send_slip(item, send_fn, manifest, cancel, retries, dead_letters):
+                _finish_slip(item, results, progress)
+        except Exception as e:
+            _slip_error(item, results, e)
+        finally:
+            if retried:
+                retries.done()
+            slip_queue.task_done()
+
+def _async_send_stage(slip_queue, send_fn, results, manifest=None, progress=None, cancel=None, retries=None, dead_letters=None):
+    """
+    _send_stage for an AsyncSend: this thread takes slips off the queue and submits
+    each send to the event loop, holding one of send_fn.max_in_flight semaphore slots
+    until it completes, so that many messages are in flight at once whatever
+    SEND_WORKERS is (and a full set of slots pauses the queue, and with it rendering).
+    Completed sends are recorded by a second thread, keeping manifest and dead-letter
+    writes off the event loop.
+    """
+    slots = threading.BoundedSemaphore(send_fn.max_in_flight)
+    completed = queue.Queue()
+
+    def settle():
+        while True:
+            entry = completed.get()
+            if entry is _END:
+                return
+            item, retried, future = entry
+            try:
+                try:
+                    outcome = future.result()
+                except Exception as e:
+                    outcome = e
+                if _settle_send(item, outcome, manifest, retries, dead_letters):
+                    _finish_slip(item, results, progress)
+            except Exception as e:
+                _slip_error(item, results, e)
+            finally:
+                slots.release()
+                if retried:
+                    retries.done()
+                slip_queue.task_done()
+
+    settler = threading.Thread(target=settle, daemon=True)
+    settler.start()
+    try:
+        while True:
+            item = slip_queue.get()
+            if item is _END:
+                slip_queue.task_done()
+                return
+            retried = item[2]["attempts"] > 0
+            if _should_send(item, send_fn, cancel):
+                slots.acquire()
+                item[2]["attempts"] += 1
+                try:
+                    future = send_fn.submit(send_fn.send(item[1], item[2]))
+                except Exception as e: # The loop is gone; settled as a failed send
+                    future = Future()
+                    future.set_exception(e)
+                future.add_done_callback(lambda future, item=item, retried=retried: completed.put((item, retried, future)))
+                continue
+            try:
+                _finish_slip(item, results, progress)
+            except Exception as e:
+                _slip_error(item, results, e)
+            finally:
+                if retried:
+                    retries.done()
+                slip_queue.task_done()
+    finally:
+        completed.put(_END)
+        settler.join()
+
+class AsyncSend:
+    """
+    A run_pipeline send_fn whose sends are coroutines on an event loop: send(employee_row,
+    result) returns (ok, message) or raises, like a plain send_fn; submit(coroutine)
+    schedules one and returns a concurrent.futures.Future. Up to max_in_flight sends
+    run at once.
+    """
+    def __init__(self, send, submit, max_in_flight):
+        self.send = send
+        self.submit = submit
+        self.max_in_flight = max_in_flight
+
+def _recipient(employee_row):
+    """The employee's email address, or None if the row has none."""
+    recipient_email = employee_row.get('Employee_Email')
+    return None if not recipient_email or recipient_email == 'N/A' else recipient_email
+
+def email_send_fn(server, sender_email):
+    """
+    Builds the run_pipeline send_fn that emails each payslip over `server` (a connection,
+    pool or transport). For an async_email_sender.AsyncSMTPPool it is an AsyncSend, so
+    the pool's sessions all carry messages at once.
+    """
+    import async_email_sender
+    if isinstance(server, async_email_sender.AsyncSMTPPool):
+        async def send_payslip_async(employee_row, slip):
+            recipient_email = _recipient(employee_row)
+            if recipient_email is None:
+                return False, f"No email address for {employee_row['Employee_Name']}, payslip not sent."
+            await server.deliver_payslip_async(sender_email, recipient_email, employee_row['Employee_Name'], employee_row['Period'],
+                                               pdf_path=slip['pdf_path'], pdf_bytes=slip['pdf_bytes'], pdf_name=slip['pdf_name'])
+            return True, "Email sent successfully!"
+        return AsyncSend(send_payslip_async, server.submit, server.size)
+
+    def send_payslip(employee_row, slip):
+        recipient_email = _recipient(employee_row)
+        if recipient_email is None:
+            return False, f"No email address for {employee_row['Employee_Name']}, payslip not sent."
+        # Raises on failure, so run_pipeline can retry transient errors
+        email_sender.deliver_payslip(server, sender_email, recipient_email, employee_row['Employee_Name'], employee_row['Period'],
+                                     pdf_path=slip['pdf_path'], pdf_bytes=slip['pdf_bytes'], pdf_name=slip['pdf_name'])
+        return True, "Email sent successfully!"
+    return send_payslip
+
+def iter_salary_jobs(employee_chunks, invalid_rows=None, periods=None):
+    """
+    Turns a stream of employee DataFrame chunks (e.g. a data_handler.EmployeeStream)
+    into (employee_row, salary_details) jobs, normalizing and calculating salaries one
+    chunk at a time. Invalid rows are reported, added to invalid_rows (if given) and
+    left out; periods, if given, collects every pay period seen.
+    Expects the essential columns to exist (check the stream's header first).
+    """
+    seen_keys = {} # Duplicate employees are caught across chunks too
+    for chunk in employee_chunks:
+        chunk, chunk_invalid_rows = data_handler.normalize_employee_data(chunk, seen_keys)
+        for problem in data_handler.format_invalid_rows(chunk_invalid_rows):
+            print(f"Skipping {problem}")
+        if invalid_rows is not None:
+            invalid_rows += chunk_invalid_rows
+        chunk = chunk.drop(index=[entry['row'] for entry in chunk_invalid_rows])
+        if periods is not None:
+            periods.update(chunk['Period'].drop_duplicates())
+        salary_by_index = calculations.calculate_salary_batch(chunk).to_dict('index')
+        for index, employee_row in chunk.iterrows():
+            yield employee_row, salary_by_index[index]
+
+def run_pipeline(jobs, send_fn, render_workers=None, send_workers=None, queue_size=None,
+                 engine=None, in_memory=None, archive=None, resume=None, combined_pdf=None, zip_archive=None,
+                 progress=None, cancel=None):
+    """
+    Renders and sends payslips as two overlapping stages joined by a bounded queue.
+    jobs is an iterable of (employee_row, salary_details) pairs and is read lazily.
+    Render workers push finished slips while sender threads drain them, so rendering
+    and SMTP round trips run at the same time, and a full queue pauses rendering.
+    With in_memory, PDFs travel to the senders as bytes and, with archive, are
+    written to Payslips_<Mon_YYYY> in the background.
+    send_fn(employee_row, result) returns (ok, message) or raises; result carries pdf_path,
+    pdf_name and pdf_bytes. An AsyncSend (see email_send_fn) is driven from one thread
+    with up to its max_in_flight sends in flight instead of send_workers threads. Pass send_fn=None to only generate the payslips. A failed render or send is recorded in that employee's
+    result and the run carries on with the rest.
+    Sends that raise a transient error (email_sender.is_transient_error) are tried
+    again up to SEND_RETRIES times after a jittered exponential backoff, without
+    holding up the other slips. Slips whose send still raised are written to
+    dead_letters.jsonl in their period folder (see retry_queue.resend_dead_letters).
+    With resume, a per-period delivery manifest makes the run incremental: rows already
+    sent and unchanged are skipped, and unchanged but unsent payslips are sent without
+    being rendered again.
+    combined_pdf and zip_archive add one multi-page PDF and one ZIP of every slip
+    per period (see pdf_generator.BulkPayslipWriter); with in_memory and no archive
+    they replace the individual files.
+    progress(result) is called from a sender thread as each employee is finished, and
+    setting cancel (a threading.Event) stops the run cleanly: no new slips are rendered,
+    queued ones are not sent, and everything already written is kept and closed.
+    Returns one result dict per employee reached, in input order.
+    """
+    in_memory = config.PDF_IN_MEMORY if in_memory is None else in_memory
+    archive = config.ARCHIVE_PAYSLIPS if archive is None else archive
+    resume = config.RESUMABLE_RUNS if resume is None else resume
+    combined_pdf = config.COMBINED_PDF if combined_pdf is None else combined_pdf
+    zip_archive = config.ZIP_ARCHIVE if zip_archive is None else zip_archive
+    bulk = pdf_generator.BulkPayslipWriter(zip_archive, combined_pdf, engine=engine) if (combined_pdf or zip_archive) else None
+    delivery_manifest = manifest.DeliveryManifest() if resume else None
+    archiver = False
+    if in_memory:
+        archiver = pdf_generator.PayslipArchiver() if archive else None
+
+    render_workers = pdf_generator.resolve_render_workers(render_workers)
+    send_workers = send_workers or config.SEND_WORKERS
+    slip_queue = queue.Queue(maxsize=queue_size or config.PIPELINE_QUEUE_SIZE)
+
+    started = time.perf_counter()
+    results = {}
+    retries = retry_queue.RetryQueue(slip_queue.put, cancel) if send_fn is not None and config.SEND_RETRIES else None
+    dead_letters = retry_queue.DeadLetterLog() if send_fn is not None else None
+    # An AsyncSend needs a single thread feeding its event loop; plain send_fns get send_workers threads
+    send_stage, send_threads = (_async_send_stage, 1) if isinstance(send_fn, AsyncSend) else (_send_stage, send_workers)
+    senders = [threading.Thread(target=send_stage, args=(slip_queue, send_fn, results, delivery_manifest, progress, cancel,
+                                                         retries, dead_letters),
+                                daemon=True)
+               for _ in range(send_threads)]
+    for sender in senders:
+        sender.start()
+
+    try:
+        _render_stage(jobs, slip_queue, render_workers, engine, archiver, delivery_manifest, bulk, cancel)
+        slip_queue.join() # Every slip has been through a sender...
+        if retries is not None:
+            retries.join() # ...and so has every retry it needed
+    finally:
+        if retries is not None:
+            retries.close()
+        for _ in senders:
+            slip_queue.put(_END)
+        for sender in senders:
+            sender.join()
+        if archiver:
+            archiver.close()
+            for error in archiver.errors:
+                print(error)
+        if delivery_manifest is not None:
+            delivery_manifest.close()
+        if bulk is not None:
+            for bulk_path in bulk.close():
+                print(f"Wrote {bulk_path}")
+        if config.PDF_STORE:
+            pdf_generator.prune_payslip_store()
+        metrics.observe("pipeline_seconds", time.perf_counter() - started)
+    return [results[index] for index in sorted(results)]
+
+def summarize_results(results):
+    """Counts generated, sent and failed payslips and collects the failure messages."""
+    return {
+        "total": len(results),
+        "generated": sum(1 for result in results if result["rendered"]),
+        "sent": sum(1 for result in results if result["sent"]),
+        "skipped": sum(1 for result in results if result["skipped"]),
+        "cancelled": sum(1 for result in results if result["cancelled"]),
+        "failed": [result["error"] for result in results if result["error"]],
+        "dead_letter_files": sorted({result["dead_letter"] for result in results if result["dead_letter"]}),
+    }
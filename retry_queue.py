@@ -0,0 +1,207 @@
+# retry_queue.py
+"""
+Retries and dead letters for payslip delivery. A send that fails with a transient
+error (see email_sender.is_transient_error) waits in a RetryQueue for a jittered
+exponential backoff and is then handed back to the senders, so a throttled
+message never holds a sender thread while the others carry on.
+
+Permanent failures, and transient ones that used up SEND_RETRIES, are appended to
+dead_letters.jsonl in their Payslips_<Mon_YYYY> folder. resend_dead_letters sends
+them again in a later run, without the workbook.
+"""
+import datetime
+import heapq
+import itertools
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import pandas as pd
+import config
+import email_sender
+import manifest
+import metrics
+from pdf_generator import employee_output_dir
+
+DEAD_LETTER_NAME = "dead_letters.jsonl"
+DEAD_LETTER_PDFS = "dead_letters" # Folder for in-memory payslips that were never archived
+CANCEL_POLL_SECONDS = 0.5
+
+def backoff_delay(attempt, base=None, cap=None):
+    """Seconds to wait before retry number `attempt` (1, 2, ...): half the exponential backoff, plus up to half again at random."""
+    base = config.RETRY_BASE_SECONDS if base is None else base
+    cap = config.RETRY_MAX_SECONDS if cap is None else cap
+    delay = min(cap, base * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2) # The jitter keeps throttled senders from retrying in lockstep
+
+class RetryQueue:
+    """
+    Holds failed sends until their backoff has passed, then calls release(item) from
+    its own timer thread. Every released item must be reported with done() once it
+    has been dealt with (sent, failed or scheduled again), and join() waits until
+    nothing is waiting or in progress. Once cancel (a threading.Event) is set,
+    waiting items are released at once.
+    """
+    def __init__(self, release, cancel=None):
+        self._release = release
+        self._cancel = cancel
+        self._waiting = []
+        self._order = itertools.count() # Tie-breaker, so items themselves are never compared
+        self._outstanding = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def schedule(self, item, delay):
+        with self._condition:
+            heapq.heappush(self._waiting, (time.monotonic() + delay, next(self._order), item))
+            self._outstanding += 1
+            self._condition.notify_all()
+
+    def done(self):
+        with self._condition:
+            self._outstanding -= 1
+            self._condition.notify_all()
+
+    def join(self):
+        with self._condition:
+            while self._outstanding:
+                self._condition.wait()
+
+    def _next_due(self):
+        """Blocks until an item is due and pops it; returns None once closed."""
+        with self._condition:
+            while not self._closed:
+                if not self._waiting:
+                    self._condition.wait()
+                    continue
+                if self._cancel is not None and self._cancel.is_set():
+                    break
+                wait = self._waiting[0][0] - time.monotonic()
+                if wait <= 0:
+                    break
+                self._condition.wait(min(wait, CANCEL_POLL_SECONDS))
+            if self._closed:
+                return None
+            return heapq.heappop(self._waiting)[2]
+
+    def _run(self):
+        while True:
+            item = self._next_due()
+            if item is None:
+                return
+            self._release(item) # Outside the lock: may block while the senders are busy
+
+    def close(self):
+        """Stops the timer thread; items still waiting are dropped."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+class DeadLetterLog:
+    """
+    Appends payslips that could not be delivered to dead_letters.jsonl in their
+    period folder, one JSON object per line, with what is needed to send them again:
+    name, email (which may be corrected by hand), period, PDF, error and whether
+    the error was transient or permanent. Safe to share between sender threads.
+    """
+    def __init__(self):
+        self.paths = set()
+        self._lock = threading.Lock()
+
+    def add(self, employee_row, result, kind):
+        """Records one undelivered payslip and returns the dead-letter file it went to."""
+        output_dir = employee_output_dir(employee_row)
+        pdf_path = result["pdf_path"]
+        with self._lock:
+            output_dir.mkdir(parents=True, exist_ok=True)
+            if pdf_path is None and result["pdf_bytes"] is not None:
+                pdf_path = output_dir / DEAD_LETTER_PDFS / result["pdf_name"]
+                pdf_path.parent.mkdir(exist_ok=True)
+                pdf_path.write_bytes(result["pdf_bytes"])
+            entry = {
+                "employee_key": manifest.employee_key(employee_row),
+                "employee_name": result["employee_name"],
+                "email": result["employee_email"],
+                "period": pd.Timestamp(employee_row['Period']).date().isoformat(),
+                "pdf_path": str(Path(pdf_path).resolve()) if pdf_path else None,
+                "kind": kind,
+                "attempts": result["attempts"],
+                "error": result["error"],
+                "failed_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            }
+            dead_letter_path = output_dir / DEAD_LETTER_NAME
+            with open(dead_letter_path, "a", encoding="utf-8") as dead_letter_file:
+                dead_letter_file.write(json.dumps(entry) + "\n")
+            self.paths.add(dead_letter_path)
+        return dead_letter_path
+
+def find_dead_letters(paths):
+    """Returns the dead-letter files given directly, or found anywhere under the given folders."""
+    found = []
+    for path in map(Path, paths):
+        candidates = sorted(path.rglob(DEAD_LETTER_NAME)) if path.is_dir() else [path]
+        found += [candidate for candidate in candidates if candidate not in found]
+    return found
+
+def _resend_entry(server, sender_email, entry):
+    """Sends one dead-letter entry, retrying transient errors with backoff. Returns the error, or None once sent."""
+    for attempt in itertools.count(1):
+        try:
+            if not entry.get("pdf_path"):
+                raise ValueError(f"No payslip PDF recorded for {entry['employee_name']}")
+            email_sender.deliver_payslip(server, sender_email, entry["email"], entry["employee_name"],
+                                         datetime.date.fromisoformat(entry["period"]), pdf_path=Path(entry["pdf_path"]))
+            return None
+        except Exception as e:
+            error = f"Failed to send payslip to {entry.get('email')}: {e}"
+            if not email_sender.is_transient_error(e) or attempt > config.SEND_RETRIES:
+                metrics.count("send_errors")
+                print(error)
+                entry.update(kind="transient" if email_sender.is_transient_error(e) else "permanent", error=error,
+                             attempts=entry.get("attempts", 0) + attempt,
+                             failed_at=datetime.datetime.now().isoformat(timespec="seconds"))
+                return error
+            metrics.count("send_retries")
+            time.sleep(backoff_delay(attempt))
+
+def resend_dead_letters(dead_letter_path, server, sender_email, workers=None):
+    """
+    Sends every payslip in a dead-letter file again over `server`. Delivered ones are
+    removed from the file and marked sent in the period's manifest; the rest stay,
+    with their new error. Entries the manifest already shows as sent (e.g. by
+    re-running the workbook) are dropped without sending, and entries without an
+    email address are kept in the file untouched until one is filled in.
+    Returns {"sent": n, "already_sent": n, "no_address": n, "failed": [error, ...]}.
+    """
+    dead_letter_path = Path(dead_letter_path)
+    output_dir = dead_letter_path.parent
+    with open(dead_letter_path, encoding="utf-8") as dead_letter_file:
+        entries = [json.loads(line) for line in dead_letter_file if line.strip()]
+    # A payslip that failed again in a later run is listed again; only its latest entry counts
+    entries = list({entry["employee_key"]: entry for entry in entries}.values())
+
+    pending = [entry for entry in entries if manifest.send_status(output_dir, entry["employee_key"]) != "sent"]
+    already_sent = len(entries) - len(pending)
+    no_address = [entry for entry in pending if not entry.get("email") or entry["email"] == "N/A"]
+    if no_address:
+        print(f"Skipping {len(no_address)} payslips with no email address in {dead_letter_path}; fill in their 'email' field to resend them.")
+        pending = [entry for entry in pending if entry not in no_address]
+    with ThreadPoolExecutor(max_workers=workers or config.SEND_WORKERS) as senders:
+        errors = list(senders.map(lambda entry: _resend_entry(server, sender_email, entry), pending))
+    for entry, error in zip(pending, errors):
+        if error is None:
+            manifest.mark_sent(output_dir, entry["employee_key"])
+
+    remaining = no_address + [entry for entry, error in zip(pending, errors) if error is not None]
+    tmp_path = dead_letter_path.with_suffix(".tmp")
+    tmp_path.write_text("".join(json.dumps(entry) + "\n" for entry in remaining), encoding="utf-8")
+    tmp_path.replace(dead_letter_path)
+    if not remaining:
+        dead_letter_path.unlink()
+    return {"sent": errors.count(None), "already_sent": already_sent, "no_address": len(no_address),
+            "failed": [error for error in errors if error is not None]}
@@ -0,0 +1,72 @@
+# test_async_email_sender.py
+"""The asyncio backend against benchmark's null SMTP sink: more messages in flight than SEND_WORKERS, and (ok, message) results."""
+import datetime
+import queue
+import sys
+import threading
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pandas as pd
+import benchmark
+import config
+import email_sender
+import pipeline
+from email_config import SMTP_SERVERS
+
+PERIOD = datetime.date(2025, 4, 1)
+
+def slip(i):
+    employee_row = pd.Series({"Employee_Name": f"Employee {i}", "Employee_Email": f"employee{i}@example.com", "Period": PERIOD})
+    result = pipeline._new_result(employee_row)
+    result.update(rendered=True, pdf_bytes=b"%PDF-1.4 test", pdf_name=f"payslip{i}.pdf")
+    return i, employee_row, result
+
+class AsyncSMTPPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.sink = benchmark.NullSMTPServer(reply_delay=0.2).__enter__()
+        self.addCleanup(self.sink.__exit__, None, None, None)
+        self.addCleanup(SMTP_SERVERS.pop, "test_sink", None)
+        SMTP_SERVERS["test_sink"] = {**SMTP_SERVERS["local"], "port": self.sink.port}
+        for name, value in (("SEND_WORKERS", 2), ("ASYNC_MAX_IN_FLIGHT", 8)):
+            self.addCleanup(setattr, config, name, getattr(config, name))
+            setattr(config, name, value)
+        self.pool = email_sender.connect_pool("payroll@localhost", None, config.SEND_WORKERS, provider="test_sink", backend="asyncio")
+        self.assertIsNotNone(self.pool)
+        self.addCleanup(self.pool.quit)
+
+    def test_send_stage_keeps_more_messages_in_flight_than_send_workers(self):
+        send_fn = pipeline.email_send_fn(self.pool, "payroll@localhost")
+        self.assertIsInstance(send_fn, pipeline.AsyncSend)
+        slip_queue, results = queue.Queue(), {}
+        sender = threading.Thread(target=pipeline._async_send_stage, args=(slip_queue, send_fn, results))
+        sender.start()
+        for i in range(16):
+            slip_queue.put(slip(i))
+        slip_queue.join()
+        slip_queue.put(pipeline._END)
+        sender.join()
+        self.assertEqual(self.sink.messages, 16)
+        self.assertTrue(all(result["sent"] for result in results.values()))
+        self.assertGreater(self.sink.peak_in_flight, config.SEND_WORKERS)
+        self.assertLessEqual(self.sink.peak_in_flight, config.ASYNC_MAX_IN_FLIGHT)
+
+    def test_send_payslips_returns_ok_and_message_per_recipient(self):
+        payslips = [{"recipient_email": f"employee{i}@example.com", "employee_name": f"Employee {i}", "period": PERIOD,
+                     "pdf_bytes": b"%PDF-1.4 test", "pdf_name": "payslip.pdf"} for i in range(10)]
+        sent = self.pool.send_payslips("payroll@localhost", payslips)
+        self.assertEqual(set(sent), {payslip["recipient_email"] for payslip in payslips})
+        self.assertTrue(all(ok and message == "Email sent successfully!" for ok, message in sent.values()))
+        self.assertGreater(self.sink.peak_in_flight, config.SEND_WORKERS)
+
+    def test_send_single_email_async_reports_failures(self):
+        # No PDF to attach: the send must fail, not raise
+        ok, message = self.pool.submit(self.pool.send_single_email_async(
+            "payroll@localhost", "employee@example.com", "Employee", PERIOD)).result()
+        self.assertFalse(ok)
+        self.assertIn("employee@example.com", message)
+
+if __name__ == "__main__":
+    unittest.main()
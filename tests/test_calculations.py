@@ -0,0 +1,123 @@
+# test_calculations.py
+"""calculate_salary_batch against the original per-row formulas, rounded exactly like round(x, 2), amounts in words against num2words, and the payroll rules' checks and slab lookups."""
+import random
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+import pandas as pd
+from num2words import num2words
+import calculations
+from config import EPF_RATE, PROF_TAX
+
+EARNINGS = {
+    'basic'             : {'rate': 0.50, 'of': 'gross'},
+    'hra'               : {'rate': 0.40, 'of': 'basic'},
+    'special_allowance' : {'rate': 0.30, 'of': 'gross'},
+}
+EPF = {'rate': EPF_RATE, 'of': 'basic', 'wage_ceiling': None}
+
+def original_salary(gross, income_tax):
+    """The per-row formulas calculate_salary used before the rules were vectorized."""
+    basic = 0.50 * gross
+    epf = round(basic * EPF_RATE, 2)
+    total_ded = epf + income_tax + PROF_TAX
+    return {"basic": basic, "hra": 0.40 * basic, "special_allowance": 0.30 * gross, "gross": gross,
+            "epf": epf, "income_tax": income_tax, "prof_tax": PROF_TAX, "total_ded": total_ded, "net": gross - total_ded}
+
+class SalaryBatchTest(unittest.TestCase):
+    def setUp(self):
+        # The shipped rules, so a site's payroll_config.py does not change what is tested
+        self.addCleanup(setattr, calculations, "_payroll_rules", calculations._payroll_rules)
+        calculations._payroll_rules = calculations.compile_payroll_rules(EARNINGS, EPF, {'default': [(0, PROF_TAX)]})
+
+    def test_round2_matches_builtin_round(self):
+        rng = random.Random(0)
+        # Half-paisa values are where np.round and round(x, 2) disagree
+        values = [rng.randint(100, 10**7) / 100 * 0.5 * EPF_RATE for _ in range(50000)] + [0.125, 1.005, 2.675, 1402.035]
+        rounded = calculations._round2(np.array(values))
+        self.assertEqual(rounded.tolist(), [round(value, 2) for value in values])
+
+    def test_batch_matches_original_formulas(self):
+        rng = random.Random(1)
+        gross = [23367.25, 3117.25, 91069.25, 543.25] + [rng.randint(100, 10**7) / 100 for _ in range(2000)]
+        income_tax = [rng.choice([0.0, 1250.0, 3333.33]) for _ in gross]
+        employee_df = pd.DataFrame({"Gross_Salary": gross, "Income_Tax": income_tax})
+        salaries = calculations.calculate_salary_batch(employee_df)
+        for (index, row), expected in zip(salaries.iterrows(), map(original_salary, gross, income_tax)):
+            self.assertEqual({key: row[key] for key in expected}, expected, f"row {index}")
+
+    def test_batch_row_matches_calculate_salary(self):
+        employee_df = pd.DataFrame({"Gross_Salary": [23367.25, 50000.0], "Income_Tax": [0.0, 1250.0]}, index=[7, 9])
+        salaries = calculations.calculate_salary_batch(employee_df)
+        for index, employee_row in employee_df.iterrows():
+            self.assertEqual(salaries.loc[index].to_dict(), calculations.calculate_salary(employee_row))
+
+def original_words(num):
+    """convert_to_inr_words as it was, spelling through num2words."""
+    rupees = int(num)
+    paise = round((num - rupees) * 100)
+    words = f"{num2words(rupees, lang='en_IN')} rupees" if rupees > 0 else ""
+    if paise > 0:
+        paise_words = num2words(paise, lang='en_IN')
+        words = f"{words} and {paise_words} paise" if words else f"{paise_words} paise"
+    return words.title() + " Only" if words else "Zero Rupees Only"
+
+class AmountWordsTest(unittest.TestCase):
+    def test_number_to_words_matches_num2words(self):
+        rng = random.Random(2)
+        numbers = list(range(2000)) + [rng.randrange(10**digits) for digits in range(4, 11) for _ in range(500)]
+        # Every group boundary, up to the largest number num2words spells in en_IN
+        numbers += [base * scale + offset for base in (1, 10, 99) for scale in (10**3, 10**5, 10**7)
+                    for offset in (-1, 0, 1, 100)] + [10**10 - 1]
+        for n in numbers:
+            self.assertEqual(calculations.number_to_words_en_in(n), num2words(n, lang='en_IN'), n)
+
+    def test_batch_words_match_original(self):
+        rng = random.Random(3)
+        amounts = [0.0, 0.5, 0.07, 1.0, 100000.0, 12345678.9] + [rng.randint(0, 10**9) / 100 for _ in range(2000)]
+        self.assertEqual(calculations.convert_to_inr_words_batch(amounts), [original_words(amount) for amount in amounts])
+
+class PayrollRulesTest(unittest.TestCase):
+    SLABS = {'default': [(0, PROF_TAX)], 'Maharashtra': [(0, 0), (7500, 175), (10000, 200)]}
+
+    def assertRejected(self, message, earnings=EARNINGS, epf=EPF, slabs=SLABS, grade_overrides=None):
+        with self.assertRaises(ValueError) as raised:
+            calculations.compile_payroll_rules(earnings, epf, slabs, 'State', 'Grade', grade_overrides)
+        self.assertIn(message, str(raised.exception))
+
+    def test_bad_rules_are_rejected(self):
+        self.assertRejected("must define hra", earnings={k: v for k, v in EARNINGS.items() if k != 'hra'})
+        self.assertRejected("EARNINGS['basic'] rate must be a non-negative number",
+                            earnings={**EARNINGS, 'basic': {'rate': -0.5, 'of': 'gross'}})
+        self.assertRejected("EARNINGS['basic'] must be a share of one of gross",
+                            earnings={'basic': {'rate': 0.5, 'of': 'hra'}, **{k: v for k, v in EARNINGS.items() if k != 'basic'}})
+        self.assertRejected("EPF must be a share of one of", epf={**EPF, 'of': 'net'})
+        self.assertRejected("EPF wage_ceiling must be a non-negative number", epf={**EPF, 'wage_ceiling': "15000"})
+        self.assertRejected("must have a 'default' entry", slabs={'Karnataka': [(0, 200)]})
+        self.assertRejected("PROF_TAX_SLABS['Kerala'] must start at 0", slabs={**self.SLABS, 'Kerala': [(100, 0)]})
+        self.assertRejected("slabs must be in ascending order", slabs={**self.SLABS, 'Kerala': [(0, 0), (9000, 100), (9000, 200)]})
+        self.assertRejected("PROF_TAX_SLABS['Kerala'] has no slabs", slabs={**self.SLABS, 'Kerala': []})
+        self.assertRejected("overrides unknown rule 'bonus'", grade_overrides={'M1': {'bonus': {'rate': 0.1}}})
+        self.assertRejected("can only change rate or wage_ceiling, not 'of'", grade_overrides={'M1': {'epf': {'of': 'gross'}}})
+
+    def test_prof_tax_slab_lookup(self):
+        evaluate = calculations.compile_payroll_rules(EARNINGS, EPF, self.SLABS, 'State')
+        gross = np.array([5000.0, 7499.99, 7500.0, 9999.99, 10000.0, 50000.0, 5000.0, 5000.0, 5000.0])
+        # States match case- and space-insensitively; unknown and blank states use 'default'
+        states = ['Maharashtra'] * 6 + [' maharashtra ', 'Goa', None]
+        amounts = evaluate(pd.DataFrame({'State': states}), gross)
+        self.assertEqual(amounts['prof_tax'].tolist(), [0, 0, 175, 175, 200, 200, 0, PROF_TAX, PROF_TAX])
+
+    def test_grade_overrides_and_wage_ceiling(self):
+        evaluate = calculations.compile_payroll_rules(EARNINGS, {**EPF, 'wage_ceiling': 15000}, self.SLABS, 'State', 'Grade',
+                                                      {'M1': {'basic': {'rate': 0.40}, 'epf': {'wage_ceiling': None}}})
+        amounts = evaluate(pd.DataFrame({'Grade': ['M1', 'm1', 'E2']}), np.array([100000.0, 100000.0, 100000.0]))
+        self.assertEqual(amounts['basic'].tolist(), [40000.0, 40000.0, 50000.0])
+        self.assertEqual(amounts['epf'].tolist(), [round(40000 * EPF_RATE, 2)] * 2 + [round(15000 * EPF_RATE, 2)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+# test_data_handler.py
+"""The validation report: invalid rows are reported by the row number Excel shows, loaded whole or streamed."""
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from openpyxl import load_workbook
+import benchmark
+import config
+import data_handler
+
+FIRST_DATA_ROW = data_handler.HEADER_ROW + 2 # Excel row of the first employee
+
+class ValidationReportTest(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(setattr, config, "USE_INPUT_CACHE", config.USE_INPUT_CACHE)
+        config.USE_INPUT_CACHE = False
+        workdir = tempfile.TemporaryDirectory(prefix="paygen_test_")
+        self.addCleanup(workdir.cleanup)
+        self.workbook = Path(workdir.name) / "employees.xlsx"
+        benchmark.write_synthetic_workbook(self.workbook, 6)
+        workbook = load_workbook(self.workbook)
+        sheet = workbook.active
+        header = [cell.value for cell in sheet[data_handler.HEADER_ROW + 1]]
+        column = lambda field: header.index(benchmark.COLUMN_MAP[field][0]) + 1
+        sheet.cell(FIRST_DATA_ROW + 1, column('Gross_Salary')).value = None
+        sheet.cell(FIRST_DATA_ROW + 3, column('Employee_Email')).value = "not-an-address"
+        for cell in sheet[FIRST_DATA_ROW + 4]: # A blank row between filled ones
+            cell.value = None
+        self.bad_name = sheet.cell(FIRST_DATA_ROW + 1, column('Employee_Name')).value
+        workbook.save(self.workbook)
+
+    def test_excel_row(self):
+        self.assertEqual(data_handler._excel_row(0), FIRST_DATA_ROW)
+        self.assertEqual(data_handler._excel_row(7), FIRST_DATA_ROW + 7)
+
+    def test_loaded_sheet_reports_excel_rows(self):
+        _, invalid_rows = data_handler.normalize_employee_data(data_handler.load_employee_data(self.workbook))
+        self.assertEqual([entry["excel_row"] for entry in invalid_rows], [FIRST_DATA_ROW + 1, FIRST_DATA_ROW + 3, FIRST_DATA_ROW + 4])
+        report = data_handler.format_invalid_rows(invalid_rows)
+        self.assertEqual(report[0], f"Row {FIRST_DATA_ROW + 1} ({self.bad_name}): Gross_Salary is missing")
+        self.assertIn("Employee_Email 'not-an-address' is not a valid address", report[1])
+        self.assertTrue(report[2].startswith(f"Row {FIRST_DATA_ROW + 4} (no name): "))
+
+    def test_stream_reports_the_same_rows(self):
+        _, loaded = data_handler.normalize_employee_data(data_handler.load_employee_data(self.workbook))
+        stream = data_handler.EmployeeStream(self.workbook, chunk_rows=2)
+        self.addCleanup(stream.close)
+        streamed, seen_keys = [], {}
+        for chunk in stream:
+            streamed += data_handler.normalize_employee_data(chunk, seen_keys)[1]
+        self.assertEqual(data_handler.format_invalid_rows(streamed), data_handler.format_invalid_rows(loaded))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+# test_email_sender.py
+"""SMTPConnectionPool against benchmark's null SMTP sink: session reuse and the max_per_minute throttle."""
+import datetime
+import sys
+import threading
+import time
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import benchmark
+import email_sender
+from email_config import SMTP_SERVERS
+
+PERIOD = datetime.date(2025, 4, 1)
+
+class SMTPConnectionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.sink = benchmark.NullSMTPServer().__enter__()
+        self.addCleanup(self.sink.__exit__, None, None, None)
+        self.addCleanup(SMTP_SERVERS.pop, "test_sink", None)
+
+    def open_pool(self, size, max_per_minute=0):
+        SMTP_SERVERS["test_sink"] = {**SMTP_SERVERS["local"], "port": self.sink.port, "max_per_minute": max_per_minute}
+        pool = email_sender.connect_pool("payroll@localhost", None, size, provider="test_sink", backend="threads")
+        self.assertIsNotNone(pool)
+        self.addCleanup(pool.quit)
+        return pool
+
+    def send(self, pool, count):
+        for i in range(count):
+            email_sender.deliver_payslip(pool, "payroll@localhost", f"employee{i}@example.com", f"Employee {i}", PERIOD,
+                                         pdf_bytes=b"%PDF-1.4 test", pdf_name="payslip.pdf")
+
+    def test_sessions_are_reused(self):
+        pool = self.open_pool(size=2)
+        senders = [threading.Thread(target=self.send, args=(pool, 5)) for _ in range(3)]
+        for sender in senders:
+            sender.start()
+        for sender in senders:
+            sender.join()
+        self.assertEqual(self.sink.messages, 15)
+        self.assertEqual(self.sink.connections, 2) # Only the sessions opened up front
+        self.assertEqual(pool.reconnects, 0)
+
+    def test_max_per_minute_spaces_messages(self):
+        pool = self.open_pool(size=2, max_per_minute=600) # One message every 0.1s
+        started = time.monotonic()
+        self.send(pool, 6)
+        elapsed = time.monotonic() - started
+        self.assertEqual(self.sink.messages, 6)
+        self.assertGreaterEqual(elapsed, 0.5) # The first message goes at once, the other five wait their slot
+
+    def test_unthrottled_pool_does_not_wait(self):
+        pool = self.open_pool(size=1)
+        started = time.monotonic()
+        self.send(pool, 6)
+        self.assertLess(time.monotonic() - started, 0.5)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+# test_resume.py
+"""Resumable runs: employees without an Employee_ID keep their manifest entry when rows are inserted above them."""
+import os
+import sys
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO))
+
+from openpyxl import load_workbook
+import batch
+import benchmark
+import config
+import data_handler
+import pdf_generator
+import pipeline
+
+FIRST_DATA_ROW = data_handler.HEADER_ROW + 2 # Excel row of the first employee
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(REPO) # The fonts are found relative to the working directory
+        workdir = tempfile.TemporaryDirectory(prefix="paygen_test_")
+        self.addCleanup(workdir.cleanup)
+        self.workdir = Path(workdir.name)
+        for name, value in (("OUTPUT_ROOT", str(self.workdir / "out")), ("USE_INPUT_CACHE", False), ("PDF_STORE", False),
+                            ("RESUMABLE_RUNS", True)):
+            self.addCleanup(setattr, config, name, getattr(config, name))
+            setattr(config, name, value)
+        pdf_generator.register_fonts()
+        self.workbook = self.workdir / "employees.xlsx"
+        benchmark.write_synthetic_workbook(self.workbook, 5)
+        def remove_ids(sheet, columns):
+            for row in range(FIRST_DATA_ROW, sheet.max_row + 1):
+                sheet.cell(row, columns['Employee_ID']).value = None
+        self.edit_sheet(remove_ids)
+
+    def edit_sheet(self, edit):
+        """Calls edit(sheet, columns) on the workbook, where columns maps each field to its column number."""
+        workbook = load_workbook(self.workbook)
+        sheet = workbook.active
+        header = [cell.value for cell in sheet[data_handler.HEADER_ROW + 1]]
+        edit(sheet, {field: header.index(names[0]) + 1 for field, names in benchmark.COLUMN_MAP.items() if names[0] in header})
+        workbook.save(self.workbook)
+
+    def run_workbook(self):
+        """Runs the workbook through the pipeline and returns the names of the employees emailed."""
+        employee_df, invalid_rows = data_handler.normalize_employee_data(data_handler.load_employee_data(self.workbook))
+        self.assertEqual(invalid_rows, [])
+        sent = []
+        send_fn = lambda employee_row, result: (sent.append(employee_row['Employee_Name']) or True, "sent")
+        pipeline.run_pipeline(batch.salary_jobs(employee_df), send_fn, render_workers=1, send_workers=1)
+        return sent
+
+    def test_inserted_row_does_not_resend_the_others(self):
+        self.assertEqual(len(self.run_workbook()), 5)
+
+        def insert_employee(sheet, columns):
+            row = [cell.value for cell in sheet[FIRST_DATA_ROW]]
+            sheet.insert_rows(FIRST_DATA_ROW)
+            for column, value in enumerate(row, start=1):
+                sheet.cell(FIRST_DATA_ROW, column).value = value
+            sheet.cell(FIRST_DATA_ROW, columns['Employee_Name']).value = "New Joiner"
+            sheet.cell(FIRST_DATA_ROW, columns['Employee_Email']).value = "new.joiner@example.com"
+        self.edit_sheet(insert_employee)
+
+        self.assertEqual(self.run_workbook(), ["New Joiner"])
+
+    def test_bulk_outputs_keep_input_order_when_resuming(self):
+        employee_df, _ = data_handler.normalize_employee_data(data_handler.load_employee_data(self.workbook))
+        pipeline.run_pipeline(batch.salary_jobs(employee_df), None, render_workers=1) # Rendered, never sent
+        # The first rows change and are rendered again in parallel; the others resume as "send" at once
+        employee_df.loc[employee_df.index[:2], 'Gross_Salary'] += 100
+        pipeline.run_pipeline(batch.salary_jobs(employee_df), lambda employee_row, result: (True, "sent"),
+                              render_workers=2, zip_archive=True)
+        period = employee_df['Period'].iloc[0]
+        with zipfile.ZipFile(pdf_generator.zip_archive_path(period)) as archive:
+            names = [Path(name).stem for name in archive.namelist()]
+        self.assertEqual(names, list(employee_df['Employee_Name']))
+
+    def test_duplicate_employees_are_invalid(self):
+        def duplicate_first(sheet, columns):
+            sheet.append([cell.value for cell in sheet[FIRST_DATA_ROW]])
+        self.edit_sheet(duplicate_first)
+        employee_df, invalid_rows = data_handler.normalize_employee_data(data_handler.load_employee_data(self.workbook))
+        self.assertEqual([entry["excel_row"] for entry in invalid_rows], [FIRST_DATA_ROW + 5])
+        self.assertIn(f"same as on row {FIRST_DATA_ROW}", invalid_rows[0]["reasons"][0])
+
+if __name__ == "__main__":
+    unittest.main()
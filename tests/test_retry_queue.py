@@ -0,0 +1,98 @@
+# test_retry_queue.py
+"""Retry classification and backoff, and payslips round-tripping through the dead-letter file."""
+import datetime
+import json
+import random
+import smtplib
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pandas as pd
+import config
+import email_sender
+import pipeline
+import retry_queue
+
+PERIOD = datetime.date(2025, 4, 1)
+
+class TransientErrorTest(unittest.TestCase):
+    def test_is_transient_error(self):
+        transient = [smtplib.SMTPResponseException(451, b"Try again later"), smtplib.SMTPServerDisconnected("gone"),
+                     smtplib.SMTPRecipientsRefused({"a@example.com": (452, b"Mailbox busy"), "b@example.com": (421, b"Busy")}),
+                     ConnectionResetError(), TimeoutError()]
+        permanent = [smtplib.SMTPResponseException(550, b"No such user"), smtplib.SMTPAuthenticationError(535, b"Bad login"),
+                     smtplib.SMTPRecipientsRefused({"a@example.com": (452, b"Mailbox busy"), "b@example.com": (550, b"No such user")}),
+                     ValueError("No payslip PDF"), FileNotFoundError()]
+        for error in transient:
+            self.assertTrue(email_sender.is_transient_error(error), repr(error))
+        for error in permanent:
+            self.assertFalse(email_sender.is_transient_error(error), repr(error))
+
+    def test_backoff_delay_bounds(self):
+        self.addCleanup(random.setstate, random.getstate())
+        random.seed(0)
+        for attempt in range(1, 10):
+            delay = min(60, 2 * 2 ** (attempt - 1))
+            for _ in range(200):
+                self.assertTrue(delay / 2 <= retry_queue.backoff_delay(attempt, base=2, cap=60) <= delay, attempt)
+
+class RecordingServer:
+    """Stands in for an SMTP session: records each message, and rejects addresses starting with 'bounce'."""
+    def __init__(self):
+        self.recipients = []
+
+    def send_message(self, msg):
+        if msg["To"].startswith("bounce"):
+            raise smtplib.SMTPResponseException(550, b"No such user")
+        self.recipients.append(msg["To"])
+
+class DeadLetterTest(unittest.TestCase):
+    def setUp(self):
+        workdir = tempfile.TemporaryDirectory(prefix="paygen_test_")
+        self.addCleanup(workdir.cleanup)
+        self.addCleanup(setattr, config, "OUTPUT_ROOT", config.OUTPUT_ROOT)
+        config.OUTPUT_ROOT = workdir.name
+        self.dead_letters = retry_queue.DeadLetterLog()
+
+    def add(self, employee_id, email, error="Failed to send"):
+        employee_row = pd.Series({"Employee_ID": employee_id, "Employee_Name": f"Employee {employee_id}",
+                                  "Employee_Email": email, "Period": PERIOD})
+        result = pipeline._new_result(employee_row)
+        result.update(pdf_bytes=b"%PDF-1.4 test", pdf_name=f"payslip_{employee_id}.pdf", attempts=3, error=error)
+        return self.dead_letters.add(employee_row, result, "transient")
+
+    def entries(self, path):
+        return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+    def test_resend_round_trip(self):
+        path = self.add("E1", "first@example.com", "stale error")
+        self.add("E1", "first@example.com") # A later failure of the same payslip replaces the earlier entry
+        self.add("E2", "N/A")
+        self.add("E3", "bounce@example.com")
+        self.assertEqual(self.dead_letters.paths, {path})
+        self.assertTrue(Path(self.entries(path)[0]["pdf_path"]).exists()) # In-memory payslips are written out
+
+        server = RecordingServer()
+        outcome = retry_queue.resend_dead_letters(path, server, "payroll@localhost", workers=2)
+        self.assertEqual(server.recipients, ["first@example.com"])
+        self.assertEqual({key: outcome[key] for key in ("sent", "already_sent", "no_address")},
+                         {"sent": 1, "already_sent": 0, "no_address": 1})
+        self.assertEqual(len(outcome["failed"]), 1)
+        remaining = {entry["employee_key"]: entry for entry in self.entries(path)}
+        self.assertEqual(set(remaining), {"E2", "E3"})
+        self.assertEqual((remaining["E3"]["kind"], remaining["E3"]["attempts"]), ("permanent", 4))
+
+        # Once every address is fixed, the file empties and is removed
+        for entry in remaining.values():
+            entry["email"] = f"{entry['employee_key'].lower()}@example.com"
+        path.write_text("".join(json.dumps(entry) + "\n" for entry in remaining.values()), encoding="utf-8")
+        outcome = retry_queue.resend_dead_letters(path, server, "payroll@localhost")
+        self.assertEqual((outcome["sent"], outcome["failed"]), (2, []))
+        self.assertFalse(path.exists())
+
+if __name__ == "__main__":
+    unittest.main()